@@ -0,0 +1,125 @@
+"""
+Preview how a new mob rule set would re-distribute the campaign before applying it
+
+Usage:
+    python Tests/mob_rules_diff.py candidate_rules.json videos.json
+    python Tests/mob_rules_diff.py candidate_rules.json got_milk_results.csv --apply
+
+videos can be a JSON list of processed video records or the "Export Results as CSV"
+download. With --apply the candidate replaces mob_rules.json once the diff is shown;
+the running app hot-reloads it within a few seconds.
+
+When MOB_ASSIGNMENT is "embedding" (the default), videos with a cached embedding
+are assigned the way retag_videos does it: the nearest mob anchor wins unless it's
+under MOB_EMBEDDING_MIN_SIMILARITY. That needs each rule set's anchors in
+cache/embeddings/mob_anchors.json; run Sync Embeddings after editing queries.
+"""
+
+import argparse
+import ast
+import csv
+import json
+import os
+import shutil
+import sys
+from collections import Counter
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import app
+
+
+def load_scenes(path):
+    """Read video ids and (activity, location, mood) for every video in a JSON or CSV export"""
+    if path.endswith('.csv'):
+        with open(path, newline='') as f:
+            records = list(csv.DictReader(f))
+    else:
+        with open(path, 'r') as f:
+            records = json.load(f)
+
+    video_ids = []
+    scenes = []
+    for record in records:
+        video_ids.append(record.get('video_id') or None)
+        activity_data = record.get('activity_data') or {}
+        if isinstance(activity_data, str):
+            # pandas writes the nested dict as its repr
+            activity_data = ast.literal_eval(activity_data)
+        scenes.append((
+            activity_data.get('activity', 'general'),
+            activity_data.get('location', 'unknown'),
+            activity_data.get('mood', 'casual')
+        ))
+    return video_ids, scenes
+
+
+def assign(table, scene):
+    """Look a scene up in a compiled rule table"""
+    assignment = table["lookup"].get(scene)
+    if assignment is None:
+        assignment = app.evaluate_mob_rules(table["rules"], *scene)
+    return assignment[0]
+
+
+def embedding_mobs(rules, video_ids, store, label):
+    """
+    Embedding mob per video for a rule set, None where rules apply. Warns and
+    returns None if the rule set's anchors aren't cached yet.
+    """
+    centroids = app.mob_centroids(rules)
+    if centroids is None:
+        print(f"⚠️ {label} mob anchors aren't cached, so embedding mobs can't be previewed; "
+              f"these counts are rules-only. Run Sync Embeddings with the rules installed.")
+        return None
+    ids = [video_id for video_id in video_ids if video_id]
+    mobs, _ = app.embedding_mob_column(ids, centroids=centroids, store=store)
+    found = dict(zip(ids, mobs))
+    return [found.get(video_id) for video_id in video_ids]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Diff mob distribution between two rule sets")
+    parser.add_argument("candidate", help="candidate rule file")
+    parser.add_argument("videos", help="JSON list of video records or results CSV export")
+    parser.add_argument("--current", default=app.MOB_RULES_PATH, help="rule file to compare against")
+    parser.add_argument("--apply", action="store_true", help="install the candidate as mob_rules.json")
+    args = parser.parse_args()
+
+    current = app.compile_mob_rules(app.load_mob_rules(args.current))
+    candidate = app.compile_mob_rules(app.load_mob_rules(args.candidate))
+    video_ids, scenes = load_scenes(args.videos)
+
+    old_overrides = new_overrides = None
+    if app.MOB_ASSIGNMENT_MODE == "embedding":
+        store = app.EmbeddingStore()
+        old_overrides = embedding_mobs(current["rules"], video_ids, store, "Current")
+        new_overrides = embedding_mobs(candidate["rules"], video_ids, store, "Candidate")
+
+    before = Counter()
+    after = Counter()
+    moves = Counter()
+    for i, scene in enumerate(scenes):
+        old_mob = (old_overrides and old_overrides[i]) or assign(current, scene)
+        new_mob = (new_overrides and new_overrides[i]) or assign(candidate, scene)
+        before[old_mob] += 1
+        after[new_mob] += 1
+        if old_mob != new_mob:
+            moves[(old_mob, new_mob)] += 1
+
+    print(f"📊 Mob distribution for {len(scenes)} videos")
+    print(f"{'Mob':<28}{'Current':>10}{'Candidate':>12}{'Change':>10}")
+    for mob in sorted(set(before) | set(after), key=lambda m: -after[m]):
+        change = after[mob] - before[mob]
+        print(f"{mob:<28}{before[mob]:>10}{after[mob]:>12}{change:>+10}")
+
+    print(f"\n🔀 {sum(moves.values())} videos would change mob")
+    for (old_mob, new_mob), count in moves.most_common():
+        print(f"  {count:>6}  {old_mob} → {new_mob}")
+
+    if args.apply:
+        shutil.copyfile(args.candidate, app.MOB_RULES_PATH)
+        print(f"\n✅ Installed {args.candidate} as {app.MOB_RULES_PATH}")
+
+
+if __name__ == "__main__":
+    main()
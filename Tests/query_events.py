@@ -0,0 +1,49 @@
+"""
+Search the processing event log, including rotated files
+
+Usage:
+    python Tests/query_events.py --since 2025-06-19 --status quarantined
+    python Tests/query_events.py --since 2025-06-19T09:00 --until 2025-06-19T17:00 --reason no_campaign_tags
+    python Tests/query_events.py --status approved --count
+
+Prints matching events as JSON lines (pipe into jq), oldest first.
+"""
+
+import argparse
+import json
+import os
+import sys
+from datetime import datetime
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import app
+
+
+def parse_time(value):
+    """ISO date/datetime to epoch seconds"""
+    return datetime.fromisoformat(value).timestamp() if value else None
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Query the processing event log")
+    parser.add_argument("--since", help="ISO date or datetime (inclusive)")
+    parser.add_argument("--until", help="ISO date or datetime (exclusive)")
+    parser.add_argument("--status", choices=["approved", "quarantined"])
+    parser.add_argument("--reason", help="quarantine reason, e.g. ai_detection_failed")
+    parser.add_argument("--count", action="store_true", help="print only the number of matches")
+    parser.add_argument("--path", default=app.EVENT_LOG_PATH, help="live log file (rotated files are found next to it)")
+    args = parser.parse_args()
+
+    log = app.EventLog(path=args.path, ring_size=0)
+    events = log.query(since=parse_time(args.since), until=parse_time(args.until),
+                       status=args.status, reason=args.reason)
+
+    if args.count:
+        print(sum(1 for _ in events))
+        return
+    for event in events:
+        print(json.dumps(event))
+
+
+if __name__ == "__main__":
+    main()
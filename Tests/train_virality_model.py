@@ -0,0 +1,99 @@
+"""
+Train the virality model from logged campaign outcomes
+
+Usage:
+    python Tests/train_virality_model.py got_milk_results.csv
+    python Tests/train_virality_model.py videos.json --ridge 2.0
+
+Fits a ridge regression from build_virality_features() to each post's
+metadata engagement_rate and writes models/virality_model.json. The running app
+picks the new file up on its next render and rescores the campaign in one batch.
+"""
+
+import argparse
+import ast
+import csv
+import json
+import os
+import sys
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import app
+
+NESTED_COLUMNS = ("metadata", "activity_data", "analysis_structured")
+
+
+def load_videos(path):
+    """Video records from a JSON list or the results CSV export"""
+    if not path.endswith('.csv'):
+        with open(path, 'r') as f:
+            return json.load(f)
+
+    with open(path, newline='') as f:
+        records = list(csv.DictReader(f))
+    for record in records:
+        # pandas writes nested dicts as their repr
+        for column in NESTED_COLUMNS:
+            if record.get(column):
+                record[column] = ast.literal_eval(record[column])
+        if record.get('confidence'):
+            record['confidence'] = float(record['confidence'])
+    return records
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Train the virality model")
+    parser.add_argument("videos", help="JSON list of video records or results CSV export")
+    parser.add_argument("--ridge", type=float, default=1.0, help="L2 regularization strength")
+    parser.add_argument("--output", default=app.VIRALITY_MODEL_PATH)
+    args = parser.parse_args()
+
+    videos = [v for v in load_videos(args.videos)
+              if isinstance(v.get('metadata'), dict) and v['metadata'].get('engagement_rate') is not None]
+    if len(videos) < 2:
+        sys.exit("❌ Need at least two videos with metadata engagement_rate to train")
+
+    features = app.build_virality_features(videos)
+    X = features.to_numpy(dtype=np.float64)
+    y = np.array([float(v['metadata']['engagement_rate']) for v in videos])
+
+    # Center so the bias isn't regularized, then solve the ridge normal equations
+    x_mean = X.mean(axis=0)
+    y_mean = y.mean()
+    Xc = X - x_mean
+    weights = np.linalg.solve(Xc.T @ Xc + args.ridge * np.eye(X.shape[1]), Xc.T @ (y - y_mean))
+    bias = y_mean - x_mean @ weights
+
+    predicted = X @ weights + bias
+    rmse = float(np.sqrt(np.mean((predicted - y) ** 2)))
+    baseline = float(np.sqrt(np.mean((y - y_mean) ** 2)))
+
+    model = {
+        "version": time.strftime("ridge-%Y%m%d%H%M%S"),
+        "trained_at": time.time(),
+        "samples": len(videos),
+        "ridge": args.ridge,
+        "features": list(features.columns),
+        "weights": weights.tolist(),
+        "bias": float(bias),
+        "target_mean": float(y_mean),
+        "target_std": float(y.std()) or 1.0,
+        "train_rmse": rmse
+    }
+    os.makedirs(os.path.dirname(args.output), exist_ok=True)
+    with open(args.output, 'w') as f:
+        json.dump(model, f, indent=2)
+
+    print(f"✅ Trained {model['version']} on {len(videos)} videos, {len(model['features'])} features")
+    print(f"   train RMSE {rmse:.2f} (predicting the mean: {baseline:.2f})")
+    top = np.argsort(-np.abs(weights))[:10]
+    for i in top:
+        print(f"   {model['features'][i]:<32}{weights[i]:+.3f}")
+    print(f"💾 Saved {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -11,11 +11,38 @@ from twelvelabs import TwelveLabs
 from twelvelabs.models.task import Task
 import time
 import json
-import glob
+import csv
+import io
+import zlib
+import shutil
+import tempfile
 import pandas as pd
+import numpy as np
+import plotly.graph_objects as go
+from plotly.subplots import make_subplots
 import logging
 import sys
 import re
+import select
+import struct
+import ctypes
+import ctypes.util
+try:
+    import fcntl
+except ImportError:  # Windows - file locks are process-local there
+    fcntl = None
+import uuid
+import hashlib
+import sqlite3
+import heapq
+import itertools
+import threading
+import contextvars
+import cProfile
+import atexit
+from collections import Counter, deque
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from contextlib import contextmanager
 from datetime import datetime
 
 # Load environment variables from .env file
@@ -33,6 +60,166 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+# Tracing ==========================================
+# Spans are written as Chrome trace "complete" events, one JSON object per line.
+# Load in Perfetto / chrome://tracing with: jq -s . logs/traces_YYYYMMDD.jsonl > trace.json
+# The day is taken at write time, so a long-running server rolls over to a new file.
+TRACE_SINK_PATTERN = os.path.join('logs', 'traces_{day}.jsonl')
+_current_span = contextvars.ContextVar('current_span', default=None)
+_trace_lock = threading.Lock()
+
+@contextmanager
+def trace_span(name, **attributes):
+    """Time a block as a span nested under the active span and yield its attributes dict"""
+    parent = _current_span.get()
+    span = {
+        "trace_id": parent["trace_id"] if parent else uuid.uuid4().hex,
+        "span_id": uuid.uuid4().hex[:16],
+        "parent_id": parent["span_id"] if parent else None,
+        "attributes": attributes
+    }
+    token = _current_span.set(span)
+    start = time.time()
+    status = "ok"
+    try:
+        yield span["attributes"]
+    except Exception as e:
+        status = "error"
+        attributes["error"] = str(e)
+        raise
+    finally:
+        end = time.time()
+        _current_span.reset(token)
+        _write_trace_event({
+            "name": name,
+            "cat": "got_milk",
+            "ph": "X",
+            "ts": int(start * 1_000_000),
+            "dur": int((end - start) * 1_000_000),
+            "pid": os.getpid(),
+            "tid": threading.get_ident(),
+            "args": {
+                "trace_id": span["trace_id"],
+                "span_id": span["span_id"],
+                "parent_id": span["parent_id"],
+                "status": status,
+                **span["attributes"]
+            }
+        })
+
+def trace_annotate(**attributes):
+    """Attach attributes to the active span (no-op outside a span)"""
+    span = _current_span.get()
+    if span:
+        span["attributes"].update(attributes)
+
+def _write_trace_event(event):
+    """Append one span to the current day's JSONL trace sink"""
+    try:
+        line = json.dumps(event, default=str)
+        with _trace_lock:
+            path = TRACE_SINK_PATTERN.format(day=datetime.now().strftime("%Y%m%d"))
+            with open(path, 'a') as f:
+                f.write(line + "\n")
+    except Exception as e:
+        logger.warning(f"Could not write trace span {event.get('name')}: {str(e)}")
+
+# Profiling ==========================================
+# Opt-in: GOT_MILK_PROFILE=1, ?profile=1 in the URL, or the sidebar toggle.
+# Each profiled run writes logs/profile_<label>_<time>.prof (cProfile, open with
+# snakeviz or pstats) and a matching .folded file (collapsed stacks for
+# flamegraph.pl / speedscope). Only one run is profiled at a time (Python allows a
+# single active cProfile per process); a concurrent run from another session is
+# skipped with a log line saying which run holds the profiler.
+PROFILE_ENV_VAR = "GOT_MILK_PROFILE"
+PROFILE_SAMPLE_INTERVAL = 0.005  # seconds between stack samples
+_profile_lock = threading.Lock()
+_profile_owner = {"thread": None, "label": None}
+
+def profiling_requested():
+    """Check whether the current run should be profiled"""
+    if os.getenv(PROFILE_ENV_VAR, "").lower() in ("1", "true", "yes"):
+        return True
+    try:
+        if st.query_params.get("profile") == "1":
+            return True
+        return bool(st.session_state.get("profile_enabled", False))
+    except Exception:
+        return False
+
+class StackSampler:
+    """Background thread that samples one thread's Python stack into collapsed-stack counts"""
+
+    def __init__(self, thread_id, interval=PROFILE_SAMPLE_INTERVAL):
+        self.thread_id = thread_id
+        self.interval = interval
+        self.counts = Counter()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="got-milk-sampler", daemon=True)
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+                frame = frame.f_back
+            if stack:
+                self.counts[";".join(reversed(stack))] += 1
+
+    def write_collapsed(self, path):
+        """Write "frame;frame;frame count" lines, the input format for flame graph tools"""
+        with open(path, 'w') as f:
+            for stack, count in self.counts.most_common():
+                f.write(f"{stack} {count}\n")
+
+@contextmanager
+def profile_run(label, enabled=None):
+    """Profile the wrapped block with cProfile plus a stack sampler and write both to logs/"""
+    if enabled is None:
+        enabled = profiling_requested()
+    if not enabled:
+        yield
+        return
+    if not _profile_lock.acquire(blocking=False):
+        # Profilers don't nest - an outer profiled run on this thread already covers
+        # this block, but a run on another thread means this one goes unprofiled
+        if _profile_owner["thread"] != threading.get_ident():
+            logger.warning(f"🔬 Skipped profiling {label}: {_profile_owner['label']} is already being profiled")
+        yield
+        return
+    _profile_owner.update(thread=threading.get_ident(), label=label)
+
+    safe_label = re.sub(r'[^A-Za-z0-9_.-]+', '_', label)
+    base_path = os.path.join('logs', f'profile_{safe_label}_{datetime.now().strftime("%Y%m%d_%H%M%S")}')
+    profiler = cProfile.Profile()
+    sampler = StackSampler(threading.get_ident())
+    sampler.start()
+    profiler.enable()
+    start = time.time()
+    try:
+        yield
+    finally:
+        profiler.disable()
+        sampler.stop()
+        try:
+            profiler.dump_stats(base_path + '.prof')
+            sampler.write_collapsed(base_path + '.folded')
+            logger.info(f"🔬 Profiled {label} in {time.time() - start:.2f}s -> {base_path}.prof / .folded")
+        except Exception as e:
+            logger.warning(f"Could not write profile for {label}: {str(e)}")
+        finally:
+            _profile_owner.update(thread=None, label=None)
+            _profile_lock.release()
+
 # Page configuration
 st.set_page_config(
     page_title="Got Milk? Campaign Manager",
@@ -104,25 +291,18 @@ def display_mob_gallery():
     """Display mob cards with colored backgrounds"""
     
     # Count videos per mob from session state
-    mob_counts = {}
-    for video in st.session_state.processed_videos:
-        mob = video.get('activity_mob', 'Unknown')
-        mob_counts[mob] = mob_counts.get(mob, 0) + 1
-    
-    # Define mob data with proper trending (only Gym and Comedy have trends)
-    mobs = [
-        ("Gym Warriors 💪", "Post-workout milk crew", mob_counts.get("Gym Warriors 💪", 0), "+12%", "error"),
-        ("Comedy Kings 😂", "Hilarious milk moments", mob_counts.get("Comedy Kings 😂", 0), "+8%", "info"),
-        ("Creative Collective 🎨", "Artistic milk expression", mob_counts.get("Creative Collective 🎨", 0), "0%", "warning"),
-        ("Kitchen Creators 👨‍🍳", "Culinary milk masters", mob_counts.get("Kitchen Creators 👨‍🍳", 0), "0%", "success"),
-        ("Home Chillers 🏠", "Cozy milk vibes", mob_counts.get("Home Chillers 🏠", 0), "0%", "info"),
-        ("Adventure Squad 🏞️", "Milk in the wild", mob_counts.get("Adventure Squad 🏞️", 0), "0%", "error")
-    ]
+    mob_counts = {mob or 'Unknown': count for mob, count in get_campaign_store().counts_by("activity_mob")}
+    
+    # Mobs come from the rule file, so adopted mobs show up here too
+    styles = ["error", "info", "warning", "success"]
+    mobs = [(rule["mob"], rule.get("description", ""), mob_counts.get(rule["mob"], 0), styles[idx % len(styles)])
+            for idx, rule in enumerate(get_mob_table()["rules"]["rules"])]
     
     # Create two columns
     col1, col2 = st.columns(2)
     
-    for idx, (name, desc, count, trend, style) in enumerate(mobs):
+    for idx, (name, desc, count, style) in enumerate(mobs):
+        trend = trend_label("mob", name)
         with col1 if idx % 2 == 0 else col2:
             # Create the colored box with info prominently displayed
             if style == "error":
@@ -130,114 +310,3369 @@ def display_mob_gallery():
                 ### {name}
                 *{desc}*
                 
-                **📊 Videos: {count}** 
+                **📊 Videos: {count}** {trend}
                 """)
             elif style == "info":
                 st.info(f"""
                 ### {name}
                 *{desc}*
                 
-                **📊 Videos: {count}** 
+                **📊 Videos: {count}** {trend}
                 """)
             elif style == "warning":
                 st.warning(f"""
                 ### {name}
                 *{desc}*
                 
-                **📊 Videos: {count}** 
+                **📊 Videos: {count}** {trend}
                 """)
             elif style == "success":
                 st.success(f"""
                 ### {name}
                 *{desc}*
                 
-                **📊 Videos: {count}**
+                **📊 Videos: {count}** {trend}
                 """)
             st.markdown("")  # Add spacing between cards
 
+    display_emerging_mobs()
+
+def display_emerging_mobs():
+    """Show mobs proposed by incremental clustering, with a button to adopt each"""
+    discovery = get_mob_discovery()
+    centroids = get_mob_centroids()
+    anchors = centroids[2] if centroids else None
+    rules = get_mob_table()["rules"]
+    existing = {rule["mob"] for rule in rules["rules"]}
+    proposals = [p for p in discovery.proposals(anchors, rules["default"]["mob"]) if p["mob"] not in existing]
+    if not proposals:
+        return
+
+    st.markdown("#### 🌱 Emerging Mobs")
+    st.caption("Dense clusters of videos that no current mob covers")
+    for proposal in proposals:
+        col1, col2 = st.columns([4, 1])
+        with col1:
+            st.markdown(f"**{proposal['mob']}** - *{proposal['description']}*")
+            st.caption(f"{proposal['members']} videos • density {proposal['density']:.2f}")
+        with col2:
+            if st.button("Adopt", key=f"adopt_mob_{proposal['cluster']}"):
+                adopt_mob_proposal(proposal)
+                st.success(f"Added {proposal['mob']} - Re-tag All to move videos into it")
+
 # END UI ADITTIONS ===============================================
-def extract_activity_data(analysis_text):
+
+# Keyword registry ===============================================
+# Every keyword the Pegasus heuristics look for lives here, in priority order
+# per category (first matching group wins). The whole registry is compiled once
+# into a single regex so one pass over the analysis text finds every hit, and
+# activity, location, mood, milk type, confidence and the quarantine reason are
+# all read from that same hit set.
+ACTIVITY_KEYWORDS = [
+    ("fitness", ["exercising", "gym", "working out"]),
+    ("dancing", ["dancing"]),
+    ("cooking", ["cooking", "pouring"]),
+    ("drinking", ["drinking"]),
+    ("posing", ["posing", "promotional"])
+]
+
+LOCATION_KEYWORDS = [
+    ("gym", ["gym"]),
+    ("kitchen", ["kitchen"]),
+    ("home", ["living room", "home"]),
+    ("outdoors", ["outdoor", "forest"]),
+    ("studio", ["studio"]),
+    ("bedroom", ["bedroom"]),
+    ("warehouse", ["warehouse"])
+]
+
+MOOD_KEYWORDS = [
+    ("funny", ["funny", "comedy", "light-hearted"]),
+    ("energetic", ["energetic", "playful"]),
+    ("artistic", ["artistic", "creative"]),
+    ("chill", ["chill", "relaxed"]),
+    ("promotional", ["promotional"])
+]
+
+MILK_TYPE_KEYWORDS = [
+    ("Chocolate", ["chocolate"]),
+    ("Strawberry", ["strawberry"]),
+    ("2% Regular", ["2%", "regular"])
+]
+
+# Quarantine reason when milk isn't found
+BEVERAGE_KEYWORDS = [
+    ("Water detected instead of milk", ["water"]),
+    ("Soda/carbonated beverage detected", ["soda", "coke", "cola"]),
+    ("Juice detected instead of milk", ["juice"])
+]
+
+MILK_PRESENCE_KEYWORDS = {
+    "affirmative": ["yes"],
+    "milk": ["milk", "dairy"]
+}
+
+CONFIDENCE_KEYWORDS = {
+    "strong_visual": ["clearly visible", "prominently", "definitely"],
+    "visual": ["visible", "can see"],
+    "container": ["bottle", "carton", "glass", "container"],
+    "label": ["label"],
+    "label_read": ["visible", "reads", "says"],
+    "audio": ["got milk", "saying"],
+    "uncertain": ["might", "possibly", "unclear", "hard to see"]
+}
+
+def _registry_keywords():
+    """Every keyword in the registry"""
+    keywords = set()
+    for rules in (ACTIVITY_KEYWORDS, LOCATION_KEYWORDS, MOOD_KEYWORDS, MILK_TYPE_KEYWORDS, BEVERAGE_KEYWORDS):
+        for _, words in rules:
+            keywords.update(words)
+    for groups in (MILK_PRESENCE_KEYWORDS, CONFIDENCE_KEYWORDS):
+        for words in groups.values():
+            keywords.update(words)
+    return keywords
+
+def _trie_regex(keywords):
+    """Build a regex that matches the longest keyword at a position, factored as a trie"""
+    trie = {}
+    for word in keywords:
+        node = trie
+        for char in word:
+            node = node.setdefault(char, {})
+        node[''] = True
+
+    def build(node):
+        branches = [re.escape(char) + build(child) for char, child in sorted(node.items()) if char != '']
+        if not branches:
+            return ''
+        body = branches[0] if len(branches) == 1 else '(?:' + '|'.join(branches) + ')'
+        # Greedy optional group: prefer the longer keyword, fall back to this one
+        return '(?:' + body + ')?' if '' in node else body
+
+    return build(trie)
+
+def compile_keyword_matcher(keywords):
+    """
+    Compile keywords into (pattern, prefixes). The pattern is a zero-width
+    lookahead so matches may overlap; it reports the longest keyword starting
+    at each position and prefixes maps that keyword to every registry keyword
+    it starts with. Together they reproduce `keyword in text` for all keywords.
+    """
+    pattern = re.compile('(?=(' + _trie_regex(keywords) + '))')
+    prefixes = {word: frozenset(k for k in keywords if word.startswith(k)) for word in keywords}
+    return pattern, prefixes
+
+_KEYWORD_PATTERN, _KEYWORD_PREFIXES = compile_keyword_matcher(_registry_keywords())
+
+def match_keywords(text):
+    """Return the set of registry keywords found in text, in a single pass"""
+    hits = set()
+    for match in _KEYWORD_PATTERN.finditer(text.lower()):
+        hits.update(_KEYWORD_PREFIXES[match.group(1)])
+    return hits
+
+def classify_keywords(hits, rules, default):
+    """Return the value of the first rule with a keyword in hits"""
+    for value, keywords in rules:
+        if any(keyword in hits for keyword in keywords):
+            return value
+    return default
+
+def classify_analysis(analysis_text):
+    """Derive every keyword-based signal from one scan of the Pegasus analysis"""
+    hits = match_keywords(analysis_text)
+    activity, location, mood = extract_activity_data(analysis_text, hits=hits)
+    milk_found = (any(k in hits for k in MILK_PRESENCE_KEYWORDS["affirmative"])
+                  and any(k in hits for k in MILK_PRESENCE_KEYWORDS["milk"]))
+    return {
+        "hits": hits,
+        "activity": activity,
+        "location": location,
+        "mood": mood,
+        "milk_found": milk_found,
+        "milk_type": classify_keywords(hits, MILK_TYPE_KEYWORDS, "Regular"),
+        "detected_content": classify_keywords(hits, BEVERAGE_KEYWORDS, "Unknown beverage")
+    }
+
+def extract_activity_data(analysis_text, hits=None):
     """Extract activity, location, and mood from Pegasus analysis"""
-    
-    # Initialize defaults
-    activity = "general"
-    location = "unknown"
-    mood = "casual"
-    
-    analysis_lower = analysis_text.lower()
-    
-    # Extract activity
-    if "exercising" in analysis_lower or "gym" in analysis_lower or "working out" in analysis_lower:
-        activity = "fitness"
-    elif "dancing" in analysis_lower:
-        activity = "dancing"
-    elif "cooking" in analysis_lower or "pouring" in analysis_lower:
-        activity = "cooking"
-    elif "drinking" in analysis_lower:
-        activity = "drinking"
-    elif "posing" in analysis_lower or "promotional" in analysis_lower:
-        activity = "posing"
-        
-    # Extract location
-    if "gym" in analysis_lower:
-        location = "gym"
-    elif "kitchen" in analysis_lower:
-        location = "kitchen"
-    elif "living room" in analysis_lower or "home" in analysis_lower:
-        location = "home"
-    elif "outdoor" in analysis_lower or "forest" in analysis_lower:
-        location = "outdoors"
-    elif "studio" in analysis_lower:
-        location = "studio"
-    elif "bedroom" in analysis_lower:
-        location = "bedroom"
-    elif "warehouse" in analysis_lower:
-        location = "warehouse"
-        
-    # Extract mood
-    if "funny" in analysis_lower or "comedy" in analysis_lower or "light-hearted" in analysis_lower:
-        mood = "funny"
-    elif "energetic" in analysis_lower or "playful" in analysis_lower:
-        mood = "energetic"
-    elif "artistic" in analysis_lower or "creative" in analysis_lower:
-        mood = "artistic"
-    elif "chill" in analysis_lower or "relaxed" in analysis_lower:
-        mood = "chill"
-    elif "promotional" in analysis_lower:
-        mood = "promotional"
-        
+    if hits is None:
+        hits = match_keywords(analysis_text)
+
+    activity = classify_keywords(hits, ACTIVITY_KEYWORDS, "general")
+    location = classify_keywords(hits, LOCATION_KEYWORDS, "unknown")
+    mood = classify_keywords(hits, MOOD_KEYWORDS, "casual")
+
     return activity, location, mood
 
+# Pegasus structured output ===============================================
+# Pegasus is asked for one JSON object. parse_pegasus_json() checks it against
+# PEGASUS_SCHEMA field by field. The PEGASUS_REQUIRED fields decide approval and
+# the milk type, so a response missing one or giving it the wrong type is
+# rejected; any other bad field is salvaged or set to None, so one off-schema
+# detail doesn't discard the rest. interpret_analysis() falls back to the
+# keyword/regex heuristics when the response is rejected or isn't JSON at all
+# (older analyses, or the model ignoring the format).
+PEGASUS_PROMPT_VERSION = "json-v2"
+
+PEGASUS_ANALYSIS_PROMPT = """Analyze this video and respond with ONLY a JSON object - no markdown, no commentary.
+Use exactly these fields:
+{
+  "milk_visible": true or false - is any milk visible in this video?,
+  "milk_type": "chocolate", "strawberry", "regular" or "none",
+  "activity": what the person is doing in one or two words (drinking, pouring, cooking, exercising, dancing, studying, etc.),
+  "location": where they are in one or two words (kitchen, gym, bedroom, outdoors, classroom, etc.),
+  "mood": the mood/style in one word (funny, serious, energetic, chill, artistic),
+  "people_count": number of people in the video as an integer,
+  "time_of_day": "morning", "afternoon", "evening", "night" or "unknown",
+  "first_sip_seconds": timestamp in seconds of the first sip or drink of milk, or null if nobody drinks,
+  "featured_seconds": timestamp in seconds when the milk is most prominently featured or held up, or null,
+  "audio_phrase_seconds": timestamp in seconds when anyone FIRST says "got milk", "got chocolate", "got strawberry", "got 2%" or the word "milk", or null,
+  "quote": exactly what the person says about milk, or null
+}
+
+Listen to the ENTIRE audio track. People often say "got [type] milk" when showing their milk."""
+
+# field -> (accepted types, allowed values or None, nullable)
+PEGASUS_SCHEMA = {
+    "milk_visible": ((bool,), None, False),
+    "milk_type": ((str,), {"chocolate", "strawberry", "regular", "none"}, False),
+    "activity": ((str,), None, False),
+    "location": ((str,), None, False),
+    "mood": ((str,), None, False),
+    "people_count": ((int,), None, False),
+    "time_of_day": ((str,), {"morning", "afternoon", "evening", "night", "unknown"}, False),
+    "first_sip_seconds": ((int, float), None, True),
+    "featured_seconds": ((int, float), None, True),
+    "audio_phrase_seconds": ((int, float), None, True),
+    "quote": ((str,), None, True)
+}
+
+# Fields a structured response can't be used without
+PEGASUS_REQUIRED = ("milk_visible", "milk_type")
+
+STRUCTURED_MILK_TYPES = {
+    "chocolate": "Chocolate",
+    "strawberry": "Strawberry",
+    "regular": "2% Regular",
+    "none": "Regular"
+}
+
+BOOLEAN_WORDS = {"true": True, "yes": True, "false": False, "no": False}
+
+def _salvage_pegasus_value(types, allowed, value):
+    """Best-effort reading of an off-schema value, or None if nothing usable is in it"""
+    if bool in types:
+        return BOOLEAN_WORDS.get(str(value).strip().lower()) if isinstance(value, str) else None
+    if allowed is not None and isinstance(value, str):
+        # "late evening" -> "evening", "chocolate milk" -> "chocolate"
+        words = set(re.findall(r"[a-z]+", value.lower()))
+        return next((option for option in sorted(allowed) if option in words), None)
+    if int in types and isinstance(value, str):
+        try:
+            value = float(value)
+        except ValueError:
+            return None
+        return value if value >= 0 else None
+    return None
+
+def validate_pegasus_fields(data):
+    """
+    Check a decoded Pegasus response against PEGASUS_SCHEMA. Returns (fields,
+    errors): fields has every schema field, with values that can't be read set
+    to None, and errors lists what was wrong (empty if the response was valid).
+    fields is None when a PEGASUS_REQUIRED field is missing, null, mistyped or
+    unreadable.
+    """
+    if not isinstance(data, dict):
+        return None, ["response is not a JSON object"]
+
+    # Field names and enum values are matched case-insensitively; free text keeps its case
+    data = {str(field).lower(): value for field, value in data.items()}
+    errors = [f"unexpected field '{field}'" for field in set(data) - set(PEGASUS_SCHEMA)]
+    fields = {}
+    rejected = False
+    for field, (types, allowed, nullable) in PEGASUS_SCHEMA.items():
+        value = data.get(field)
+        if allowed is not None and isinstance(value, str):
+            value = value.strip().lower()
+        required = field in PEGASUS_REQUIRED
+        if field not in data:
+            errors.append(f"missing field '{field}'")
+            rejected = rejected or required
+        elif value is None:
+            if not nullable:
+                errors.append(f"'{field}' may not be null")
+        # bool is a subclass of int - only accept it where bool is the declared type
+        elif isinstance(value, bool) and bool not in types:
+            errors.append(f"'{field}' has wrong type bool")
+            value = None
+        elif not isinstance(value, types):
+            errors.append(f"'{field}' has wrong type {type(value).__name__}")
+            value = None if required else _salvage_pegasus_value(types, allowed, value)
+        elif allowed is not None and value not in allowed:
+            errors.append(f"'{field}' has unexpected value {value!r}")
+            value = _salvage_pegasus_value(types, allowed, value)
+        elif isinstance(value, (int, float)) and not isinstance(value, bool) and value < 0:
+            errors.append(f"'{field}' may not be negative")
+            value = None
+        if required and value is None:
+            rejected = True
+        fields[field] = value
+    return (None if rejected else fields), errors
+
+def parse_pegasus_json(analysis_text):
+    """Parse a structured Pegasus response; returns the schema fields, or None if it isn't usable"""
+    if not analysis_text:
+        return None
+
+    # Tolerate a ```json fence or stray text around the object
+    start = analysis_text.find('{')
+    end = analysis_text.rfind('}')
+    if start == -1 or end <= start:
+        return None
+
+    try:
+        data = json.loads(analysis_text[start:end + 1])
+    except ValueError as e:
+        logger.info(f"Pegasus response is not valid JSON: {str(e)}")
+        return None
+
+    fields, errors = validate_pegasus_fields(data)
+    if fields is None:
+        logger.info(f"Pegasus JSON rejected, using the heuristics: {'; '.join(errors)}")
+    elif errors:
+        logger.info(f"Pegasus JSON is off-schema, using the readable fields: {'; '.join(errors)}")
+    return fields
+
+def structured_milk_moment(structured):
+    """Pick the milk moment from the structured timestamps (drinking, then audio, then display)"""
+    sip = structured.get("first_sip_seconds")
+    audio = structured.get("audio_phrase_seconds")
+    featured = structured.get("featured_seconds")
+
+    if sip is not None and audio is not None and abs(sip - audio) <= 2.0:
+        return float(sip), "both_audio_visual"
+    if sip is not None:
+        return float(sip), "visual_drinking"
+    if audio is not None:
+        return float(audio), "audio_milk_detected"
+    if featured is not None:
+        return float(featured), "visual_display"
+    return 3.0, "default"
+
+def interpret_analysis(analysis_text):
+    """
+    Turn a stored or fresh Pegasus response into every derived field.
+    Structured (JSON) responses are read directly, field by field, with the
+    defaults standing in for optional fields that were missing or unreadable;
+    rejected or unstructured responses go through the keyword matcher and
+    extract_milk_moment's regex heuristics.
+    """
+    result = classify_analysis(analysis_text)
+    structured = parse_pegasus_json(analysis_text)
+    result["structured"] = structured
+
+    if structured is None:
+        result["milk_moment"], result["moment_type"] = extract_milk_moment(analysis_text)
+        return result
+
+    result["milk_found"] = structured["milk_visible"]
+    result["milk_type"] = STRUCTURED_MILK_TYPES[structured["milk_type"]]
+    result["activity"] = classify_keywords(match_keywords(structured["activity"] or ""), ACTIVITY_KEYWORDS, "general")
+    result["location"] = classify_keywords(match_keywords(structured["location"] or ""), LOCATION_KEYWORDS, "unknown")
+    result["mood"] = classify_keywords(match_keywords(structured["mood"] or ""), MOOD_KEYWORDS, "casual")
+    result["milk_moment"], result["moment_type"] = structured_milk_moment(structured)
+    return result
+
+def request_pegasus_analysis(client, video_id):
+    """Run the structured Pegasus prompt on an indexed video and return the response text"""
+    with trace_span("pegasus_analyze", video_id=video_id, prompt_version=PEGASUS_PROMPT_VERSION) as span:
+        for attempt in range(PEGASUS_MAX_RETRIES + 1):
+            span["rate_limit_wait"] = round(pegasus_rate_limiter.acquire(), 3)
+            try:
+                analysis_result = client.analyze(
+                    video_id=video_id,
+                    prompt=PEGASUS_ANALYSIS_PROMPT,
+                    temperature=0.2  # Keep this for consistency!
+                )
+                break
+            except Exception as e:
+                # Back off and retry when the API says we're going too fast
+                if attempt == PEGASUS_MAX_RETRIES or not ("429" in str(e) or "rate limit" in str(e).lower()):
+                    raise
+                backoff = 2 ** attempt
+                logger.warning(f"⏳ Pegasus rate limited on {video_id}, retrying in {backoff}s")
+                time.sleep(backoff)
+        span["attempts"] = attempt + 1
+
+        # Get the analysis text (handle different attribute names)
+        # Original case, so quotes are stored as spoken; the matchers lowercase for themselves
+        if hasattr(analysis_result, 'data'):
+            analysis_text = str(analysis_result.data)
+        elif hasattr(analysis_result, 'content'):
+            analysis_text = str(analysis_result.content)
+        elif hasattr(analysis_result, 'text'):
+            analysis_text = str(analysis_result.text)
+        else:
+            analysis_text = str(analysis_result)
+        span["analysis_chars"] = len(analysis_text)
+    return analysis_text
+
+# Mob rules ===============================================
+# Activity mobs are defined as data in mob_rules.json: each rule has a priority
+# and a list of "when" clauses (field -> allowed values, all fields must match,
+# any clause may match). The rules are compiled into a dense table over every
+# (activity, location, mood) the classifiers can emit, so assignment is a single
+# lookup. The file is re-checked every few seconds and hot-reloaded when it changes.
+MOB_RULES_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'mob_rules.json')
+MOB_RULES_RELOAD_INTERVAL = 2.0  # seconds between mtime checks
+MOB_FIELDS = ("activity", "location", "mood")
+_mob_rules_lock = threading.Lock()
+_mob_rules = {"mtime": None, "checked": 0.0, "table": None}
+
+def load_mob_rules(path=MOB_RULES_PATH):
+    """Read and validate a mob rule set; raises ValueError if it's malformed"""
+    with open(path, 'r') as f:
+        rules = json.load(f)
+
+    if not isinstance(rules, dict) or not isinstance(rules.get("default"), dict) \
+            or not isinstance(rules["default"].get("mob"), str):
+        raise ValueError(f"{path}: needs a default mob")
+    if not isinstance(rules.get("rules"), list):
+        raise ValueError(f"{path}: 'rules' must be a list")
+
+    for i, rule in enumerate(rules["rules"]):
+        if not isinstance(rule, dict) or not isinstance(rule.get("mob"), str):
+            raise ValueError(f"{path}: rule {i} needs a mob name")
+        if not isinstance(rule.get("priority"), (int, float)) or isinstance(rule["priority"], bool):
+            raise ValueError(f"{path}: rule {i} ({rule['mob']}) needs a numeric priority")
+        if not isinstance(rule.get("query", ""), str):
+            raise ValueError(f"{path}: rule {i} ({rule['mob']}) query must be a string")
+        if not isinstance(rule.get("when"), list) or not rule["when"]:
+            raise ValueError(f"{path}: rule {i} ({rule['mob']}) needs at least one 'when' clause")
+        for clause in rule["when"]:
+            if not isinstance(clause, dict) or not clause or set(clause) - set(MOB_FIELDS):
+                raise ValueError(f"{path}: rule {i} ({rule['mob']}) clauses may only use {', '.join(MOB_FIELDS)}")
+            if not all(isinstance(v, list) and all(isinstance(x, str) for x in v) for v in clause.values()):
+                raise ValueError(f"{path}: rule {i} ({rule['mob']}) clause values must be lists of strings")
+    return rules
+
+def mob_field_values(rules):
+    """Every value each field can take: what the classifiers emit plus anything a rule names"""
+    values = {
+        "activity": [value for value, _ in ACTIVITY_KEYWORDS] + ["general"],
+        "location": [value for value, _ in LOCATION_KEYWORDS] + ["unknown"],
+        "mood": [value for value, _ in MOOD_KEYWORDS] + ["casual", "neutral"]
+    }
+    for rule in rules["rules"]:
+        for clause in rule["when"]:
+            for field, allowed in clause.items():
+                values[field] += [value for value in allowed if value not in values[field]]
+    return values
+
+def evaluate_mob_rules(rules, activity, location, mood):
+    """Highest-priority matching rule as (mob, description); file order breaks ties"""
+    scene = {"activity": activity, "location": location, "mood": mood}
+    for rule in sorted(rules["rules"], key=lambda r: -r["priority"]):
+        if any(all(scene[field] in allowed for field, allowed in clause.items()) for clause in rule["when"]):
+            return rule["mob"], rule.get("description", "")
+    return rules["default"]["mob"], rules["default"].get("description", "")
+
+def compile_mob_rules(rules):
+    """Evaluate a rule set once for every (activity, location, mood) combination"""
+    values = mob_field_values(rules)
+    lookup = {}
+    dense = np.empty([len(values[field]) for field in MOB_FIELDS], dtype=object)
+    for i, activity in enumerate(values["activity"]):
+        for j, location in enumerate(values["location"]):
+            for k, mood in enumerate(values["mood"]):
+                assignment = evaluate_mob_rules(rules, activity, location, mood)
+                lookup[(activity, location, mood)] = assignment
+                dense[i, j, k] = assignment[0]
+    return {"rules": rules, "values": values, "lookup": lookup, "dense": dense}
+
+def get_mob_table():
+    """Compiled mob rules, reloaded when mob_rules.json changes on disk"""
+    table = _mob_rules["table"]
+    now = time.time()
+    if table is not None and now - _mob_rules["checked"] < MOB_RULES_RELOAD_INTERVAL:
+        return table
+
+    with _mob_rules_lock:
+        _mob_rules["checked"] = now
+        try:
+            mtime = os.path.getmtime(MOB_RULES_PATH)
+            if mtime != _mob_rules["mtime"]:
+                _mob_rules["table"] = compile_mob_rules(load_mob_rules())
+                _mob_rules["mtime"] = mtime
+                logger.info(f"📜 Loaded mob rules v{_mob_rules['table']['rules'].get('version', '?')} "
+                            f"({len(_mob_rules['table']['lookup'])} combinations)")
+        except (OSError, ValueError) as e:
+            if _mob_rules["table"] is None:
+                raise
+            logger.error(f"Keeping previous mob rules - could not reload {MOB_RULES_PATH}: {str(e)}")
+        return _mob_rules["table"]
+
 def assign_activity_mob(activity, location, mood):
     """Assign to activity-based mob"""
-    
-    # Fitness focused
-    if activity == "fitness" or location == "gym":
-        return "Gym Warriors 💪", "Post-workout milk crew"
-    
-    # Comedy focused
-    elif mood == "funny":
-        return "Comedy Kings 😂", "Hilarious milk moments"
-    
-    # Creative/Artistic
-    elif mood == "artistic" or location == "studio" or activity == "dancing":
-        return "Creative Collective 🎨", "Artistic milk expression"
-    
-    # Outdoor adventures
-    elif location == "outdoors":
-        return "Adventure Squad 🏞️", "Milk in the wild"
-    
-    # Home/Casual
-    elif location in ["home", "bedroom", "living room", "kitchen"] and mood == "chill":
-        return "Home Chillers 🏠", "Cozy milk vibes"
-    
-    # Kitchen specific
-    elif location == "kitchen" and activity == "cooking":
-        return "Kitchen Creators 👨‍🍳", "Culinary milk masters"
-    
-    # Default
+    table = get_mob_table()
+    assignment = table["lookup"].get((activity, location, mood))
+    if assignment is None:
+        # Value outside the compiled space - evaluate the rules directly
+        assignment = evaluate_mob_rules(table["rules"], activity, location, mood)
+    return assignment
+
+# Bulk re-tagging ===============================================
+# Re-tag All recomputes every derived tag from the stored Pegasus analyses.
+# Each keyword rule becomes one vectorized str.contains over the whole column
+# and np.select picks the first matching rule per row, mirroring
+# classify_keywords(); mobs come straight from the compiled dense mob table.
+
+def classify_keywords_column(texts, rules, default):
+    """Vectorized classify_keywords: first matching rule value for every row of texts"""
+    conditions = [
+        texts.str.contains('|'.join(re.escape(k) for k in keywords), regex=True).to_numpy()
+        for _, keywords in rules
+    ]
+    return np.select(conditions, [value for value, _ in rules], default=default).astype(object)
+
+def assign_activity_mob_column(activity, location, mood):
+    """Vectorized assign_activity_mob: index the dense mob table with category codes"""
+    table = get_mob_table()
+    values = table["values"]
+    codes = [pd.Categorical(column, categories=values[field]).codes
+             for field, column in zip(MOB_FIELDS, (activity, location, mood))]
+    known = (codes[0] >= 0) & (codes[1] >= 0) & (codes[2] >= 0)
+
+    mobs = np.empty(len(known), dtype=object)
+    mobs[known] = table["dense"][codes[0][known], codes[1][known], codes[2][known]]
+    for i in np.flatnonzero(~known):
+        mobs[i] = evaluate_mob_rules(table["rules"], activity[i], location[i], mood[i])[0]
+    return mobs
+
+def milk_type_mob_column(milk_type):
+    """Vectorized milk-type mob name (Chocolate Champions / Berry Squad / Classic Crew)"""
+    return np.select(
+        [milk_type == "Chocolate", milk_type == "Strawberry"],
+        ["Chocolate Champions 🍫", "Berry Squad 🍓"],
+        default="Classic Crew 🥛"
+    ).astype(object)
+
+def retag_videos(videos):
+    """
+    Recompute activity, location, mood, milk type and both mobs for every video
+    with a stored analysis. Returns (new video list, changed count); videos
+    without an analysis (search-fallback approvals) keep their scene tags.
+    A video whose analysis no longer finds milk gets milk_found=False, and
+    reindex_videos moves it to quarantine.
+    Makes no API calls: embedding mobs only use cached embeddings and anchors.
+    """
+    if not videos:
+        return list(videos), 0
+
+    texts = pd.Series([v.get('analysis_text') or "" for v in videos], dtype=object).str.lower()
+    has_analysis = (texts.str.len() > 0).to_numpy()
+
+    # Structured analyses are classified from their own fields, free text from the whole response
+    structured = pd.DataFrame.from_records(
+        [v.get('analysis_structured') or {} for v in videos],
+        columns=["activity", "location", "mood", "milk_type"]
+    )
+    is_structured = pd.Series([bool(v.get('analysis_structured')) for v in videos])
+    milk_visible = pd.Series([(v.get('analysis_structured') or {}).get('milk_visible') for v in videos],
+                             dtype=object)
+
+    def source(field):
+        return structured[field].where(is_structured, texts).fillna("").astype(str).str.lower()
+
+    activity = classify_keywords_column(source("activity"), ACTIVITY_KEYWORDS, "general")
+    location = classify_keywords_column(source("location"), LOCATION_KEYWORDS, "unknown")
+    mood = classify_keywords_column(source("mood"), MOOD_KEYWORDS, "casual")
+
+    milk_type = classify_keywords_column(texts, MILK_TYPE_KEYWORDS, "Regular")
+    milk_type = np.where(is_structured,
+                         structured["milk_type"].map(STRUCTURED_MILK_TYPES).fillna("Regular"),
+                         milk_type).astype(object)
+
+    # Same test as classify_analysis / interpret_analysis
+    def mentions(words):
+        return texts.str.contains('|'.join(re.escape(word) for word in words), regex=True)
+    milk_found = (mentions(MILK_PRESENCE_KEYWORDS["affirmative"]) & mentions(MILK_PRESENCE_KEYWORDS["milk"])).to_numpy()
+    milk_found = np.where(is_structured & milk_visible.notna(), milk_visible, milk_found).astype(bool)
+
+    activity_mob = assign_activity_mob_column(activity, location, mood)
+    mob = milk_type_mob_column(milk_type)
+
+    # Cached embeddings override the rule-based mob
+    embedding_mob, embedding_similarity = embedding_mob_column([v['video_id'] for v in videos])
+    has_embedding = pd.notna(embedding_mob)
+
+    retagged = []
+    changed = 0
+    for i, video in enumerate(videos):
+        updates = {}
+        if has_analysis[i]:
+            updates.update({
+                "milk_type": milk_type[i],
+                "activity_mob": activity_mob[i],
+                "mob_method": "rules",
+                "mob_similarity": None,
+                "mob": mob[i],
+                "activity_data": {
+                    "activity": activity[i],
+                    "location": location[i],
+                    "mood": mood[i]
+                }
+            })
+            # Approved records are implicitly milk_found; only a lost detection is flagged
+            if not milk_found[i]:
+                updates["milk_found"] = False
+        if has_embedding[i]:
+            updates.update({
+                "activity_mob": embedding_mob[i],
+                "mob_method": "embedding",
+                "mob_similarity": float(embedding_similarity[i])
+            })
+        if not updates:
+            retagged.append(video)
+            continue
+        if any(video.get(key) != value for key, value in updates.items()):
+            changed += 1
+            video = {**video, **updates}
+        retagged.append(video)
+    return retagged, changed
+
+# Bulk re-analysis ===============================================
+# Re-analyze All fans Pegasus calls out over a thread pool. Every call goes
+# through pegasus_rate_limiter (a token bucket shared with the upload pipeline)
+# and every response is cached on disk per prompt version as soon as it
+# arrives, so videos already analyzed with the current prompt are skipped and an
+# interrupted run picks up where it stopped.
+ANALYSIS_CACHE_DIR = os.path.join('cache', 'analyses')
+REANALYZE_WORKERS = int(os.getenv("REANALYZE_WORKERS", "8"))
+PEGASUS_RATE_LIMIT = float(os.getenv("PEGASUS_RATE_LIMIT", "4"))  # requests per second, 0 = unlimited
+PEGASUS_RATE_BURST = int(os.getenv("PEGASUS_RATE_BURST", "8"))
+PEGASUS_MAX_RETRIES = 3
+
+class TokenBucket:
+    """Thread-safe token bucket: acquire() blocks until a request may go out (rate <= 0 means unlimited)"""
+
+    def __init__(self, rate, burst):
+        if burst < 1:
+            raise ValueError(f"token bucket burst must be at least 1, got {burst}")
+        self.rate = rate
+        self.capacity = burst
+        self.tokens = float(burst)
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        """Take one token, sleeping as needed; returns the seconds spent waiting"""
+        if self.rate <= 0:
+            return 0.0
+        waited = 0.0
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return waited
+                delay = (1 - self.tokens) / self.rate
+            time.sleep(delay)
+            waited += delay
+
+pegasus_rate_limiter = TokenBucket(PEGASUS_RATE_LIMIT, PEGASUS_RATE_BURST)
+
+def _analysis_cache_path(video_id, prompt_version=PEGASUS_PROMPT_VERSION):
+    return os.path.join(ANALYSIS_CACHE_DIR, prompt_version, f"{video_id}.json")
+
+def load_cached_analysis(video_id, prompt_version=PEGASUS_PROMPT_VERSION):
+    """Cached Pegasus response for a video under a prompt version, or None"""
+    try:
+        with open(_analysis_cache_path(video_id, prompt_version), 'r') as f:
+            return json.load(f)["analysis_text"]
+    except (OSError, ValueError, KeyError):
+        return None
+
+def store_cached_analysis(video_id, analysis_text, prompt_version=PEGASUS_PROMPT_VERSION):
+    """Write a Pegasus response to the cache (atomically, so a killed run never leaves half a file)"""
+    path = _analysis_cache_path(video_id, prompt_version)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = f"{path}.{threading.get_ident()}.tmp"
+    with open(tmp_path, 'w') as f:
+        json.dump({
+            "video_id": video_id,
+            "prompt_version": prompt_version,
+            "analysis_text": analysis_text,
+            "analyzed_at": time.time()
+        }, f)
+    os.replace(tmp_path, path)
+
+def _analyze_and_cache(client, video_id):
+    analysis_text = request_pegasus_analysis(client, video_id)
+    store_cached_analysis(video_id, analysis_text)
+    return analysis_text
+
+def reanalyze_videos(client, videos, workers=REANALYZE_WORKERS, on_progress=None):
+    """
+    Bring every video's analysis up to the current prompt version.
+    Returns (new video list, stats). on_progress(done, total, stats) is called
+    from the calling thread after each video finishes, so it may touch the UI.
+    """
+    stats = {"total": len(videos), "current": 0, "cached": 0, "analyzed": 0, "failed": 0}
+    analyses = {}
+    pending = {}  # video_id -> None, an insertion-ordered set
+
+    for video in videos:
+        video_id = video['video_id']
+        if video.get('prompt_version') == PEGASUS_PROMPT_VERSION and video.get('analysis_text'):
+            stats["current"] += 1
+            continue
+        cached = load_cached_analysis(video_id)
+        if cached is not None:
+            analyses[video_id] = cached
+            stats["cached"] += 1
+        else:
+            pending[video_id] = None
+
+    done = stats["current"] + stats["cached"]
+    if on_progress:
+        on_progress(done, stats["total"], stats)
+
+    if pending:
+        with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="reanalyze") as executor:
+            futures = {executor.submit(_analyze_and_cache, client, video_id): video_id for video_id in pending}
+            for future in as_completed(futures):
+                video_id = futures[future]
+                try:
+                    analyses[video_id] = future.result()
+                    stats["analyzed"] += 1
+                except Exception as e:
+                    stats["failed"] += 1
+                    logger.warning(f"Re-analysis failed for {video_id}: {str(e)}")
+                done += 1
+                if on_progress:
+                    on_progress(done, stats["total"], stats)
+
+    updated = []
+    for video in videos:
+        analysis_text = analyses.get(video['video_id'])
+        if analysis_text is None:
+            updated.append(video)
+            continue
+        scene = interpret_analysis(analysis_text)
+        updated.append({
+            **video,
+            "analysis_text": analysis_text,
+            "analysis_structured": scene["structured"],
+            "prompt_version": PEGASUS_PROMPT_VERSION,
+            "milk_moment": scene["milk_moment"],
+            "moment_type": scene["moment_type"]
+        })
+
+    # Milk type, scene and mobs follow from the new analyses
+    updated, _ = retag_videos(updated)
+    return updated, stats
+
+# File locks ===============================================
+# Files that several Streamlit worker processes write (the embedding memmap, the
+# event log) are only changed while holding an exclusive flock on a sidecar lock
+# file, so two writers never interleave.
+@contextmanager
+def file_lock(path):
+    """Hold an exclusive cross-process lock on path (created if missing) for the block"""
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    with open(path, 'a') as f:
+        if fcntl is not None:
+            fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            if fcntl is not None:
+                fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+
+# Embeddings ===============================================
+# Mob Matchmaker: every approved video's Marengo embedding is fetched once from
+# the index and kept locally in a float32 memory-mapped array (one unit-length
+# row per video, row order in ids.txt). Each mob gets a centroid from the text
+# embedding of its rule "query", and a video joins the mob whose centroid has
+# the highest dot product - one small matrix product, no Pegasus wording involved.
+# A match weaker than MOB_EMBEDDING_MIN_SIMILARITY doesn't count: the video keeps
+# its rule-based mob. Embeddings are only fetched at ingest and by the explicit "Sync Embeddings"
+# action; re-tagging uses whatever is cached and never calls the API.
+EMBEDDING_DIR = os.path.join('cache', 'embeddings')
+EMBEDDING_MODEL = "Marengo-retrieval-2.7"
+EMBEDDING_DIM = 1024
+EMBEDDING_OPTIONS = ["visual-text", "audio"]
+MOB_ASSIGNMENT_MODE = os.getenv("MOB_ASSIGNMENT", "embedding")  # "embedding" or "rules"
+MOB_EMBEDDING_MIN_SIMILARITY = float(os.getenv("MOB_EMBEDDING_MIN_SIMILARITY", "0.1"))
+
+def _mean_unit_vector(vectors):
+    """Average segment vectors into one L2-normalized float32 vector"""
+    matrix = np.asarray([v for v in vectors if v], dtype=np.float32)
+    if matrix.size == 0:
+        raise ValueError("no embedding segments returned")
+    mean = matrix.mean(axis=0)
+    norm = np.linalg.norm(mean)
+    return mean / norm if norm > 0 else mean
+
+def _segment_floats(segments):
+    """Float lists from SDK segment objects (embeddings_float) or raw dicts (float)"""
+    floats = []
+    for segment in segments or []:
+        values = getattr(segment, 'embeddings_float', None)
+        if values is None and isinstance(segment, dict):
+            values = segment.get('float')
+        floats.append(values)
+    return floats
+
+class EmbeddingStore:
+    """
+    Append-only float32 memmap of unit-length video embeddings keyed by video_id.
+    Writes hold a file lock, and rows appended by other processes are picked up
+    from the tail of ids.txt, so every worker process can share the same files.
+    """
+
+    def __init__(self, directory=EMBEDDING_DIR, dim=EMBEDDING_DIM):
+        self.directory = directory
+        self.dim = dim
+        self.vectors_path = os.path.join(directory, 'vectors.f32')
+        self.ids_path = os.path.join(directory, 'ids.txt')
+        self.lock_path = os.path.join(directory, 'write.lock')
+        self.lock = threading.RLock()
+        self.ids = []
+        self.rows = {}
+        self.ids_offset = 0  # bytes of ids.txt already read
+        self.vectors = None
+        self.version = 0  # bumped on every write so indexes built on top know to refresh
+        self.refresh()
+
+    def _remap(self):
+        """Map the whole backing file if it has grown past what we have mapped"""
+        try:
+            size = os.path.getsize(self.vectors_path)
+        except OSError:
+            return
+        if size // (self.dim * 4) > self.capacity:
+            self.vectors = np.memmap(self.vectors_path, dtype=np.float32, mode='r+').reshape(-1, self.dim)
+
+    def refresh(self):
+        """Pick up rows appended since we last looked (by this or another process)"""
+        with self.lock:
+            try:
+                size = os.path.getsize(self.ids_path)
+            except OSError:
+                return
+            if size <= self.ids_offset:
+                return
+            with open(self.ids_path, 'rb') as f:
+                f.seek(self.ids_offset)
+                chunk = f.read(size - self.ids_offset)
+            # Only take complete lines; a writer may be mid-append
+            chunk = chunk[:chunk.rfind(b'\n') + 1]
+            if not chunk:
+                return
+            self.ids_offset += len(chunk)
+            self._remap()
+            # Ids are appended after their vector is written, so every listed row is complete
+            for video_id in chunk.decode('utf-8').split('\n'):
+                if video_id.strip() and len(self.ids) < self.capacity:
+                    self.rows[video_id.strip()] = len(self.ids)
+                    self.ids.append(video_id.strip())
+            self.version += 1
+
+    @property
+    def capacity(self):
+        return 0 if self.vectors is None else self.vectors.shape[0]
+
+    def __len__(self):
+        return len(self.ids)
+
+    def __contains__(self, video_id):
+        return video_id in self.rows
+
+    def _grow(self, rows):
+        """Extend the backing file (zero-filled) and remap it with room for at least rows vectors (file lock held)"""
+        new_capacity = max(rows, self.capacity * 2, 1024)
+        os.makedirs(self.directory, exist_ok=True)
+        if self.vectors is not None:
+            self.vectors.flush()
+        with open(self.vectors_path, 'ab') as f:
+            f.truncate(new_capacity * self.dim * 4)
+        self.vectors = np.memmap(self.vectors_path, dtype=np.float32, mode='r+',
+                                 shape=(new_capacity, self.dim))
+
+    def add(self, video_id, vector):
+        """Store (or overwrite) a video's embedding"""
+        vector = np.asarray(vector, dtype=np.float32)
+        if vector.shape != (self.dim,):
+            raise ValueError(f"expected a {self.dim}-d embedding, got shape {vector.shape}")
+        with self.lock, file_lock(self.lock_path):
+            # Another process may have appended (and grown the file) - the next free row is after theirs
+            self.refresh()
+            self._remap()
+            row = self.rows.get(video_id)
+            if row is None:
+                row = len(self.ids)
+                if row >= self.capacity:
+                    self._grow(row + 1)
+            self.vectors[row] = vector
+            self.vectors.flush()
+            if video_id not in self.rows:
+                line = (video_id + '\n').encode('utf-8')
+                with open(self.ids_path, 'ab') as f:
+                    f.write(line)
+                self.ids_offset += len(line)
+                self.ids.append(video_id)
+                self.rows[video_id] = row
+            self.version += 1
+
+    def get(self, video_id):
+        """A copy of one video's embedding, or None"""
+        row = self.rows.get(video_id)
+        return None if row is None else np.array(self.vectors[row])
+
+    def matrix(self):
+        """Read-only view of every stored embedding, in row order"""
+        if self.vectors is None:
+            return np.zeros((0, self.dim), dtype=np.float32)
+        return self.vectors[:len(self.ids)]
+
+    def lookup(self, video_ids):
+        """Row numbers for video_ids (-1 where no embedding is stored)"""
+        self.refresh()
+        return np.fromiter((self.rows.get(video_id, -1) for video_id in video_ids), dtype=np.int64,
+                           count=len(video_ids))
+
+@st.cache_resource
+def get_embedding_store():
+    """Process-wide embedding store"""
+    return EmbeddingStore()
+
+def fetch_video_embedding(client, index_id, video_id):
+    """Pull a video's Marengo embedding from the index and average its segments"""
+    with trace_span("fetch_embedding", video_id=video_id) as span:
+        video = client.index.video.retrieve(index_id=index_id, id=video_id, embedding_option=EMBEDDING_OPTIONS)
+        segments = video.embedding.video_embedding.segments
+        span["segments"] = len(segments)
+        return _mean_unit_vector(_segment_floats(segments))
+
+def ensure_video_embedding(client, index_id, video_id):
+    """Cached embedding for a video, fetching it on first use"""
+    store = get_embedding_store()
+    vector = store.get(video_id)
+    if vector is None:
+        vector = fetch_video_embedding(client, index_id, video_id)
+        store.add(video_id, vector)
+    return vector
+
+def embed_text(client, text):
+    """Marengo text embedding as a unit vector (same space as the video embeddings)"""
+    result = client.embed.create(model_name=EMBEDDING_MODEL, text=text)
+    return _mean_unit_vector(_segment_floats(result.text_embedding.segments))
+
+_mob_centroids = {"key": None, "names": None, "descriptions": None, "matrix": None}
+
+def _mob_anchor_queries(rules):
+    """[(mob, description)] and the anchor query text for each, rules first, then the default"""
+    mobs = [(rule["mob"], rule.get("description", ""), rule.get("query")) for rule in rules["rules"]]
+    mobs.append((rules["default"]["mob"], rules["default"].get("description", ""), rules["default"].get("query")))
+    queries = [query or f"{mob}: {description}" for mob, description, query in mobs]
+    return [(mob, description) for mob, description, _ in mobs], queries
+
+def get_mob_centroids(client=None):
+    """
+    (names, descriptions, centroid matrix) for the current mob rules. Text
+    embeddings are cached on disk per query, so the API is only called when a
+    rule's query changes. Returns None if an anchor is missing and there's no client.
+    """
+    rules = get_mob_table()["rules"]
+    _, queries = _mob_anchor_queries(rules)
+    key = tuple(queries)
+    if _mob_centroids["key"] == key:
+        return _mob_centroids["names"], _mob_centroids["descriptions"], _mob_centroids["matrix"]
+
+    centroids = mob_centroids(rules, client)
+    if centroids is None:
+        return None
+    names, descriptions, matrix = centroids
+    _mob_centroids.update(key=key, names=names, descriptions=descriptions, matrix=matrix)
+    return names, descriptions, matrix
+
+def mob_centroids(rules, client=None):
+    """(names, descriptions, centroid matrix) for any rule set, or None if an anchor isn't cached and there's no client"""
+    mobs, queries = _mob_anchor_queries(rules)
+    anchors_path = os.path.join(EMBEDDING_DIR, 'mob_anchors.json')
+    try:
+        with open(anchors_path, 'r') as f:
+            anchors = json.load(f)
+    except (OSError, ValueError):
+        anchors = {}
+
+    missing = [query for query in queries if query not in anchors]
+    if missing:
+        if client is None:
+            return None
+        for query in missing:
+            anchors[query] = embed_text(client, query).tolist()
+            logger.info(f"🧭 Embedded mob anchor: {query}")
+        os.makedirs(EMBEDDING_DIR, exist_ok=True)
+        with open(anchors_path + '.tmp', 'w') as f:
+            json.dump(anchors, f)
+        os.replace(anchors_path + '.tmp', anchors_path)
+
+    return ([mob for mob, _ in mobs], [description for _, description in mobs],
+            np.asarray([anchors[query] for query in queries], dtype=np.float32))
+
+def nearest_mobs(vectors, centroids):
+    """Index of the nearest centroid and its cosine similarity for each row of vectors"""
+    similarities = np.asarray(vectors, dtype=np.float32) @ centroids.T
+    best = similarities.argmax(axis=1)
+    return best, similarities[np.arange(len(best)), best]
+
+def match_mob_by_embedding(client, index_id, video_id):
+    """(mob, description, similarity) from the video embedding, or None to keep the rule-based mob"""
+    if MOB_ASSIGNMENT_MODE != "embedding":
+        return None
+    with trace_span("embedding_mob", video_id=video_id) as span:
+        try:
+            vector = ensure_video_embedding(client, index_id, video_id)
+            centroids = get_mob_centroids(client)
+        except Exception as e:
+            logger.warning(f"Embedding mob assignment unavailable for {video_id}: {str(e)}")
+            span["error"] = str(e)
+            return None
+        names, descriptions, matrix = centroids
+        best, similarity = nearest_mobs(vector[np.newaxis, :], matrix)
+        span.update(activity_mob=names[best[0]], similarity=float(similarity[0]))
+        if similarity[0] < MOB_EMBEDDING_MIN_SIMILARITY:
+            logger.info(f"Nearest mob {names[best[0]]} for {video_id} is only {similarity[0]:.3f} similar - keeping the rule-based mob")
+            return None
+        return names[best[0]], descriptions[best[0]], float(similarity[0])
+
+def sync_embeddings(client, index_id, videos, on_progress=None):
+    """
+    Fetch what re-tagging can't: anchor embeddings for changed mob rule queries
+    and Marengo embeddings for videos that don't have one cached (which are then
+    fed to mob discovery). Returns stats; on_progress(done, total) is called
+    after each video.
+    """
+    stats = {"fetched": 0, "failed": 0}
+    if MOB_ASSIGNMENT_MODE != "embedding":
+        return stats
+    get_mob_centroids(client)
+
+    store = get_embedding_store()
+    missing = [video for video in videos if video['video_id'] not in store]
+    for done, video in enumerate(missing, 1):
+        try:
+            ensure_video_embedding(client, index_id, video['video_id'])
+            stats["fetched"] += 1
+            update_mob_discovery(video)
+        except Exception as e:
+            stats["failed"] += 1
+            logger.warning(f"Embedding fetch failed for {video['video_id']}: {str(e)}")
+        if on_progress:
+            on_progress(done, len(missing))
+    return stats
+
+def embedding_mob_column(video_ids, centroids=None, store=None):
+    """
+    Vectorized embedding mobs for video_ids: (mobs, similarities), None where no
+    embedding or anchor is cached or the best match is under MOB_EMBEDDING_MIN_SIMILARITY.
+    centroids and store default to the current rules' and the process-wide store
+    """
+    mobs = np.full(len(video_ids), None, dtype=object)
+    similarities = np.full(len(video_ids), np.nan, dtype=np.float32)
+    if MOB_ASSIGNMENT_MODE != "embedding" or not video_ids:
+        return mobs, similarities
+
+    centroids = centroids or get_mob_centroids()
+    if centroids is None:
+        return mobs, similarities
+    names, _, matrix = centroids
+
+    store = store or get_embedding_store()
+    rows = store.lookup(video_ids)
+    known = rows >= 0
+    if known.any():
+        best, sims = nearest_mobs(store.matrix()[rows[known]], matrix)
+        confident = sims >= MOB_EMBEDDING_MIN_SIMILARITY
+        positions = np.flatnonzero(known)[confident]
+        mobs[positions] = np.asarray(names, dtype=object)[best[confident]]
+        similarities[positions] = sims[confident]
+    return mobs, similarities
+
+# Similarity search ===============================================
+# "More like this" over the cached embeddings. Up to VECTOR_INDEX_EXACT_LIMIT
+# vectors the index scores every row (one matrix-vector product). Above that it
+# trains an IVF partitioning - spherical k-means with ~sqrt(n) lists - and only
+# scores the rows in the VECTOR_INDEX_NPROBE lists nearest the query. New
+# vectors are dropped into their nearest list as they arrive; the partitioning
+# is retrained only once the store has doubled since the last training.
+VECTOR_INDEX_EXACT_LIMIT = 20000
+VECTOR_INDEX_NPROBE = 8
+VECTOR_INDEX_TRAIN_ITERATIONS = 10
+
+def train_ivf_centroids(matrix, nlist, iterations=VECTOR_INDEX_TRAIN_ITERATIONS, seed=0):
+    """Spherical k-means on a sample of unit vectors; returns (nlist, d) unit centroids"""
+    rng = np.random.default_rng(seed)
+    sample_size = min(len(matrix), nlist * 256)
+    sample = np.asarray(matrix[np.sort(rng.choice(len(matrix), sample_size, replace=False))])
+    centroids = sample[rng.choice(sample_size, nlist, replace=False)].copy()
+
+    for _ in range(iterations):
+        labels = (sample @ centroids.T).argmax(axis=1)
+        sums = np.zeros_like(centroids)
+        np.add.at(sums, labels, sample)
+        norms = np.linalg.norm(sums, axis=1, keepdims=True)
+        # Keep the previous centroid for any list that came up empty
+        centroids = np.where(norms > 0, sums / np.maximum(norms, 1e-12), centroids)
+    return centroids
+
+class VectorIndex:
+    """Top-k cosine search over an EmbeddingStore (exact when small, IVF when large)"""
+
+    def __init__(self, store, exact_limit=VECTOR_INDEX_EXACT_LIMIT, nprobe=VECTOR_INDEX_NPROBE):
+        self.store = store
+        self.exact_limit = exact_limit
+        self.nprobe = nprobe
+        self.lock = threading.Lock()
+        self.centroids = None
+        self.assignments = np.zeros(0, dtype=np.int32)  # IVF list of each row
+        self.trained_size = 0
+        self.indexed = 0
+
+    def _assign(self, vectors, chunk=8192):
+        return np.concatenate([
+            (np.asarray(vectors[i:i + chunk]) @ self.centroids.T).argmax(axis=1).astype(np.int32)
+            for i in range(0, len(vectors), chunk)
+        ]) if len(vectors) else np.zeros(0, dtype=np.int32)
+
+    def _sync(self):
+        """Bring the partitioning up to date with the store"""
+        self.store.refresh()
+        size = len(self.store)
+        if size == self.indexed:
+            return
+        matrix = self.store.matrix()
+        if size <= self.exact_limit:
+            self.centroids = None
+        elif self.centroids is None or size > 2 * self.trained_size:
+            nlist = int(np.sqrt(size))
+            start = time.time()
+            self.centroids = train_ivf_centroids(matrix, nlist)
+            self.assignments = self._assign(matrix)
+            self.trained_size = size
+            logger.info(f"🗂️ Trained IVF index: {nlist} lists over {size} vectors in {time.time() - start:.1f}s")
+        else:
+            self.assignments = np.concatenate([self.assignments, self._assign(matrix[self.indexed:size])])
+        self.indexed = size
+
+    def search(self, vector, k=5, exclude_rows=()):
+        """[(row, similarity)] for the k rows most similar to vector, best first"""
+        with self.lock:
+            self._sync()
+            matrix = self.store.matrix()[:self.indexed]
+            if self.centroids is None:
+                candidates = np.arange(self.indexed)
+            else:
+                probe = np.argsort(self.centroids @ vector)[-self.nprobe:]
+                candidates = np.flatnonzero(np.isin(self.assignments, probe))
+
+        if len(exclude_rows):
+            candidates = candidates[~np.isin(candidates, exclude_rows)]
+        if len(candidates) == 0:
+            return []
+
+        scores = np.asarray(matrix[candidates]) @ vector
+        top = np.argpartition(-scores, min(k, len(scores)) - 1)[:k]
+        top = top[np.argsort(-scores[top])]
+        return [(int(candidates[i]), float(scores[i])) for i in top]
+
+@st.cache_resource
+def get_vector_index():
+    """Process-wide similarity index over the embedding store"""
+    return VectorIndex(get_embedding_store())
+
+def find_similar_videos(video_id, k=5):
+    """The k approved videos most like video_id, as [(video, similarity)]; [] without an embedding"""
+    store = get_embedding_store()
+    vector = store.get(video_id)
+    if vector is None:
+        return []
+
+    campaign = get_campaign_store()
+    with trace_span("similar_videos", video_id=video_id, k=k) as span:
+        # Embeddings are fetched at approval, so nearly every hit is approved:
+        # over-fetch a little, look up just the hits, and widen only if too few are
+        fetch = 2 * k
+        while True:
+            matches = get_vector_index().search(vector, k=fetch, exclude_rows=np.array([store.rows[video_id]]))
+            approved = campaign.approved_by_id([store.ids[row] for row, _ in matches])
+            similar = [(approved[store.ids[row]], similarity) for row, similarity in matches
+                       if store.ids[row] in approved][:k]
+            if len(similar) == k or len(matches) < fetch:
+                break
+            fetch *= 4
+        span.update(matches=len(similar), fetched=fetch)
+    return similar
+
+def show_similar_videos(video_id):
+    """Render the "more like this" list for a video"""
+    similar = find_similar_videos(video_id)
+    if not similar:
+        st.caption("No similar videos yet - similarity needs the video's embedding and other approved videos")
+        return
+    for video, similarity in similar:
+        col1, col2 = st.columns([4, 1])
+        with col1:
+            st.write(f"📹 {video['filename']}")
+            st.caption(f"{video.get('activity_mob', 'Unknown')} • {video.get('milk_type', 'Regular')}")
+        with col2:
+            st.metric("Match", f"{similarity * 100:.0f}%")
+
+# Mob discovery ===============================================
+# Sequential (online) k-means over each approved video's embedding plus a small
+# one-hot of its activity, location and mood. A video either joins its nearest
+# cluster - moving that centroid by 1/n, O(k*d) - or, if nothing is close
+# enough, seeds a new cluster. The corpus is never reclustered. A cluster that
+# grows dense enough and isn't covered by an existing mob (its centroid is far
+# from every mob anchor, or most of its members fell through to the default mob)
+# is proposed as a new mob in the gallery. The model is snapshotted every
+# MOB_DISCOVERY_SAVE_EVERY updates or MOB_DISCOVERY_SAVE_INTERVAL seconds (and
+# at exit); the ids it has absorbed are appended to a log, never rewritten.
+MOB_DISCOVERY_PATH = os.path.join('cache', 'mob_discovery')
+MOB_DISCOVERY_SAVE_EVERY = 25
+MOB_DISCOVERY_SAVE_INTERVAL = 60.0
+MOB_DISCOVERY_MAX_CLUSTERS = 32
+MOB_DISCOVERY_SPAWN_SIMILARITY = 0.55   # below this a video seeds a new cluster
+MOB_DISCOVERY_MIN_MEMBERS = 5
+MOB_DISCOVERY_MIN_DENSITY = 0.7         # mean member-to-centroid similarity
+MOB_DISCOVERY_COVERED_SIMILARITY = 0.35  # centroid this close to a mob anchor = already covered
+MOB_DISCOVERY_SCENE_WEIGHT = 0.5
+
+def _scene_vocabulary():
+    """Fixed one-hot layout for the metadata part of the clustering features"""
+    return ([("activity", value) for value, _ in ACTIVITY_KEYWORDS] +
+            [("location", value) for value, _ in LOCATION_KEYWORDS] +
+            [("mood", value) for value, _ in MOOD_KEYWORDS])
+
+class MobDiscovery:
+    """Incremental clusterer that proposes mobs for dense, uncovered clusters"""
+
+    def __init__(self, path=MOB_DISCOVERY_PATH, dim=EMBEDDING_DIM):
+        self.path = path
+        self.vocabulary = _scene_vocabulary()
+        self.slots = {entry: i for i, entry in enumerate(self.vocabulary)}
+        self.dim = dim + len(self.vocabulary)
+        self.lock = threading.Lock()
+        self.centroids = np.zeros((0, self.dim), dtype=np.float32)
+        self.counts = np.zeros(0, dtype=np.int64)
+        self.similarity_sums = np.zeros(0, dtype=np.float64)
+        self.profiles = []  # per cluster: Counter of scene values and assigned mobs
+        self.seen = set()
+        self.seen_path = path + '.seen'
+        self.pending = []   # ids absorbed since the last snapshot
+        self.saved_at = time.time()
+        self._load()
+
+    def _load(self):
+        try:
+            arrays = np.load(self.path + '.npz')
+            with open(self.path + '.json', 'r') as f:
+                state = json.load(f)
+        except (OSError, ValueError):
+            return
+        if state.get("vocabulary") != [list(entry) for entry in self.vocabulary] \
+                or arrays["centroids"].shape[1] != self.dim:
+            logger.info("Mob discovery features changed - starting a fresh model")
+            return
+        self.centroids = arrays["centroids"]
+        self.counts = arrays["counts"]
+        self.similarity_sums = arrays["similarity_sums"]
+        self.profiles = [Counter(profile) for profile in state["profiles"]]
+        if "seen" in state:
+            # Snapshot from before the seen log - move the ids into it on the next save
+            self.seen = set(state["seen"])
+            self.pending = sorted(self.seen)
+        try:
+            with open(self.seen_path, 'r+b') as f:
+                # Ids logged after the last snapshot aren't in its centroids - forget them
+                f.truncate(state.get("seen_bytes", 0))
+                self.seen.update(line.decode('utf-8') for line in f.read().splitlines() if line)
+        except OSError:
+            pass
+
+    def _save(self):
+        """Snapshot the centroids and profiles, appending newly absorbed ids to the seen log"""
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        with open(self.seen_path, 'ab') as f:
+            f.write(''.join(video_id + '\n' for video_id in self.pending).encode('utf-8'))
+            seen_bytes = f.tell()
+        np.savez(self.path + '.tmp.npz', centroids=self.centroids, counts=self.counts,
+                 similarity_sums=self.similarity_sums)
+        os.replace(self.path + '.tmp.npz', self.path + '.npz')
+        with open(self.path + '.json.tmp', 'w') as f:
+            json.dump({
+                "vocabulary": self.vocabulary,
+                "profiles": [dict(profile) for profile in self.profiles],
+                "seen_bytes": seen_bytes
+            }, f)
+        os.replace(self.path + '.json.tmp', self.path + '.json')
+        self.pending = []
+        self.saved_at = time.time()
+
+    def flush(self):
+        """Snapshot now if anything changed since the last snapshot"""
+        with self.lock:
+            if self.pending:
+                self._save()
+
+    def reset(self):
+        """Forget every cluster and seen video, on disk too"""
+        with self.lock:
+            self.centroids = np.zeros((0, self.dim), dtype=np.float32)
+            self.counts = np.zeros(0, dtype=np.int64)
+            self.similarity_sums = np.zeros(0, dtype=np.float64)
+            self.profiles = []
+            self.seen = set()
+            self.pending = []
+            if os.path.exists(self.seen_path):
+                os.remove(self.seen_path)
+            self._save()
+
+    def features(self, embedding, activity_data):
+        """Unit-length clustering feature: embedding plus weighted scene one-hot"""
+        scene = np.zeros(len(self.vocabulary), dtype=np.float32)
+        for field in MOB_FIELDS:
+            slot = self.slots.get((field, (activity_data or {}).get(field)))
+            if slot is not None:
+                scene[slot] = MOB_DISCOVERY_SCENE_WEIGHT / np.sqrt(len(MOB_FIELDS))
+        feature = np.concatenate([np.asarray(embedding, dtype=np.float32), scene])
+        return feature / np.linalg.norm(feature)
+
+    def update(self, video_id, embedding, activity_data, activity_mob):
+        """Fold one video into the model; returns its cluster index"""
+        with self.lock:
+            if video_id in self.seen:
+                return None
+            feature = self.features(embedding, activity_data)
+
+            if len(self.counts):
+                norms = np.linalg.norm(self.centroids, axis=1)
+                similarities = (self.centroids @ feature) / np.maximum(norms, 1e-12)
+                cluster = int(similarities.argmax())
+                similarity = float(similarities[cluster])
+            else:
+                cluster, similarity = -1, -1.0
+
+            if similarity < MOB_DISCOVERY_SPAWN_SIMILARITY and len(self.counts) < MOB_DISCOVERY_MAX_CLUSTERS:
+                cluster = len(self.counts)
+                self.centroids = np.vstack([self.centroids, feature])
+                self.counts = np.append(self.counts, 1)
+                self.similarity_sums = np.append(self.similarity_sums, 1.0)
+                self.profiles.append(Counter())
+            else:
+                self.counts[cluster] += 1
+                self.centroids[cluster] += (feature - self.centroids[cluster]) / self.counts[cluster]
+                self.similarity_sums[cluster] += similarity
+
+            profile = self.profiles[cluster]
+            for field in MOB_FIELDS:
+                profile[f"{field}:{(activity_data or {}).get(field, 'unknown')}"] += 1
+            profile[f"mob:{activity_mob}"] += 1
+            self.seen.add(video_id)
+            self.pending.append(video_id)
+            if len(self.pending) >= MOB_DISCOVERY_SAVE_EVERY \
+                    or time.time() - self.saved_at >= MOB_DISCOVERY_SAVE_INTERVAL:
+                self._save()
+            return cluster
+
+    def proposals(self, anchors=None, default_mob=None):
+        """Dense clusters no existing mob covers, as proposal dicts (largest first)"""
+        proposals = []
+        with self.lock:
+            for cluster, count in enumerate(self.counts):
+                density = self.similarity_sums[cluster] / count
+                if count < MOB_DISCOVERY_MIN_MEMBERS or density < MOB_DISCOVERY_MIN_DENSITY:
+                    continue
+
+                profile = self.profiles[cluster]
+                members = int(count)
+                default_share = profile.get(f"mob:{default_mob}", 0) / members
+                coverage = None
+                if anchors is not None:
+                    embedding_part = self.centroids[cluster][:anchors.shape[1]]
+                    coverage = float((anchors @ embedding_part).max() / max(np.linalg.norm(embedding_part), 1e-12))
+                    covered = coverage >= MOB_DISCOVERY_COVERED_SIMILARITY and default_share < 0.6
+                else:
+                    covered = default_share < 0.6
+                if covered:
+                    continue
+
+                def dominant(field):
+                    values = {key.split(':', 1)[1]: n for key, n in profile.items() if key.startswith(field + ':')}
+                    return max(values, key=values.get) if values else "unknown"
+
+                activity, location, mood = dominant("activity"), dominant("location"), dominant("mood")
+                proposals.append({
+                    "cluster": cluster,
+                    "members": members,
+                    "density": round(float(density), 3),
+                    "coverage": coverage,
+                    "mob": f"{mood.title()} {activity.title()} Crew 🌱",
+                    "description": f"{activity} in the {location}, {mood} vibes",
+                    "query": f"person {activity} with milk in the {location}, {mood} mood",
+                    "when": [{"activity": [activity], "location": [location], "mood": [mood]}]
+                })
+        return sorted(proposals, key=lambda p: -p["members"])
+
+@st.cache_resource
+def get_mob_discovery():
+    """Process-wide mob discovery model (a fresh model is caught up on the approved videos once)"""
+    discovery = MobDiscovery()
+    atexit.register(discovery.flush)
+    if not discovery.seen:
+        embeddings = get_embedding_store()
+        for video in get_campaign_store().iter_records():
+            embedding = embeddings.get(video['video_id'])
+            if embedding is not None:
+                discovery.update(video['video_id'], embedding, video.get('activity_data'), video.get('activity_mob'))
+        discovery.flush()
+    return discovery
+
+def update_mob_discovery(video):
+    """Feed an approved video with a cached embedding into the discovery model"""
+    embedding = get_embedding_store().get(video['video_id'])
+    if embedding is None:
+        return None
+    return get_mob_discovery().update(video['video_id'], embedding, video.get('activity_data'),
+                                      video.get('activity_mob'))
+
+def adopt_mob_proposal(proposal, path=MOB_RULES_PATH):
+    """Append a proposed mob to the rule file; the hot reload picks it up"""
+    rules = load_mob_rules(path)
+    lowest = min((rule["priority"] for rule in rules["rules"]), default=10)
+    rules["rules"].append({
+        "mob": proposal["mob"],
+        "description": proposal["description"],
+        "query": proposal["query"],
+        "priority": lowest - 10,
+        "when": proposal["when"]
+    })
+    rules["version"] = rules.get("version", 0) + 1
+    with open(path + '.tmp', 'w') as f:
+        json.dump(rules, f, indent=2, ensure_ascii=False)
+    os.replace(path + '.tmp', path)
+    logger.info(f"🌱 Adopted new mob {proposal['mob']} (cluster {proposal['cluster']}, {proposal['members']} members)")
+
+# Trends ===============================================
+# Streaming trend detection over hashtags, mobs, milk types, locations and
+# posting time slots. Events land in hourly Count-Min sketches kept in a ring
+# covering two windows (the last TREND_WINDOW_BUCKETS hours and the ones before),
+# so memory is fixed no matter how many posts arrive. Running sums of each window
+# make a count estimate O(depth), and each dimension keeps a small bounded set of
+# heavy-hitter candidates, so "what's trending" never scans anything large. At the
+# defaults the ring is 2 x 24 x 4 x 2048 int32 counters (1.5MB) plus two int64
+# window sums (128KB). The state is saved to TREND_STATE_PATH at most every
+# TREND_SAVE_INTERVAL seconds (and at exit) and reloaded on startup, so a restart
+# keeps the windows; sketch columns use crc32 so they mean the same in every process.
+TREND_STATE_PATH = os.path.join('cache', 'trends')
+TREND_SAVE_INTERVAL = 60.0
+TREND_BUCKET_SECONDS = 3600
+TREND_WINDOW_BUCKETS = 24
+TREND_SKETCH_WIDTH = 2048
+TREND_SKETCH_DEPTH = 4
+TREND_TRACKED_PER_DIMENSION = 32
+
+TIME_SLOTS = [
+    ("Morning (6am-12pm)", range(6, 12)),
+    ("Afternoon (12pm-6pm)", range(12, 18)),
+    ("Evening (6pm-12am)", range(18, 24)),
+    ("Night (12am-6am)", range(0, 6))
+]
+
+class TrendEngine:
+    """Sliding-window Count-Min sketches with per-dimension heavy-hitter tracking"""
+
+    def __init__(self, bucket_seconds=TREND_BUCKET_SECONDS, window_buckets=TREND_WINDOW_BUCKETS,
+                 width=TREND_SKETCH_WIDTH, depth=TREND_SKETCH_DEPTH, tracked=TREND_TRACKED_PER_DIMENSION,
+                 path=None):
+        self.bucket_seconds = bucket_seconds
+        self.window = window_buckets
+        self.width = width
+        self.depth = depth
+        self.tracked = tracked
+        self.rows = np.arange(depth)
+        self.buckets = np.zeros((2 * window_buckets, depth, width), dtype=np.int32)
+        self.current = np.zeros((depth, width), dtype=np.int64)
+        self.previous = np.zeros((depth, width), dtype=np.int64)
+        self.epoch = None  # bucket number of the newest bucket
+        self.candidates = {}  # dimension -> {value: current-window estimate}
+        self.lock = threading.Lock()
+        self.path = path
+        self.dirty = False
+        self.saved_at = time.time()
+        if path:
+            self._load()
+
+    def _load(self):
+        try:
+            with np.load(self.path + '.npz') as state:
+                buckets = state["buckets"]
+                settings = [int(x) for x in state["settings"]]
+                if settings != [self.bucket_seconds, self.window, self.width, self.depth] \
+                        or buckets.shape != self.buckets.shape:
+                    logger.info("Trend sketch settings changed - starting empty windows")
+                    return
+                self.buckets = buckets
+                self.current = state["current"]
+                self.previous = state["previous"]
+                self.epoch = int(state["epoch"])
+                self.candidates = json.loads(str(state["candidates"]))
+        except (OSError, ValueError, KeyError):
+            return
+
+    def _save(self):
+        os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+        np.savez(self.path + '.tmp.npz', buckets=self.buckets, current=self.current, previous=self.previous,
+                 epoch=self.epoch, candidates=json.dumps(self.candidates),
+                 settings=[self.bucket_seconds, self.window, self.width, self.depth])
+        os.replace(self.path + '.tmp.npz', self.path + '.npz')
+        self.dirty = False
+        self.saved_at = time.time()
+
+    def flush(self):
+        """Save now if anything was counted since the last save"""
+        with self.lock:
+            if self.path and self.dirty:
+                self._save()
+
+    def reset(self):
+        """Empty both windows (and the saved state)"""
+        with self.lock:
+            self.buckets[:] = 0
+            self.current[:] = 0
+            self.previous[:] = 0
+            self.epoch = None
+            self.candidates = {}
+            self.dirty = False
+            if self.path and os.path.exists(self.path + '.npz'):
+                os.remove(self.path + '.npz')
+
+    def _columns(self, key):
+        return np.array([zlib.crc32(f"{row}:{key}".encode('utf-8')) % self.width for row in range(self.depth)])
+
+    def _advance(self, now):
+        """Slide the windows forward to the bucket containing now"""
+        bucket = int(now // self.bucket_seconds)
+        if self.epoch is None or bucket - self.epoch >= 2 * self.window:
+            self.buckets[:] = 0
+            self.current[:] = 0
+            self.previous[:] = 0
+            self.epoch = bucket
+            for values in self.candidates.values():
+                values.clear()
+            return
+        if bucket <= self.epoch:
+            return  # late events count towards the newest bucket
+
+        size = len(self.buckets)
+        while self.epoch < bucket:
+            leaving_current = self.buckets[(self.epoch - self.window + 1) % size]
+            self.current -= leaving_current
+            self.previous += leaving_current
+            expiring = (self.epoch + 1) % size  # oldest bucket of the previous window
+            self.previous -= self.buckets[expiring]
+            self.buckets[expiring] = 0
+            self.epoch += 1
+
+        for dimension, values in self.candidates.items():
+            for value in list(values):
+                estimate = self._estimate(self.current, f"{dimension}:{value}")
+                if estimate:
+                    values[value] = estimate
+                else:
+                    del values[value]
+
+    def _estimate(self, sketch, key):
+        return int(sketch[self.rows, self._columns(key)].min())
+
+    def add(self, dimension, value, now=None):
+        """Count one occurrence of value in dimension"""
+        if value is None or value == "":
+            return
+        key = f"{dimension}:{value}"
+        columns = self._columns(key)
+        with self.lock:
+            self._advance(time.time() if now is None else now)
+            self.buckets[self.epoch % len(self.buckets)][self.rows, columns] += 1
+            self.current[self.rows, columns] += 1
+            estimate = int(self.current[self.rows, columns].min())
+
+            values = self.candidates.setdefault(dimension, {})
+            if value in values or len(values) < self.tracked:
+                values[value] = estimate
+            else:
+                weakest = min(values, key=values.get)
+                if estimate > values[weakest]:
+                    del values[weakest]
+                    values[value] = estimate
+
+            self.dirty = True
+            if self.path and time.time() - self.saved_at >= TREND_SAVE_INTERVAL:
+                self._save()
+
+    def counts(self, dimension, value, now=None):
+        """(current window, previous window) estimated counts for one value"""
+        key = f"{dimension}:{value}"
+        with self.lock:
+            self._advance(time.time() if now is None else now)
+            return self._estimate(self.current, key), self._estimate(self.previous, key)
+
+    def trending(self, dimension, n=5, now=None):
+        """Top n values of a dimension in the current window as [(value, count, growth)]"""
+        with self.lock:
+            self._advance(time.time() if now is None else now)
+            values = self.candidates.get(dimension, {})
+            top = sorted(values.items(), key=lambda item: -item[1])[:n]
+            result = []
+            for value, count in top:
+                previous = self._estimate(self.previous, f"{dimension}:{value}")
+                result.append((value, count, (count - previous) / previous if previous else None))
+            return result
+
+@st.cache_resource
+def get_trend_engine():
+    """Process-wide trend engine, restored from its last saved state"""
+    engine = TrendEngine(path=TREND_STATE_PATH)
+    atexit.register(engine.flush)
+    return engine
+
+def posting_time_slot(metadata):
+    """Time slot label for a post's metadata timestamp, or None"""
+    try:
+        hour = datetime.fromisoformat(str(metadata.get('timestamp', '')).replace('Z', '+00:00')).hour
+    except ValueError:
+        return None
+    return next(label for label, hours in TIME_SLOTS if hour in hours)
+
+def record_trend_events(metadata, video=None):
+    """Feed a post's hashtags and location (and an approved video's mobs) to the trend engine"""
+    engine = get_trend_engine()
+    metadata = metadata or {}
+    for hashtag in set(tag.lower() for tag in metadata.get('hashtags', [])):
+        engine.add("hashtag", hashtag)
+    engine.add("location", metadata.get('location'))
+    if video is not None:
+        engine.add("mob", video.get('activity_mob'))
+        engine.add("milk_type", video.get('milk_type'))
+        engine.add("time_slot", posting_time_slot(metadata))
+
+def trend_label(dimension, value):
+    """Short trend string for a value (window over window), or "" without data"""
+    current, previous = get_trend_engine().counts(dimension, value)
+    if not current and not previous:
+        return ""
+    if not previous:
+        return "🆕 new"
+    change = (current - previous) / previous * 100
+    return f"{'📈' if change >= 0 else '📉'} {change:+.0f}%"
+
+# Metadata index ===============================================
+# Inverted index from post metadata and tags to posting sets of video keys, kept
+# up to date on every approval, quarantine and bulk re-tag. Filters are answered
+# by intersecting posting sets (smallest first) instead of scanning every video.
+# One index is shared by every session thread, so reads and writes hold its lock.
+METADATA_INDEX_FIELDS = ["status", "reason", "hashtag", "username", "location", "creative_style",
+                         "milk_type", "activity_mob"]
+
+def metadata_index_terms(record, status, metadata=None):
+    """(field, value) pairs a record is indexed under"""
+    metadata = metadata if metadata is not None else (record.get('metadata') or {})
+    terms = {("status", status)}
+    if record.get('reason'):
+        terms.add(("reason", record['reason']))
+    for hashtag in metadata.get('hashtags', []):
+        terms.add(("hashtag", hashtag.lower()))
+    for field in ("username", "location", "creative_style"):
+        if metadata.get(field):
+            terms.add((field, metadata[field]))
+    for field in ("milk_type", "activity_mob"):
+        if record.get(field):
+            terms.add((field, record[field]))
+    return terms
+
+def record_matches(record, filters, status="approved"):
+    """Whether a record matches filters the way MetadataIndex.match would (for streamed records)"""
+    terms = metadata_index_terms(record, status)
+    for field, values in filters.items():
+        if not values:
+            continue
+        if isinstance(values, str):
+            values = [values]
+        if not any((field, value) in terms for value in values):
+            return False
+    return True
+
+class MetadataIndex:
+    """field -> value -> set of video keys, with set-intersection queries"""
+
+    def __init__(self):
+        self.lock = threading.RLock()  # shared by every session thread
+        self.postings = {field: {} for field in METADATA_INDEX_FIELDS}
+        self.records = {}
+        self.terms = {}
+        self.order = {}  # key -> insertion sequence, so results keep campaign order
+        self.sequence = 0
+
+    @staticmethod
+    def key(record):
+        return record.get('video_id') or record.get('filename')
+
+    def add(self, record, status, metadata=None):
+        """Index (or re-index) a record"""
+        key = self.key(record)
+        terms = metadata_index_terms(record, status, metadata)
+        with self.lock:
+            if key in self.terms:
+                self._unlink(key)
+            else:
+                self.order[key] = self.sequence
+                self.sequence += 1
+            for field, value in terms:
+                self.postings[field].setdefault(value, set()).add(key)
+            self.terms[key] = terms
+            self.records[key] = record
+
+    def _unlink(self, key):
+        for field, value in self.terms.pop(key):
+            posting = self.postings[field][value]
+            posting.discard(key)
+            if not posting:
+                del self.postings[field][value]
+
+    def remove(self, record):
+        key = self.key(record)
+        with self.lock:
+            if key in self.terms:
+                self._unlink(key)
+                del self.records[key]
+                del self.order[key]
+
+    def match(self, filters):
+        """Keys matching every field in filters (any of the values listed per field)"""
+        sets = []
+        with self.lock:
+            for field, values in filters.items():
+                if not values:
+                    continue
+                postings = self.postings[field]
+                if isinstance(values, str):
+                    values = [values]
+                sets.append(set().union(*(postings.get(value, ()) for value in values)))
+            if not sets:
+                return set(self.records)
+        sets.sort(key=len)
+        return sets[0].intersection(*sets[1:])
+
+    def query(self, filters):
+        """Records matching filters, in the order they were added"""
+        with self.lock:
+            return [self.records[key] for key in sorted(self.match(filters), key=self.order.get)]
+
+    def facet(self, field, within=None):
+        """[(value, count)] for a field, optionally restricted to a key set, largest first"""
+        with self.lock:
+            counts = [(value, len(keys & within) if within is not None else len(keys))
+                      for value, keys in self.postings[field].items()]
+        return sorted([(value, count) for value, count in counts if count], key=lambda item: -item[1])
+
+def build_metadata_index():
+    """Index every approved and quarantined video in the campaign store"""
+    store = get_campaign_store()
+    index = MetadataIndex()
+    for video in store.videos():
+        index.add(video, "approved")
+    for reason, entries in store.quarantined().items():
+        for entry in entries:
+            index.add({**entry, "reason": reason}, "quarantined", (entry.get('details') or {}).get('metadata'))
+    return index
+
+@st.cache_resource
+def get_metadata_index():
+    """Process-wide metadata index, built from the store on first use"""
+    return build_metadata_index()
+
+def requarantine_entry(video):
+    """Quarantine entry for an approved video whose new analysis no longer finds milk"""
+    return {
+        "timestamp": datetime.now().isoformat(),
+        "filename": video.get('filename'),
+        "video_id": video.get('video_id'),
+        "status": "quarantined",
+        "reason": "ai_detection_failed",
+        "details": {
+            "ai_analysis": classify_analysis(video.get('analysis_text') or "")["detected_content"],
+            "confidence": 0,
+            "metadata": video.get('metadata'),
+            "previously_approved": True,
+            "prompt_version": video.get('prompt_version')
+        }
+    }
+
+def reindex_videos(previous, current):
+    """
+    Store and re-index the approved videos a bulk operation replaced (records
+    are swapped, never mutated). Videos flagged milk_found=False move to
+    quarantine in the same transaction. Returns how many were quarantined
+    """
+    demoted = {id(new): requarantine_entry(new) for old, new in zip(previous, current)
+               if new is not old and new.get('milk_found') is False}
+    get_campaign_store().replace_videos(previous, current, demoted)
+    index = get_metadata_index()
+    leaderboards = get_leaderboards()
+    for old, new in zip(previous, current):
+        if new is old:
+            continue
+        entry = demoted.get(id(new))
+        if entry is None:
+            index.add(new, "approved")
+            leaderboards.add(new)
+        else:
+            logger.info(f"🚫 {new.get('filename')} no longer shows milk - moved to quarantine")
+            index.add(entry, "quarantined", entry["details"]["metadata"])
+            leaderboards.remove(new)
+            add_to_logs(entry)
+    return len(demoted)
+
+# Virality ===============================================
+# Layer 3 Virality Predictor. build_virality_features() turns videos into a
+# named feature matrix (scene, milk type, structured Pegasus fields, post
+# metadata - never the engagement outcomes themselves). A ridge regression on
+# logged engagement_rate is trained offline by Tests/train_virality_model.py and
+# saved as JSON; scoring the whole campaign is one matrix-vector product, and the
+# score is stored on each video with the model version that produced it. Videos
+# are scored at ingest; the campaign is only rescored when the active model
+# version differs from the one recorded in the store's settings.
+VIRALITY_MODEL_PATH = os.path.join('models', 'virality_model.json')
+HEURISTIC_VIRALITY_VERSION = "heuristic"
+_virality_model = {"mtime": None, "model": None}
+
+def build_virality_features(videos):
+    """Named feature matrix (pandas DataFrame, one row per video) for the virality model"""
+    metadata = pd.DataFrame.from_records([v.get('metadata') or {} for v in videos],
+                                         columns=["hashtags", "caption", "timestamp", "creative_style"])
+    scene = pd.DataFrame.from_records([v.get('activity_data') or {} for v in videos],
+                                      columns=["activity", "location", "mood"])
+    structured = pd.DataFrame.from_records([v.get('analysis_structured') or {} for v in videos],
+                                           columns=["people_count", "time_of_day"])
+    videos_frame = pd.DataFrame.from_records(videos, columns=["milk_type", "confidence", "moment_type"])
+
+    hours = pd.to_datetime(metadata["timestamp"], errors="coerce", utc=True).dt.hour
+    slots = pd.Series(np.select([hours.isin(list(hours_range)) for _, hours_range in TIME_SLOTS],
+                                [label.split(' ')[0].lower() for label, _ in TIME_SLOTS], default="unknown"))
+
+    parts = [
+        pd.get_dummies(scene["activity"], prefix="activity", dtype=float),
+        pd.get_dummies(scene["location"], prefix="location", dtype=float),
+        pd.get_dummies(scene["mood"], prefix="mood", dtype=float),
+        pd.get_dummies(structured["time_of_day"], prefix="time_of_day", dtype=float),
+        pd.get_dummies(videos_frame["milk_type"], prefix="milk_type", dtype=float),
+        pd.get_dummies(metadata["creative_style"], prefix="style", dtype=float),
+        pd.get_dummies(slots, prefix="slot", dtype=float),
+        pd.DataFrame({
+            "people_count": pd.to_numeric(structured["people_count"], errors="coerce").fillna(1).clip(0, 10),
+            "confidence": pd.to_numeric(videos_frame["confidence"], errors="coerce").fillna(0) / 100,
+            "hashtag_count": metadata["hashtags"].map(lambda tags: len(tags) if isinstance(tags, list) else 0),
+            "caption_length": metadata["caption"].fillna("").astype(str).str.len() / 100,
+            "audio_moment": videos_frame["moment_type"].isin(
+                ["audio_milk_detected", "audio_gotmilk", "both_audio_visual"]).astype(float)
+        })
+    ]
+    return pd.concat(parts, axis=1).fillna(0.0)
+
+def load_virality_model():
+    """The trained model (reloaded when the file changes), or None if there isn't one"""
+    try:
+        mtime = os.path.getmtime(VIRALITY_MODEL_PATH)
+    except OSError:
+        return None
+    if mtime != _virality_model["mtime"]:
+        with open(VIRALITY_MODEL_PATH, 'r') as f:
+            model = json.load(f)
+        model["weight_vector"] = np.asarray(model["weights"], dtype=np.float64)
+        _virality_model.update(mtime=mtime, model=model)
+        logger.info(f"🚀 Loaded virality model {model['version']} ({model['samples']} training videos)")
+    return _virality_model["model"]
+
+def score_virality(videos, model=None):
+    """(scores 0-10, model version) for videos in one batch"""
+    if not videos:
+        return np.zeros(0), HEURISTIC_VIRALITY_VERSION
+    model = model if model is not None else load_virality_model()
+
+    if model is None:
+        # No trained model yet: the original engagement/views blend
+        metadata = pd.DataFrame.from_records([v.get('metadata') or {} for v in videos],
+                                             columns=["engagement_rate", "views"])
+        engagement = pd.to_numeric(metadata["engagement_rate"], errors="coerce").fillna(0).to_numpy()
+        views = pd.to_numeric(metadata["views"], errors="coerce").fillna(0).to_numpy()
+        return engagement * 0.6 + np.minimum(views / 1000, 10) * 0.4, HEURISTIC_VIRALITY_VERSION
+
+    features = build_virality_features(videos).reindex(columns=model["features"], fill_value=0.0)
+    predicted = features.to_numpy(dtype=np.float64) @ model["weight_vector"] + model["bias"]
+    # Map predicted engagement onto 0-10 around the training mean (5 = typical)
+    scores = 10 / (1 + np.exp(-(predicted - model["target_mean"]) / model["target_std"]))
+    return scores, model["version"]
+
+def ensure_viral_scores(videos):
+    """Videos with viral_score current for the active model; rescored in one batch if any are stale"""
+    model = load_virality_model()
+    version = model["version"] if model else HEURISTIC_VIRALITY_VERSION
+    stale = [i for i, video in enumerate(videos) if video.get('viral_model_version') != version]
+    if not stale:
+        return videos
+
+    scores, version = score_virality([videos[i] for i in stale], model)
+    updated = list(videos)
+    for i, score in zip(stale, scores):
+        updated[i] = {**videos[i], "viral_score": float(score), "viral_model_version": version}
+    return updated
+
+def refresh_viral_scores():
+    """Rescore the campaign once after the active virality model changes (one settings read otherwise)"""
+    model = load_virality_model()
+    version = model["version"] if model else HEURISTIC_VIRALITY_VERSION
+    store = get_campaign_store()
+    if store.setting("viral_model_version") == version:
+        return
+    stored = store.videos()
+    videos = ensure_viral_scores(stored)
+    if videos is not stored:
+        reindex_videos(stored, videos)
+    store.set_setting("viral_model_version", version)
+    logger.info(f"🚀 Campaign scored with virality model {version}")
+
+# Leaderboards ===============================================
+# Bounded min-heaps of the best LEADERBOARD_CAPACITY videos per (metric, group),
+# where groups are the whole campaign, each activity mob and each activity.
+# Approving a video is O(log k) per board and rendering reads the heap directly.
+# Replaced or removed videos leave stale heap entries that reads skip; a board
+# that has evicted entries and then runs short is rebuilt from the records. The
+# boards are shared by every session thread; reads and writes hold their lock.
+LEADERBOARD_CAPACITY = 50
+
+LEADERBOARD_METRICS = {
+    "engagement": lambda video: (video.get('metadata') or {}).get('engagement_rate'),
+    "confidence": lambda video: video.get('confidence'),
+    "viral_score": lambda video: video.get('viral_score') if video.get('metadata') else None
+}
+
+def leaderboard_groups(video):
+    """Boards a video competes on besides the campaign-wide one"""
+    return ["all",
+            f"mob:{video.get('activity_mob', 'Unknown')}",
+            f"activity:{(video.get('activity_data') or {}).get('activity', 'unknown')}"]
+
+class Leaderboards:
+    """Per-metric, per-group top-k heaps maintained as videos are approved"""
+
+    def __init__(self, capacity=LEADERBOARD_CAPACITY):
+        self.lock = threading.RLock()  # shared by every session thread
+        self.capacity = capacity
+        self.boards = {}      # (metric, group) -> min-heap of (score, seq, key)
+        self.overflowed = set()
+        self.records = {}     # key -> video
+        self.versions = {}    # key -> seq of its live heap entries
+        self.sequence = 0
+
+    def add(self, video):
+        """Insert or replace a video on every board it belongs to"""
+        key = video.get('video_id') or video.get('filename')
+        groups = leaderboard_groups(video)
+        with self.lock:
+            self.sequence += 1
+            self.records[key] = video
+            self.versions[key] = self.sequence
+            for metric, value_of in LEADERBOARD_METRICS.items():
+                score = value_of(video)
+                if score is None:
+                    continue
+                for group in groups:
+                    self._push((metric, group), (float(score), self.sequence, key))
+
+    def _push(self, board_key, entry):
+        heap = self.boards.setdefault(board_key, [])
+        if len(heap) < self.capacity:
+            heapq.heappush(heap, entry)
+        elif entry > heap[0]:
+            heapq.heapreplace(heap, entry)
+            self.overflowed.add(board_key)
+        else:
+            self.overflowed.add(board_key)
+
+    def remove(self, video):
+        key = video.get('video_id') or video.get('filename')
+        with self.lock:
+            self.records.pop(key, None)
+            self.versions.pop(key, None)
+
+    def _rebuild(self, board_key):
+        metric, group = board_key
+        heap = []
+        for key, video in self.records.items():
+            score = LEADERBOARD_METRICS[metric](video)
+            if score is not None and group in leaderboard_groups(video):
+                entry = (float(score), self.versions[key], key)
+                if len(heap) < self.capacity:
+                    heapq.heappush(heap, entry)
+                elif entry > heap[0]:
+                    heapq.heapreplace(heap, entry)
+        self.boards[board_key] = heap
+        self.overflowed.discard(board_key)
+
+    def top(self, metric, group="all", k=10):
+        """[(video, score)] best first"""
+        board_key = (metric, group)
+        with self.lock:
+            live = [entry for entry in self.boards.get(board_key, []) if self.versions.get(entry[2]) == entry[1]]
+            if len(live) < k and board_key in self.overflowed:
+                self._rebuild(board_key)
+                live = [entry for entry in self.boards[board_key] if self.versions.get(entry[2]) == entry[1]]
+            live.sort(reverse=True)
+            return [(self.records[key], score) for score, _, key in live[:k]]
+
+    def groups(self, metric, prefix):
+        """Group names on a metric's boards starting with prefix (e.g. "activity:")"""
+        with self.lock:
+            return [group for m, group in self.boards if m == metric and group.startswith(prefix)]
+
+def build_leaderboards():
+    leaderboards = Leaderboards()
+    for video in get_campaign_store().videos():
+        leaderboards.add(video)
+    return leaderboards
+
+@st.cache_resource
+def get_leaderboards():
+    """Process-wide leaderboards, built from the store on first use"""
+    return build_leaderboards()
+
+# Campaign store ===============================================
+# Approved and quarantined videos live in SQLite instead of session state, so
+# results survive restarts and every browser tab sees the same campaign. Each
+# record is kept whole as JSON next to indexed columns for the fields pages
+# filter and aggregate on; dashboard counts are SQL queries. The approved list is
+# cached in memory and replaced (never mutated) on writes, so callers can keep
+# comparing records by identity.
+#
+# One store is shared by every session in the process. Several app processes can
+# point at the same file: refresh() notices their commits via PRAGMA data_version
+# and reads back only the rows whose revision (a counter bumped by every video
+# write) is newer than the last one it applied, so a foreign write costs as much
+# as the rows it touched. Only clear() changes the generation and forces a full
+# reload; rollup, setting and claim writes touch no videos and change nothing
+# cached. Dashboard aggregates (totals, confidence sum, milk type,
+# mob, detection method and quarantine reason counts) are counters updated in the
+# same transaction as each write and mirrored in memory, so headline metrics are
+# dictionary lookups however large the campaign gets. Posts are claimed in the
+# claims table before processing, so two moderators can't validate (and pay for)
+# the same post; a claim expires after CLAIM_TTL seconds in case its session dies
+# mid-run.
+CAMPAIGN_DB_PATH = os.getenv("CAMPAIGN_DB", "data/campaign.db")
+CLAIM_TTL = 600
+QUARANTINE_REASONS = ("missing_metadata", "no_campaign_tags", "ai_detection_failed")
+
+CAMPAIGN_SCHEMA = """
+CREATE TABLE IF NOT EXISTS videos (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    video_id TEXT,
+    filename TEXT,
+    status TEXT NOT NULL,
+    reason TEXT,
+    milk_type TEXT,
+    activity_mob TEXT,
+    confidence REAL,
+    timestamp REAL NOT NULL,
+    record TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_videos_video_id ON videos(video_id);
+CREATE INDEX IF NOT EXISTS idx_videos_filename ON videos(filename);
+CREATE INDEX IF NOT EXISTS idx_videos_milk_type ON videos(milk_type);
+CREATE INDEX IF NOT EXISTS idx_videos_activity_mob ON videos(activity_mob);
+CREATE INDEX IF NOT EXISTS idx_videos_status ON videos(status, reason);
+CREATE INDEX IF NOT EXISTS idx_videos_timestamp ON videos(timestamp);
+CREATE INDEX IF NOT EXISTS idx_videos_confidence ON videos(status, confidence);
+CREATE TABLE IF NOT EXISTS rollups (
+    granularity TEXT NOT NULL,
+    bucket REAL NOT NULL,
+    metric TEXT NOT NULL,
+    value REAL NOT NULL,
+    PRIMARY KEY (granularity, bucket, metric)
+);
+CREATE TABLE IF NOT EXISTS counters (
+    name TEXT PRIMARY KEY,
+    value REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS settings (
+    name TEXT PRIMARY KEY,
+    value TEXT
+);
+"""
+
+# Claims live in an attached database so claiming a post doesn't bump the main
+# file's data_version and make other processes reload the campaign
+CLAIMS_SCHEMA = """
+CREATE TABLE IF NOT EXISTS coordination.claims (
+    filename TEXT PRIMARY KEY,
+    owner TEXT NOT NULL,
+    claimed_at REAL NOT NULL
+);
+"""
+
+# Throughput rollups: every processing event adds to its minute, hour and day
+# bucket (approved, quarantined:<reason>, confidence/processing-time sums and
+# counts). Old minute and hour buckets are pruned as new ones start.
+ROLLUP_GRANULARITIES = {"minute": 60, "hour": 3600, "day": 86400}
+ROLLUP_RETENTION = {"minute": 2 * 86400, "hour": 90 * 86400, "day": None}
+# How far back an empty rollup table is rebuilt from the event log on startup, so
+# the rebuild doesn't grow with log history; older day buckets are not recovered
+ROLLUP_REBUILD_WINDOW = int(os.getenv("ROLLUP_REBUILD_WINDOW_DAYS", "90")) * 86400
+
+def rollup_deltas(event):
+    """Rollup metrics a processing log entry contributes to"""
+    details = event.get('details') or {}
+    if event.get('status') == "approved":
+        deltas = [("approved", 1)]
+        if event.get('confidence') is not None:
+            deltas += [("confidence_sum", float(event['confidence'])), ("confidence_count", 1)]
+    else:
+        deltas = [(f"quarantined:{event.get('reason', 'unknown')}", 1)]
+    processing_time = event.get('processing_time', details.get('processing_time'))
+    if isinstance(processing_time, (int, float)):
+        deltas += [("processing_time_sum", float(processing_time)), ("processing_time_count", 1)]
+    return deltas
+
+# ORDER BY clauses page() can sort by
+PAGE_SORTS = {
+    "newest": "id DESC",
+    "oldest": "id",
+    "confidence": "confidence DESC, id DESC",
+    "filename": "filename, id"
+}
+
+# Directory facets that are videos columns, so page() can filter on them in SQL
+SQL_FACETS = ("milk_type", "activity_mob")
+
+def counter_deltas(record, status, reason=None):
+    """Counter names ("<status>|<group>|<value>") a record contributes to, with amounts"""
+    deltas = [(f"{status}|count|", 1)]
+    if status == "approved":
+        deltas.append((f"approved|confidence_sum|", float(record.get('confidence') or 0)))
+        deltas.append((f"approved|milk_type|{record.get('milk_type') or ''}", 1))
+        deltas.append((f"approved|activity_mob|{record.get('activity_mob') or ''}", 1))
+        for method in record.get('detection_methods') or []:
+            deltas.append((f"approved|method|{method.split(':')[0]}", 1))
+    else:
+        deltas.append((f"{status}|reason|{reason or ''}", 1))
+    return deltas
+
+def record_epoch(record):
+    """A record's timestamp as epoch seconds (approved videos store epochs, logs ISO strings)"""
+    value = record.get('timestamp')
+    if isinstance(value, (int, float)):
+        return float(value)
+    try:
+        return datetime.fromisoformat(str(value)).timestamp()
+    except ValueError:
+        return time.time()
+
+def encode_record(record):
+    # numpy scalars from scoring/embedding code aren't JSON types
+    return json.dumps(record, default=lambda value: value.item() if hasattr(value, 'item') else str(value))
+
+class CampaignStore:
+    """SQLite repository for the campaign's videos, quarantine and processing log"""
+
+    def __init__(self, path=CAMPAIGN_DB_PATH):
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        self.path = path
+        self.lock = threading.RLock()
+        self.db = sqlite3.connect(path, check_same_thread=False, timeout=10)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.executescript(CAMPAIGN_SCHEMA)
+        if "revision" not in {column for _, column, *_ in self.db.execute("PRAGMA table_info(videos)")}:
+            # Databases from before incremental refresh
+            self.db.execute("ALTER TABLE videos ADD COLUMN revision INTEGER NOT NULL DEFAULT 0")
+        self.db.execute("CREATE INDEX IF NOT EXISTS idx_videos_revision ON videos(revision)")
+        self.db.execute("ATTACH DATABASE ? AS coordination", (f"{os.path.splitext(path)[0]}_claims.db",))
+        self.db.execute("PRAGMA coordination.journal_mode=WAL")
+        self.db.executescript(CLAIMS_SCHEMA)
+        self._videos = None   # approved records, oldest first
+        self._rows = {}       # id(record) -> row id
+        self._revisions = {}  # row id -> revision of the cached approved record
+        self.version = 0      # bumped on every change, ours or another process's
+        self._revision = int(self.setting("revision", 0))  # newest video write applied here
+        self._generation = self.setting("generation")
+        with self.db:
+            if self.db.execute("SELECT COUNT(*) FROM counters").fetchone()[0] == 0:
+                self._rebuild_counters()
+        self._load_counters()
+        self._data_version = self._read_data_version()
+
+    def _rebuild_counters(self):
+        """Recompute counters from the videos table (databases from before counters existed)"""
+        self.db.execute("DELETE FROM counters")
+        for status, reason, record in self.db.execute("SELECT status, reason, record FROM videos").fetchall():
+            self._bump(counter_deltas(json.loads(record), status, reason), persist_only=True)
+
+    def _load_counters(self):
+        self.counters = dict(self.db.execute("SELECT name, value FROM counters").fetchall())
+
+    def _bump(self, deltas, sign=1, persist_only=False):
+        """Apply counter deltas in the current transaction (and in memory)"""
+        self.db.executemany(
+            "INSERT INTO counters (name, value) VALUES (?, ?) "
+            "ON CONFLICT(name) DO UPDATE SET value = value + excluded.value",
+            [(name, sign * amount) for name, amount in deltas])
+        if not persist_only:
+            for name, amount in deltas:
+                self.counters[name] = self.counters.get(name, 0) + sign * amount
+
+    def _read_data_version(self):
+        return self.db.execute("PRAGMA main.data_version").fetchone()[0]
+
+    @contextmanager
+    def _write(self):
+        """Transaction holding the write lock from the start, so revisions can't interleave"""
+        with self.db:
+            self.db.execute("BEGIN IMMEDIATE")
+            yield
+
+    def _next_revision(self):
+        """Take the next video revision (inside _write)"""
+        row = self.db.execute("SELECT value FROM settings WHERE name = 'revision'").fetchone()
+        revision = int(row[0] if row else 0) + 1
+        self.db.execute("INSERT INTO settings (name, value) VALUES ('revision', ?) "
+                        "ON CONFLICT(name) DO UPDATE SET value = excluded.value", (str(revision),))
+        return revision
+
+    def _applied(self, revision):
+        """Our own write took revision; skip past it unless someone else's write is still unread"""
+        if revision == self._revision + 1:
+            self._revision = revision
+
+    def refresh(self):
+        """
+        Apply other processes' commits since the last check. Returns None if no
+        video changed, else {"reloaded", "approved", "quarantined"}: reloaded means
+        the campaign was cleared and everything should be rebuilt; otherwise
+        approved is [(old record or None, new record)] and quarantined is
+        [(record, reason)] for just the rows that changed.
+        """
+        with self.lock:
+            data_version = self._read_data_version()
+            if data_version == self._data_version:
+                return None
+            self._data_version = data_version
+
+            generation = self.setting("generation")
+            if generation != self._generation:
+                self._generation = generation
+                self._revision = int(self.setting("revision", 0))
+                self._videos = None
+                self._rows = {}
+                self._revisions = {}
+                self._load_counters()
+                self.version += 1
+                return {"reloaded": True, "approved": [], "quarantined": []}
+
+            rows = self.db.execute(
+                "SELECT id, status, reason, revision, record FROM videos WHERE revision > ? ORDER BY revision, id",
+                (self._revision,)).fetchall()
+            if rows:
+                self._revision = max(self._revision, rows[-1][3])
+            # Our own writes come back too - the cached record is already that revision
+            rows = [row for row in rows if self._revisions.get(row[0]) != row[3]]
+            if not rows:
+                return None
+
+            approved, quarantined, appended, replaced, removed = [], [], [], {}, set()
+            cached = {}
+            if self._videos is not None and any(row[0] in self._revisions for row in rows):
+                cached = {self._rows[id(video)]: video for video in self._videos}
+            for row_id, status, reason, revision, record in rows:
+                record = json.loads(record)
+                if status != "approved":
+                    # An approved video another process moved to quarantine leaves the cached list
+                    old = cached.get(row_id)
+                    if old is not None:
+                        removed.add(id(old))
+                        del self._rows[id(old)]
+                        del self._revisions[row_id]
+                    quarantined.append((record, reason))
+                    continue
+                old = cached.get(row_id)
+                approved.append((old, record))
+                if old is not None:
+                    replaced[id(old)] = record
+                    del self._rows[id(old)]
+                else:
+                    appended.append(record)
+                self._rows[id(record)] = row_id
+                self._revisions[row_id] = revision
+
+            if self._videos is not None:
+                self._videos = [replaced.get(id(video), video) for video in self._videos
+                                if id(video) not in removed] if replaced or removed else self._videos
+                self._videos = self._videos + appended
+            self._load_counters()
+            self.version += 1
+            return {"reloaded": False, "approved": approved, "quarantined": quarantined}
+
+    def claim(self, filename, owner, ttl=CLAIM_TTL):
+        """Atomically reserve a post for processing; False if it's taken or already in the campaign"""
+        with self.lock:
+            with self.db:
+                self.db.execute("BEGIN IMMEDIATE")
+                self.db.execute("DELETE FROM coordination.claims WHERE filename = ? AND claimed_at < ?",
+                                (filename, time.time() - ttl))
+                if self.db.execute("SELECT 1 FROM videos WHERE filename = ? LIMIT 1", (filename,)).fetchone():
+                    return False
+                cursor = self.db.execute("INSERT OR IGNORE INTO coordination.claims (filename, owner, claimed_at) VALUES (?, ?, ?)",
+                                         (filename, owner, time.time()))
+                return cursor.rowcount == 1
+
+    def release(self, filename, owner):
+        with self.lock:
+            with self.db:
+                self.db.execute("DELETE FROM coordination.claims WHERE filename = ? AND owner = ?", (filename, owner))
+
+    def claimed_filenames(self, ttl=CLAIM_TTL):
+        """Posts another moderator is processing right now"""
+        with self.lock:
+            rows = self.db.execute("SELECT filename FROM coordination.claims WHERE claimed_at >= ?", (time.time() - ttl,))
+            return {filename for filename, in rows}
+
+    def _load(self):
+        rows = self.db.execute(
+            "SELECT id, revision, record FROM videos WHERE status = 'approved' ORDER BY id").fetchall()
+        self._videos = [json.loads(record) for _, _, record in rows]
+        self._rows = {id(video): row_id for video, (row_id, _, _) in zip(self._videos, rows)}
+        self._revisions = {row_id: revision for row_id, revision, _ in rows}
+
+    def _insert(self, record, status, reason=None):
+        """Insert a record (inside _write); returns (row id, revision)"""
+        revision = self._next_revision()
+        cursor = self.db.execute(
+            "INSERT INTO videos (video_id, filename, status, reason, milk_type, activity_mob, confidence, timestamp, "
+            "record, revision) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            (record.get('video_id'), record.get('filename'), status, reason, record.get('milk_type'),
+             record.get('activity_mob'), record.get('confidence'), record_epoch(record), encode_record(record),
+             revision))
+        return cursor.lastrowid, revision
+
+    @staticmethod
+    def _where(status, milk_types=None, activity_mobs=None):
+        """WHERE clause and parameters for a status and optional milk type / mob filters"""
+        where, params = ["status = ?"], [status]
+        for column, values in (("milk_type", milk_types), ("activity_mob", activity_mobs)):
+            if values:
+                where.append(f"{column} IN ({', '.join('?' * len(values))})")
+                params.extend(values)
+        return " AND ".join(where), params
+
+    def count_matching(self, status="approved", milk_types=None, activity_mobs=None):
+        """How many records have one of milk_types and one of activity_mobs (either may be empty)"""
+        if not (milk_types or activity_mobs):
+            return self.count(status)
+        clause, params = self._where(status, milk_types, activity_mobs)
+        with self.lock:
+            return self.db.execute(f"SELECT COUNT(*) FROM videos WHERE {clause}", params).fetchone()[0]
+
+    def page(self, status="approved", offset=0, limit=20, sort="newest", milk_types=None, activity_mobs=None):
+        """One page of records and the total matching, filtered and sorted in SQL"""
+        clause, params = self._where(status, milk_types, activity_mobs)
+        total = self.count_matching(status, milk_types, activity_mobs)
+        with self.lock:
+            rows = self.db.execute(f"SELECT record FROM videos WHERE {clause} ORDER BY {PAGE_SORTS[sort]} LIMIT ? OFFSET ?",
+                                   params + [limit, offset]).fetchall()
+        return [json.loads(record) for record, in rows], total
+
+    def search_filenames(self, text="", limit=20):
+        """Newest approved records whose filename contains text (all if empty), at most limit"""
+        pattern = "%" + re.sub(r"([%_\\])", r"\\\1", text) + "%"
+        with self.lock:
+            rows = self.db.execute(
+                "SELECT record FROM videos WHERE status = 'approved' AND filename LIKE ? ESCAPE '\\' "
+                "ORDER BY id DESC LIMIT ?", (pattern, limit)).fetchall()
+        return [json.loads(record) for record, in rows]
+
+    def get_video(self, video_id):
+        """An approved record by Twelve Labs video id, or None"""
+        with self.lock:
+            row = self.db.execute("SELECT record FROM videos WHERE video_id = ? AND status = 'approved' "
+                                  "ORDER BY id DESC LIMIT 1", (video_id,)).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def approved_by_id(self, video_ids, chunk_size=500):
+        """{video_id: approved record} for the given Twelve Labs video ids (index lookups only)"""
+        video_ids = list(dict.fromkeys(video_ids))
+        found = {}
+        with self.lock:
+            for i in range(0, len(video_ids), chunk_size):
+                chunk = video_ids[i:i + chunk_size]
+                rows = self.db.execute(
+                    f"SELECT video_id, record FROM videos WHERE status = 'approved' "
+                    f"AND video_id IN ({', '.join('?' * len(chunk))}) ORDER BY id", chunk).fetchall()
+                # Later rows win, matching get_video
+                found.update((video_id, json.loads(record)) for video_id, record in rows)
+        return found
+
+    def iter_records(self, status="approved", chunk_size=1000, milk_types=None, activity_mobs=None):
+        """Yield stored records oldest first, reading chunk_size rows at a time"""
+        clause, params = self._where(status, milk_types, activity_mobs)
+        last_id = 0
+        while True:
+            with self.lock:
+                rows = self.db.execute(
+                    f"SELECT id, reason, record FROM videos WHERE {clause} AND id > ? ORDER BY id LIMIT ?",
+                    params + [last_id, chunk_size]).fetchall()
+            if not rows:
+                return
+            for row_id, reason, record in rows:
+                record = json.loads(record)
+                if reason:
+                    record.setdefault('reason', reason)
+                yield record
+            last_id = rows[-1][0]
+
+    def videos(self):
+        """Approved videos, oldest first. Treat the list as read-only"""
+        with self.lock:
+            if self._videos is None:
+                self._load()
+            return self._videos
+
+    def add_video(self, video):
+        with self.lock:
+            videos = self.videos()
+            with self._write():
+                row_id, revision = self._insert(video, "approved")
+                self._bump(counter_deltas(video, "approved"))
+            self._videos = videos + [video]
+            self._rows[id(video)] = row_id
+            self._revisions[row_id] = revision
+            self._applied(revision)
+            self.version += 1
+
+    def replace_videos(self, previous, current, demoted=None):
+        """
+        Persist the approved records a bulk operation swapped in (matched by
+        identity). demoted maps id(new record) to a quarantine entry that
+        replaces it instead, in the same transaction
+        """
+        demoted = demoted or {}
+        with self.lock:
+            swapped = [(old, new) for old, new in zip(previous, current)
+                       if new is not old and id(old) in self._rows]
+            if not swapped:
+                return
+            with self._write():
+                revision = self._next_revision()
+                updates, quarantines = [], []
+                for old, new in swapped:
+                    row_id = self._rows.pop(id(old))
+                    self._revisions[row_id] = revision
+                    entry = demoted.get(id(new))
+                    if entry is not None:
+                        quarantines.append((entry["reason"], record_epoch(entry), encode_record(entry), revision,
+                                            row_id))
+                        continue
+                    self._rows[id(new)] = row_id
+                    updates.append((new.get('video_id'), new.get('filename'), new.get('milk_type'),
+                                    new.get('activity_mob'), new.get('confidence'), encode_record(new), revision,
+                                    row_id))
+                self.db.executemany(
+                    "UPDATE videos SET video_id = ?, filename = ?, milk_type = ?, activity_mob = ?, "
+                    "confidence = ?, record = ?, revision = ? WHERE id = ?", updates)
+                self.db.executemany(
+                    "UPDATE videos SET status = 'quarantined', reason = ?, milk_type = NULL, activity_mob = NULL, "
+                    "confidence = NULL, timestamp = ?, record = ?, revision = ? WHERE id = ?", quarantines)
+                for old, new in swapped:
+                    self._bump(counter_deltas(old, "approved"), sign=-1)
+                    entry = demoted.get(id(new))
+                    if entry is None:
+                        self._bump(counter_deltas(new, "approved"))
+                    else:
+                        self._bump(counter_deltas(entry, "quarantined", entry["reason"]))
+            self._applied(revision)
+            replaced = {id(old): new for old, new in swapped if id(new) not in demoted}
+            dropped = {id(old) for old, new in swapped if id(new) in demoted}
+            self._videos = [replaced.get(id(video), video) for video in self._videos if id(video) not in dropped]
+            self.version += 1
+
+    def quarantine(self, reason, entry):
+        with self.lock:
+            with self._write():
+                _, revision = self._insert(entry, "quarantined", reason)
+                self._bump(counter_deltas(entry, "quarantined", reason))
+            self._applied(revision)
+            self.version += 1
+
+    def quarantined(self):
+        """Quarantine entries by reason, oldest first"""
+        entries = {reason: [] for reason in QUARANTINE_REASONS}
+        with self.lock:
+            rows = self.db.execute(
+                "SELECT reason, record FROM videos WHERE status = 'quarantined' ORDER BY id").fetchall()
+        for reason, record in rows:
+            entries.setdefault(reason, []).append(json.loads(record))
+        return entries
+
+    def quarantine_page(self, reason, offset=0, limit=20):
+        """One page of a reason's quarantine entries, oldest first"""
+        with self.lock:
+            rows = self.db.execute(
+                "SELECT record FROM videos WHERE status = 'quarantined' AND reason = ? ORDER BY id LIMIT ? OFFSET ?",
+                (reason, limit, offset)).fetchall()
+        return [json.loads(record) for record, in rows]
+
+    def count(self, status="approved", reason=None):
+        if reason:
+            return int(self.counters.get(f"{status}|reason|{reason}", 0))
+        return int(self.counters.get(f"{status}|count|", 0))
+
+    def counts_by(self, group, status="approved"):
+        """[(value, count)] for milk_type, activity_mob, method or reason, largest first"""
+        prefix = f"{status}|{group}|"
+        counts = [(name[len(prefix):], int(value)) for name, value in list(self.counters.items())
+                  if name.startswith(prefix) and value]
+        return sorted(counts, key=lambda item: -item[1])
+
+    def group_by(self, *paths, status="approved"):
+        """
+        [(values, count, average confidence)] grouped by JSON paths into the
+        records (e.g. "$.activity_data.mood"), largest group first. Aggregated in
+        SQLite, so no record is decoded in Python
+        """
+        columns = ", ".join("json_extract(record, ?)" for _ in paths)
+        groups = ", ".join(str(n) for n in range(1, len(paths) + 1))
+        with self.lock:
+            rows = self.db.execute(
+                f"SELECT {columns}, COUNT(*), AVG(confidence) FROM videos WHERE status = ? "
+                f"GROUP BY {groups} ORDER BY COUNT(*) DESC", list(paths) + [status]).fetchall()
+        return [(row[:-2], row[-2], row[-1]) for row in rows]
+
+    def average_confidence(self):
+        count = self.count()
+        return self.counters.get("approved|confidence_sum|", 0) / count if count else None
+
+    def record_rollup(self, event):
+        """Add a processing event to its minute, hour and day buckets"""
+        when = record_epoch(event)
+        deltas = rollup_deltas(event)
+        with self.lock:
+            with self.db:
+                for granularity, width in ROLLUP_GRANULARITIES.items():
+                    bucket = when - when % width
+                    started = self.db.execute("SELECT 1 FROM rollups WHERE granularity = ? AND bucket = ? LIMIT 1",
+                                              (granularity, bucket)).fetchone() is None
+                    self.db.executemany(
+                        "INSERT INTO rollups (granularity, bucket, metric, value) VALUES (?, ?, ?, ?) "
+                        "ON CONFLICT(granularity, bucket, metric) DO UPDATE SET value = value + excluded.value",
+                        [(granularity, bucket, metric, amount) for metric, amount in deltas])
+                    if started and ROLLUP_RETENTION[granularity]:
+                        self.db.execute("DELETE FROM rollups WHERE granularity = ? AND bucket < ?",
+                                        (granularity, when - ROLLUP_RETENTION[granularity]))
+
+    def rebuild_rollups(self, events):
+        """
+        Recompute the rollups from processing events (databases from before
+        rollups existed). Does nothing if another process filled them first
+        """
+        totals = {}
+        for event in events:
+            when = record_epoch(event)
+            for granularity, width in ROLLUP_GRANULARITIES.items():
+                bucket = when - when % width
+                for metric, amount in rollup_deltas(event):
+                    key = (granularity, bucket, metric)
+                    totals[key] = totals.get(key, 0) + amount
+        now = time.time()
+        rows = [(granularity, bucket, metric, value) for (granularity, bucket, metric), value in totals.items()
+                if not ROLLUP_RETENTION[granularity] or bucket >= now - ROLLUP_RETENTION[granularity]]
+        with self.lock:
+            with self._write():
+                if self.db.execute("SELECT 1 FROM rollups LIMIT 1").fetchone() is not None:
+                    return 0
+                self.db.executemany("INSERT INTO rollups (granularity, bucket, metric, value) VALUES (?, ?, ?, ?)",
+                                    rows)
+        return len(rows)
+
+    def has_rollups(self):
+        with self.lock:
+            return self.db.execute("SELECT 1 FROM rollups LIMIT 1").fetchone() is not None
+
+    def rollups(self, granularity, since=None):
+        """[(bucket, metric, value)] for a granularity, oldest bucket first"""
+        with self.lock:
+            return self.db.execute(
+                "SELECT bucket, metric, value FROM rollups WHERE granularity = ? AND bucket >= ? ORDER BY bucket",
+                (granularity, since or 0)).fetchall()
+
+    def setting(self, name, default=None):
+        with self.lock:
+            row = self.db.execute("SELECT value FROM settings WHERE name = ?", (name,)).fetchone()
+        return row[0] if row else default
+
+    def set_setting(self, name, value):
+        with self.lock:
+            with self.db:
+                self.db.execute("INSERT INTO settings (name, value) VALUES (?, ?) "
+                                "ON CONFLICT(name) DO UPDATE SET value = excluded.value", (name, value))
+
+    def filenames(self, status=None):
+        """Filenames already in the campaign, optionally for one status"""
+        query, params = "SELECT DISTINCT filename FROM videos", ()
+        if status:
+            query, params = query + " WHERE status = ?", (status,)
+        with self.lock:
+            return {filename for filename, in self.db.execute(query, params)}
+
+    def has_filename(self, filename, status="approved"):
+        with self.lock:
+            return self.db.execute("SELECT 1 FROM videos WHERE filename = ? AND status = ? LIMIT 1",
+                                   (filename, status)).fetchone() is not None
+
+    def clear(self, status=None):
+        """Delete videos (all, or one status). The event log is append-only and kept"""
+        with self.lock:
+            # Deletes can't be replayed from revisions - a new generation makes other processes reload
+            generation = uuid.uuid4().hex
+            with self._write():
+                if status:
+                    self.db.execute("DELETE FROM videos WHERE status = ?", (status,))
+                    self.db.execute("DELETE FROM counters WHERE name LIKE ?", (f"{status}|%",))
+                else:
+                    self.db.execute("DELETE FROM videos")
+                    self.db.execute("DELETE FROM counters")
+                self.db.execute("INSERT INTO settings (name, value) VALUES ('generation', ?) "
+                                "ON CONFLICT(name) DO UPDATE SET value = excluded.value", (generation,))
+            self._generation = generation
+            self._load_counters()
+            self._videos = None
+            self._rows = {}
+            self._revisions = {}
+            self.version += 1
+
+@st.cache_resource
+def get_campaign_store():
+    """Process-wide campaign store"""
+    store = CampaignStore()
+    logger.info(f"🗄️ Campaign store at {store.path}: {store.count()} approved, {store.count('quarantined')} quarantined")
+    if not store.has_rollups():
+        rebuilt = store.rebuild_rollups(get_event_log().query(since=time.time() - ROLLUP_REBUILD_WINDOW))
+        if rebuilt:
+            logger.info(f"📈 Rebuilt {rebuilt} throughput rollup rows from the event log")
+    return store
+
+# Parquet snapshots ===============================================
+# Columnar snapshot of the campaign for analytics tools. Approved and quarantined
+# videos are flattened (metadata.* and activity_data.* become their own columns)
+# and written as a Hive-partitioned dataset, date=YYYY-MM-DD/milk_type=<type>/.
+# Readers pass filters on those (or any other) columns and pyarrow skips whole
+# partitions and row groups. Each export replaces the previous snapshot; set
+# PARQUET_EXPORT_INTERVAL (seconds) to also export in the background whenever
+# the store has changed. Records are streamed from the store and flattened
+# PARQUET_CHUNK_ROWS at a time into staging files, which are then rewritten into
+# the partitioned dataset under one unified schema, so memory use is bounded by
+# the chunk size rather than the campaign size.
+PARQUET_EXPORT_DIR = os.getenv("PARQUET_EXPORT_DIR", "exports/campaign_parquet")
+PARQUET_EXPORT_INTERVAL = float(os.getenv("PARQUET_EXPORT_INTERVAL", "0"))
+PARQUET_PARTITIONS = ["date", "milk_type"]
+PARQUET_CHUNK_ROWS = 5000
+
+def campaign_rows(store):
+    """Approved then quarantined videos as export rows, streamed from the store"""
+    for video in store.iter_records("approved"):
+        yield {**video, "status": "approved", "reason": None}
+    for entry in store.iter_records("quarantined"):
+        details = entry.get('details') or {}
+        yield {**{k: v for k, v in entry.items() if k != 'details'},
+               "status": "quarantined", "reason": entry.get('reason'),
+               "metadata": details.get('metadata'),
+               "confidence": details.get('confidence'),
+               "detected_content": details.get('ai_analysis')}
+
+def campaign_frame(rows):
+    """A chunk of export rows as one flat DataFrame"""
+    if not rows:
+        return pd.DataFrame(columns=["status", "reason", "filename"] + PARQUET_PARTITIONS)
+
+    for row in rows:
+        row["timestamp"] = record_epoch(row)
+    df = pd.json_normalize(rows, sep="_")
+    # analysis_structured_* is already flattened; the raw Pegasus text stays for auditing
+    df["timestamp"] = pd.to_datetime(df["timestamp"], unit="s", utc=True)
+    df["date"] = df["timestamp"].dt.strftime("%Y-%m-%d")
+    df["milk_type"] = df.get("milk_type", pd.Series(index=df.index, dtype=object)).fillna("none")
+    # pyarrow needs one type per column; leave lists alone and stringify other mixed objects
+    for column in df.columns[df.dtypes == object]:
+        kinds = set(df[column].dropna().map(type))
+        if len(kinds) > 1 and list not in kinds:
+            df[column] = df[column].map(lambda value: None if value is None else str(value))
+    return df
+
+def export_campaign_parquet(path=PARQUET_EXPORT_DIR, store=None):
+    """Write a fresh partitioned snapshot; returns (rows, seconds)"""
+    import pyarrow as pa
+    import pyarrow.dataset as ds
+    import pyarrow.parquet as pq
+
+    start = time.time()
+    store = store or get_campaign_store()
+    staging = f"{path}.tmp"
+    chunks_dir = f"{path}.chunks"
+    for directory in (staging, chunks_dir):
+        shutil.rmtree(directory, ignore_errors=True)
+    os.makedirs(chunks_dir)
+
+    # Flatten a chunk at a time; chunks can disagree on columns and types
+    files, schemas, total = [], [], 0
+    rows = campaign_rows(store)
+    while True:
+        chunk = list(itertools.islice(rows, PARQUET_CHUNK_ROWS))
+        if not chunk:
+            break
+        table = pa.Table.from_pandas(campaign_frame(chunk), preserve_index=False).replace_schema_metadata(None)
+        files.append(os.path.join(chunks_dir, f"chunk-{len(files):05d}.parquet"))
+        pq.write_table(table, files[-1])
+        schemas.append(table.schema)
+        total += table.num_rows
+
+    if total:
+        # ...so the dataset is rewritten batch by batch under their union, and every
+        # partition file has the same schema for pandas, DuckDB and Spark
+        schema = pa.unify_schemas(schemas, promote_options="permissive")
+        ds.write_dataset(ds.dataset(files, schema=schema, format="parquet"), staging, format="parquet",
+                         partitioning=PARQUET_PARTITIONS, partitioning_flavor="hive")
+    else:
+        os.makedirs(staging)
+    shutil.rmtree(chunks_dir, ignore_errors=True)
+    # Swap directories so readers never see a half-written snapshot for long
+    retired = f"{path}.old"
+    shutil.rmtree(retired, ignore_errors=True)
+    if os.path.exists(path):
+        os.rename(path, retired)
+    os.rename(staging, path)
+    shutil.rmtree(retired, ignore_errors=True)
+    elapsed = time.time() - start
+    logger.info(f"📦 Exported {total} videos to {path} in {elapsed:.2f}s")
+    return total, elapsed
+
+def read_campaign_parquet(filters=None, columns=None, path=PARQUET_EXPORT_DIR):
+    """
+    Read a snapshot with predicate pushdown, e.g.
+    read_campaign_parquet([("milk_type", "=", "Chocolate"), ("date", ">=", "2025-06-01")])
+    """
+    return pd.read_parquet(path, engine="pyarrow", filters=filters, columns=columns)
+
+@st.cache_resource
+def start_parquet_exporter():
+    """Background thread re-exporting every PARQUET_EXPORT_INTERVAL seconds when the store changed"""
+    if PARQUET_EXPORT_INTERVAL <= 0:
+        return None
+    store = get_campaign_store()
+
+    def run():
+        exported = None
+        while True:
+            time.sleep(PARQUET_EXPORT_INTERVAL)
+            if store.version == exported:
+                continue
+            version = store.version
+            try:
+                export_campaign_parquet(store=store)
+                exported = version
+            except Exception as e:
+                logger.error(f"Parquet export failed: {str(e)}")
+
+    thread = threading.Thread(target=run, name="parquet-exporter", daemon=True)
+    thread.start()
+    logger.info(f"📦 Exporting Parquet snapshots every {PARQUET_EXPORT_INTERVAL:.0f}s to {PARQUET_EXPORT_DIR}")
+    return thread
+
+# Event log ===============================================
+# Every processing event (approved or quarantined, with its details) is appended
+# to logs/events.jsonl. When the file reaches EVENT_LOG_MAX_BYTES it's rotated to
+# events.jsonl.1 ... events.jsonl.<EVENT_LOG_BACKUPS>, oldest dropped last, so
+# the audit trail is complete up to a fixed disk budget. The UI reads the most
+# recent events from an in-memory ring buffer; Tests/query_events.py filters the
+# full history by time range and status.
+EVENT_LOG_PATH = os.getenv("EVENT_LOG_PATH", os.path.join('logs', 'events.jsonl'))
+EVENT_LOG_MAX_BYTES = int(os.getenv("EVENT_LOG_MAX_BYTES", str(10 * 1024 * 1024)))
+EVENT_LOG_BACKUPS = int(os.getenv("EVENT_LOG_BACKUPS", "20"))
+EVENT_RING_SIZE = 100
+
+class EventLog:
+    """Size-rotated append-only JSONL log with a ring buffer of recent events"""
+
+    def __init__(self, path=EVENT_LOG_PATH, max_bytes=EVENT_LOG_MAX_BYTES, backups=EVENT_LOG_BACKUPS,
+                 ring_size=EVENT_RING_SIZE):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.backups = backups
+        self.lock = threading.Lock()
+        self.rotate_lock_path = path + '.lock'
+        self.ring = deque(maxlen=ring_size)
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        # Prime the ring from the tail of the live file so a restart keeps "Recent Activity"
+        if ring_size and os.path.exists(path):
+            with open(path, 'r') as f:
+                for line in deque(f, maxlen=ring_size):
+                    try:
+                        self.ring.append(json.loads(line))
+                    except ValueError:
+                        continue
+
+    def append(self, event):
+        line = encode_record(event) + "\n"
+        with self.lock:
+            try:
+                size = os.path.getsize(self.path)
+            except OSError:
+                size = 0
+            if size and size + len(line) > self.max_bytes:
+                # Other processes append to the same file: only one of them may rotate it
+                with file_lock(self.rotate_lock_path):
+                    try:
+                        size = os.path.getsize(self.path)
+                    except OSError:
+                        size = 0
+                    if size and size + len(line) > self.max_bytes:
+                        self._rotate()
+            with open(self.path, 'a') as f:
+                f.write(line)
+            self.ring.append(event)
+
+    def _rotate(self):
+        for n in range(self.backups - 1, 0, -1):
+            if os.path.exists(f"{self.path}.{n}"):
+                os.replace(f"{self.path}.{n}", f"{self.path}.{n + 1}")
+        if self.backups:
+            os.replace(self.path, f"{self.path}.1")
+        else:
+            os.remove(self.path)
+        logger.info(f"🔄 Rotated event log {self.path}")
+
+    def recent(self, n=10):
+        """Newest n events, oldest first"""
+        with self.lock:
+            return list(self.ring)[-n:]
+
+    def files(self):
+        """Log files oldest first"""
+        rotated = [f"{self.path}.{n}" for n in range(self.backups, 0, -1)]
+        return [path for path in rotated + [self.path] if os.path.exists(path)]
+
+    def query(self, since=None, until=None, status=None, reason=None):
+        """Yield events in [since, until) (epoch seconds) matching status/reason, oldest first"""
+        for path in self.files():
+            # A file last written before the range starts can't contain anything in it
+            if since is not None and os.path.getmtime(path) < since:
+                continue
+            with open(path, 'r') as f:
+                for line in f:
+                    try:
+                        event = json.loads(line)
+                    except ValueError:
+                        continue
+                    if status and event.get('status') != status:
+                        continue
+                    if reason and event.get('reason') != reason:
+                        continue
+                    if since is not None or until is not None:
+                        when = record_epoch(event)
+                        if since is not None and when < since:
+                            continue
+                        if until is not None and when >= until:
+                            continue
+                    yield event
+
+@st.cache_resource
+def get_event_log():
+    """Process-wide event log"""
+    return EventLog()
+
+# Video catalog ===============================================
+# One in-memory index of the test_videos tree, filename -> path, size, mtime and
+# parsed _metadata.json, shared by the simulator, upload page and directory.
+# refresh() stats each known directory and rescans only those whose mtime moved
+# (a file was added, removed or renamed); metadata files are re-read only when
+# their own mtime changed. A rerun costs one stat per directory however many
+# videos are in the drop folders.
+CATALOG_ROOT = "test_videos"
+FEED_VIDEO_DIRS = ["test_videos/2%", "test_videos/choco", "test_videos/straw", "test_videos/EdgeTests/real vids META"]
+UPLOAD_VIDEO_DIRS = ["test_videos/2%", "test_videos/choco", "test_videos/straw"]
+
+class VideoCatalog:
+    """mtime-invalidated index of the .mp4 files (and their metadata) under a directory tree"""
+
+    def __init__(self, root=CATALOG_ROOT):
+        self.root = root
+        self.lock = threading.Lock()
+        self.dirs = {}         # directory -> (mtime, {filename: entry}, [subdirectories])
+        self.by_filename = {}
+        self.generation = 0    # bumped whenever a rescan changed anything
+
+    def _scan(self, directory, mtime):
+        previous = self.dirs.get(directory, (None, {}, []))[1]
+        entries, subdirs, metadata_mtimes = {}, [], {}
+        with os.scandir(directory) as listing:
+            items = sorted(listing, key=lambda item: item.name)
+        for item in items:
+            if item.is_dir():
+                subdirs.append(item.path)
+            elif item.name.endswith('_metadata.json'):
+                metadata_mtimes[item.name] = item.stat().st_mtime
+        for item in items:
+            if not item.name.endswith('.mp4') or not item.is_file():
+                continue
+            stat = item.stat()
+            metadata_name = item.name[:-len('.mp4')] + '_metadata.json'
+            metadata_mtime = metadata_mtimes.get(metadata_name)
+            old = previous.get(item.name)
+            if old and old['metadata_mtime'] == metadata_mtime:
+                metadata = old['metadata']
+            elif metadata_mtime is not None:
+                try:
+                    with open(os.path.join(directory, metadata_name), 'r') as f:
+                        metadata = json.load(f)
+                except (OSError, ValueError) as e:
+                    logger.warning(f"Unreadable metadata {metadata_name}: {str(e)}")
+                    metadata = None
+            else:
+                metadata = None
+            entries[item.name] = {
+                "path": item.path,
+                "filename": item.name,
+                "directory": directory,
+                "size": stat.st_size,
+                "mtime": stat.st_mtime,
+                "metadata": metadata,
+                "metadata_mtime": metadata_mtime
+            }
+        self.dirs[directory] = (mtime, entries, subdirs)
+        return subdirs
+
+    def refresh(self):
+        """Rescan directories whose mtime changed; True if anything did"""
+        with self.lock:
+            changed = False
+            pending = [self.root]
+            seen = set()
+            while pending:
+                directory = pending.pop()
+                seen.add(directory)
+                try:
+                    mtime = os.stat(directory).st_mtime
+                except OSError:
+                    continue
+                known = self.dirs.get(directory)
+                if known and known[0] == mtime:
+                    pending.extend(known[2])
+                    continue
+                pending.extend(self._scan(directory, mtime))
+                changed = True
+            for directory in set(self.dirs) - seen:
+                del self.dirs[directory]
+                changed = True
+            if changed:
+                by_filename = {}
+                for directory in sorted(self.dirs):
+                    for filename, entry in self.dirs[directory][1].items():
+                        by_filename.setdefault(filename, entry)
+                self.by_filename = by_filename
+                self.generation += 1
+            return changed
+
+    def videos(self, directories=None):
+        """Entries in the given directories (in that order), or all of them"""
+        self.refresh()
+        directories = directories if directories is not None else sorted(self.dirs)
+        return [entry for directory in directories
+                for entry in self.dirs.get(directory, (None, {}, []))[1].values()]
+
+    def invalidate(self, directory):
+        """Force a rescan of a directory (its files changed without the directory's mtime moving)"""
+        with self.lock:
+            if directory in self.dirs:
+                _, entries, subdirs = self.dirs[directory]
+                self.dirs[directory] = (None, entries, subdirs)
+
+    def lookup(self, filename, refresh=True):
+        """Entry for a filename anywhere in the tree, or None"""
+        if refresh or not self.dirs:
+            self.refresh()
+        return self.by_filename.get(filename)
+
+@st.cache_resource
+def get_video_catalog():
+    """Process-wide test_videos catalog"""
+    return VideoCatalog()
+
+# The simulator's queue: feed posts with metadata that haven't been approved or
+# quarantined. The handled filenames are read from the store once and then kept
+# up to date on ingest (ours and, through sync_campaign_state, other processes'),
+# and the waiting list is only re-derived when the catalog actually changed, so a
+# rerun touches the few posts it shows rather than every file and every record.
+class FeedQueue:
+    """Unprocessed feed posts, in catalog order"""
+
+    def __init__(self, catalog, directories=FEED_VIDEO_DIRS):
+        self.catalog = catalog
+        self.directories = directories
+        self.lock = threading.Lock()
+        self.handled = None              # filenames already approved or quarantined
+        self.catalog_generation = None
+        self.waiting = {}                # filename -> catalog entry
+
+    def _sync(self):
+        if self.handled is None:
+            self.handled = get_campaign_store().filenames()
+            self.catalog_generation = None
+        self.catalog.refresh()
+        if self.catalog.generation != self.catalog_generation:
+            self.waiting = {}
+            for entry in self.catalog.videos(self.directories):
+                if entry['metadata'] is not None and entry['filename'] not in self.handled:
+                    self.waiting.setdefault(entry['filename'], entry)
+            self.catalog_generation = self.catalog.generation
+
+    def upcoming(self, n, first=(), skip_paths=(), skip_filenames=()):
+        """
+        (next n waiting posts, how many are waiting). Paths in first (fresh
+        arrivals, oldest first) go to the front; posts in skip_paths (still being
+        written) or skip_filenames (claimed elsewhere) are held back.
+        """
+        with self.lock:
+            self._sync()
+            held = {filename for filename in skip_filenames if filename in self.waiting}
+            held.update(os.path.basename(path) for path in skip_paths
+                        if self.waiting.get(os.path.basename(path), {}).get('path') == path)
+
+            picked = []
+            for path in first:
+                entry = self.waiting.get(os.path.basename(path))
+                if len(picked) < n and entry and entry['path'] == path and entry['filename'] not in held \
+                        and entry not in picked:
+                    picked.append(entry)
+            for entry in self.waiting.values():
+                if len(picked) >= n:
+                    break
+                if entry['filename'] not in held and entry not in picked:
+                    picked.append(entry)
+            return picked, len(self.waiting) - len(held)
+
+    def mark_handled(self, filename):
+        """A post was approved or quarantined"""
+        with self.lock:
+            if self.handled is not None:
+                self.handled.add(filename)
+            self.waiting.pop(filename, None)
+
+    def reset(self):
+        """Re-read the handled set from the store on next use (after a clear)"""
+        with self.lock:
+            self.handled = None
+
+@st.cache_resource
+def get_feed_queue():
+    """Process-wide simulator queue over the feed folders"""
+    return FeedQueue(get_video_catalog())
+
+# Approved videos record where their file lives (video_path) at ingest time, so
+# playback never has to search for it. Uploads that only exist in memory are
+# written to a content-addressed store first. Records from before video_path
+# existed fall back to the catalog's filename index without rescanning.
+UPLOAD_STORE_DIR = os.path.join("data", "uploads")
+
+def ingest_video_path(video_file):
+    """Absolute path of the file being validated, saving in-memory uploads to the content store"""
+    if isinstance(video_file, str):
+        return os.path.abspath(video_file)
+    name = getattr(video_file, 'name', None)
+    if isinstance(name, str) and os.path.isfile(name):
+        return os.path.abspath(name)
+    try:
+        video_file.seek(0)
+        data = video_file.read()
+        video_file.seek(0)
+    except (AttributeError, OSError) as e:
+        logger.warning(f"Can't keep a copy of {name}: {str(e)}")
+        return None
+    os.makedirs(UPLOAD_STORE_DIR, exist_ok=True)
+    path = os.path.abspath(os.path.join(UPLOAD_STORE_DIR, f"{hashlib.sha256(data).hexdigest()}.mp4"))
+    if not os.path.exists(path):
+        with open(path, 'wb') as f:
+            f.write(data)
+    return path
+
+def resolve_video_path(video):
+    """Where a campaign video's file is, from the record or the catalog's last scan"""
+    if video.get('video_path'):
+        return video['video_path']
+    entry = get_video_catalog().lookup(video.get('filename'), refresh=False)
+    return entry['path'] if entry else None
+
+# Drop folder watcher ===============================================
+# Picks up posts as the upstream exporter drops them into the feed folders.
+# On Linux an inotify watch (through libc via ctypes) reports new and moved-in
+# files; elsewhere, or with WATCH_MODE=poll, the folders are listed every
+# WATCH_POLL_INTERVAL seconds. A post becomes ready once both the .mp4 and its
+# _metadata.json exist and their sizes and mtimes haven't changed for
+# WATCH_STABLE_SECONDS, so a half-written file is never validated. The simulator
+# holds back posts that are still being written and puts ready ones first; with
+# "Auto-validate" on it processes them as they arrive. A ready post that is never
+# validated here (another process took it, or its files were removed) stops
+# counting as a fresh arrival after WATCH_READY_TTL seconds.
+DROP_FOLDERS = [path for path in os.getenv("DROP_FOLDERS", os.pathsep.join(FEED_VIDEO_DIRS)).split(os.pathsep) if path]
+WATCH_MODE = os.getenv("WATCH_MODE", "auto")  # auto | inotify | poll
+WATCH_STABLE_SECONDS = float(os.getenv("WATCH_STABLE_SECONDS", "2"))
+WATCH_POLL_INTERVAL = float(os.getenv("WATCH_POLL_INTERVAL", "2"))
+WATCH_READY_TTL = float(os.getenv("WATCH_READY_TTL", "3600"))
+
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+INOTIFY_EVENT = struct.Struct("iIII")
+
+def metadata_path_for(video_path):
+    return video_path[:-len('.mp4')] + '_metadata.json'
+
+def open_inotify(folders):
+    """(inotify fd, {watch descriptor: folder}) watching folders, or (None, {}) where inotify isn't available"""
+    if not sys.platform.startswith("linux"):
+        return None, {}
+    try:
+        libc = ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True)
+        fd = libc.inotify_init()
+        if fd < 0:
+            return None, {}
+        watches = {}
+        for folder in folders:
+            wd = libc.inotify_add_watch(fd, folder.encode(), IN_CLOSE_WRITE | IN_MOVED_TO | IN_CREATE)
+            if wd < 0:
+                logger.warning(f"inotify can't watch {folder}: {os.strerror(ctypes.get_errno())}")
+            else:
+                watches[wd] = folder
+        return fd, watches
+    except (OSError, AttributeError) as e:
+        logger.warning(f"inotify unavailable, polling instead: {str(e)}")
+        return None, {}
+
+class DropFolderWatcher:
+    """Background thread turning new .mp4 + metadata pairs into ready posts"""
+
+    def __init__(self, folders=DROP_FOLDERS, mode=WATCH_MODE, on_ready=None):
+        self.folders = [folder for folder in folders if os.path.isdir(folder)]
+        self.on_ready = on_ready
+        self.lock = threading.Lock()
+        self.pending = {}   # video path -> (signature, stable since)
+        self.ready = {}     # video path -> time it became ready, in arrival order
+        self.fd, self.watches = open_inotify(self.folders) if mode in ("auto", "inotify") else (None, {})
+        self.mode = "inotify" if self.fd is not None else "poll"
+        self.listing = {folder: self._list(folder) for folder in self.folders}
+
+    def _list(self, folder):
+        try:
+            return set(os.listdir(folder))
+        except OSError:
+            return set()
+
+    def _candidate(self, folder, name):
+        """Track the post a new file belongs to"""
+        if name.endswith('_metadata.json'):
+            name = name[:-len('_metadata.json')] + '.mp4'
+        elif not name.endswith('.mp4'):
+            return
+        path = os.path.join(folder, name)
+        with self.lock:
+            if path not in self.ready:
+                self.pending.setdefault(path, (None, None))
+
+    def _signature(self, path):
+        try:
+            video, metadata = os.stat(path), os.stat(metadata_path_for(path))
+        except OSError:
+            return None
+        return (video.st_size, video.st_mtime, metadata.st_size, metadata.st_mtime)
+
+    def _check_stable(self):
+        now = time.time()
+        with self.lock:
+            for path, (previous, since) in list(self.pending.items()):
+                signature = self._signature(path)
+                if signature is None or signature != previous:
+                    self.pending[path] = (signature, now)
+                elif now - since >= WATCH_STABLE_SECONDS:
+                    del self.pending[path]
+                    self.ready[path] = now
+                    logger.info(f"📥 New post ready: {path}")
+                    if self.on_ready:
+                        self.on_ready(path)
+            for path, since in list(self.ready.items()):
+                if now - since >= WATCH_READY_TTL or not os.path.exists(path):
+                    del self.ready[path]
+
+    def _read_events(self, timeout):
+        ready, _, _ = select.select([self.fd], [], [], timeout)
+        if not ready:
+            return
+        data = os.read(self.fd, 64 * 1024)
+        offset = 0
+        while offset < len(data):
+            wd, mask, cookie, length = INOTIFY_EVENT.unpack_from(data, offset)
+            name = data[offset + INOTIFY_EVENT.size:offset + INOTIFY_EVENT.size + length].rstrip(b"\0").decode()
+            offset += INOTIFY_EVENT.size + length
+            folder = self.watches.get(wd)
+            if folder is not None:
+                self._candidate(folder, name)
+
+    def _poll(self):
+        time.sleep(WATCH_POLL_INTERVAL)
+        for folder in self.folders:
+            listing = self._list(folder)
+            for name in listing - self.listing[folder]:
+                self._candidate(folder, name)
+            self.listing[folder] = listing
+
+    def run(self):
+        while True:
+            try:
+                if self.fd is not None:
+                    self._read_events(min(1.0, WATCH_STABLE_SECONDS))
+                else:
+                    self._poll()
+                self._check_stable()
+            except Exception as e:
+                logger.error(f"Drop folder watcher error: {str(e)}")
+                time.sleep(WATCH_POLL_INTERVAL)
+
+    def writing(self):
+        """Posts seen but not yet fully written"""
+        with self.lock:
+            return set(self.pending)
+
+    def arrivals(self):
+        """Ready posts, oldest arrival first"""
+        with self.lock:
+            return list(self.ready)
+
+    def done(self, path):
+        with self.lock:
+            self.ready.pop(path, None)
+
+@st.cache_resource
+def get_drop_watcher():
+    """Process-wide drop folder watcher, started on first use"""
+    # Metadata is often rewritten in place while exporting, which doesn't touch the
+    # directory mtime, so have the catalog re-read the folder once the post is stable
+    catalog = get_video_catalog()
+    watcher = DropFolderWatcher(on_ready=lambda path: catalog.invalidate(os.path.dirname(path)))
+    threading.Thread(target=watcher.run, name="drop-watcher", daemon=True).start()
+    logger.info(f"👀 Watching {len(watcher.folders)} drop folders ({watcher.mode})")
+    return watcher
+
+# Streaming exports ===============================================
+# CSV and NDJSON exports are generators over record iterables (usually
+# store.iter_records(), which reads the database in chunks), optionally gzipped
+# on the fly, and written to exports/ chunk by chunk, so memory use doesn't grow
+# with the campaign. The browser download is only offered when the finished file
+# is under EXPORT_DOWNLOAD_LIMIT; bigger exports are picked up from disk.
+EXPORT_DIR = "exports"
+EXPORT_CHUNK_ROWS = 1000
+EXPORT_DOWNLOAD_LIMIT = int(os.getenv("EXPORT_DOWNLOAD_LIMIT", str(200 * 1024 * 1024)))
+
+# Same columns (and dict/list cells as Python reprs) as the old DataFrame export,
+# which Tests/train_virality_model.py and Tests/mob_rules_diff.py read back
+CSV_EXPORT_COLUMNS = ["video_id", "filename", "video_path", "confidence", "milk_type", "activity_mob",
+                      "mob_method", "mob_similarity", "activity_data", "detection_methods", "metadata", "mob",
+                      "timestamp", "clip_start", "clip_end", "milk_moment", "moment_type", "analysis_text",
+                      "analysis_structured", "prompt_version", "viral_score", "viral_model_version"]
+
+def csv_chunks(records, columns=CSV_EXPORT_COLUMNS, chunk_rows=EXPORT_CHUNK_ROWS):
+    """Yield CSV text a chunk of rows at a time, header first"""
+    buffer = io.StringIO()
+    writer = csv.DictWriter(buffer, fieldnames=columns, extrasaction="ignore")
+    writer.writeheader()
+    for n, record in enumerate(records, 1):
+        writer.writerow(record)
+        if n % chunk_rows == 0:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+    yield buffer.getvalue()
+
+def ndjson_chunks(records, chunk_rows=EXPORT_CHUNK_ROWS):
+    """Yield newline-delimited JSON a chunk of records at a time"""
+    lines = []
+    for record in records:
+        lines.append(encode_record(record))
+        if len(lines) == chunk_rows:
+            yield "\n".join(lines) + "\n"
+            lines = []
+    if lines:
+        yield "\n".join(lines) + "\n"
+
+def gzip_chunks(chunks):
+    """Gzip a stream of text chunks without buffering it"""
+    compressor = zlib.compressobj(wbits=31)  # 31 = gzip container
+    for chunk in chunks:
+        data = compressor.compress(chunk.encode())
+        if data:
+            yield data
+    yield compressor.flush()
+
+def write_export(chunks, name, compress=False):
+    """Write a chunk stream to exports/<name>[.gz]; returns (path, bytes written)"""
+    os.makedirs(EXPORT_DIR, exist_ok=True)
+    path = os.path.join(EXPORT_DIR, name + (".gz" if compress else ""))
+    stream = gzip_chunks(chunks) if compress else (chunk.encode() for chunk in chunks)
+    size = 0
+    # A private temp file per export, so sessions exporting at the same time can't interleave
+    with tempfile.NamedTemporaryFile(dir=EXPORT_DIR, prefix=name + ".", suffix=".tmp", delete=False) as f:
+        try:
+            for data in stream:
+                f.write(data)
+                size += len(data)
+        except BaseException:
+            f.close()
+            os.remove(f.name)
+            raise
+    os.replace(f.name, path)
+    return path, size
+
+def offer_export(chunks, name, mime, compress=False, key=None):
+    """Stream an export to disk, then offer it for download if it's small enough"""
+    start = time.time()
+    path, size = write_export(chunks, name, compress)
+    logger.info(f"📥 Exported {path} ({size / 1024 / 1024:.1f} MB) in {time.time() - start:.1f}s")
+    st.success(f"Saved `{path}` ({size / 1024 / 1024:.1f} MB)")
+    if size <= EXPORT_DOWNLOAD_LIMIT:
+        with open(path, 'rb') as f:
+            st.download_button(label=f"Download {os.path.basename(path)}", data=f,
+                               file_name=os.path.basename(path),
+                               mime="application/gzip" if compress else mime, key=key)
     else:
-        return "Milk Enthusiasts 🥛", "General milk lovers"
+        st.info("Too large to download through the browser - copy it from the server")
 
 # Initialize Twelve Labs client
 @st.cache_resource
@@ -268,59 +3703,129 @@ def init_session_state():
         st.session_state.index_id = os.getenv("CAMPAIGN_INDEX_ID", None)
         logger.info(f"Index ID from env: {st.session_state.index_id}")
     
-    if 'processed_videos' not in st.session_state:
-        st.session_state.processed_videos = []
-    
     if 'current_page' not in st.session_state:
         st.session_state.current_page = "Tech"
 
-    if 'quarantined_videos' not in st.session_state:
-        st.session_state.quarantined_videos = {
-            'missing_metadata': [],
-            'no_campaign_tags': [],
-            'ai_detection_failed': []
-        }
-
-    if 'processing_logs' not in st.session_state:
-        st.session_state.processing_logs = []  # Keep last 100    
+def session_owner():
+    """Stable id for this browser session, used to own post claims"""
+    if 'session_id' not in st.session_state:
+        st.session_state.session_id = uuid.uuid4().hex
+    return st.session_state.session_id
+
+def sync_campaign_state():
+    """Pick up other processes' writes and let this session know when someone else changed the campaign"""
+    store = get_campaign_store()
+    changes = store.refresh()
+    if changes and changes["reloaded"]:
+        logger.info("🔄 Campaign was cleared in another process - rebuilding indexes")
+        get_metadata_index.clear()
+        get_leaderboards.clear()
+        get_feed_queue().reset()
+    elif changes:
+        # Only the rows another process wrote are re-indexed
+        index = get_metadata_index()
+        leaderboards = get_leaderboards()
+        queue = get_feed_queue()
+        for _, video in changes["approved"]:
+            index.add(video, "approved")
+            leaderboards.add(video)
+            queue.mark_handled(video.get('filename'))
+        for entry, reason in changes["quarantined"]:
+            queue.mark_handled(entry.get('filename'))
+            leaderboards.remove(entry)
+            index.add({**entry, "reason": reason}, "quarantined", (entry.get('details') or {}).get('metadata'))
+    seen = st.session_state.get('seen_store_version')
+    if seen is not None and seen != store.version:
+        st.toast("🔔 The campaign was updated by another moderator")
+    st.session_state.seen_store_version = store.version
+
+def mark_own_change():
+    """Our own writes shouldn't trigger the 'updated by another moderator' notice"""
+    st.session_state.seen_store_version = get_campaign_store().version
+
+def reset_campaign():
+    """Empty the campaign and every structure derived from it (the event log and rollups are kept)"""
+    get_campaign_store().clear()
+    mark_own_change()
+    get_metadata_index.clear()
+    get_leaderboards.clear()
+    get_feed_queue().reset()
+    get_trend_engine().reset()
+    get_mob_discovery().reset()
 
 def add_to_logs(log_entry):
-    """Add entry to logs, keeping only last 100"""
-    st.session_state.processing_logs.append(log_entry)
-    if len(st.session_state.processing_logs) > 100:
-        st.session_state.processing_logs = st.session_state.processing_logs[-100:]        
+    """
+    Append entry to the processing event log and the throughput rollups. The two
+    writes aren't atomic; the log is the source of truth and the rollups are
+    rebuilt from it when the table is empty
+    """
+    get_event_log().append(log_entry)
+    get_campaign_store().record_rollup(log_entry)
 
-def calculate_confidence(analysis_text, milk_found):
+def record_approved_video(video):
+    """Add an approved video to the campaign and update the structures derived from it incrementally"""
+    try:
+        scores, version = score_virality([video])
+        video = {**video, "viral_score": float(scores[0]), "viral_model_version": version}
+    except Exception as e:
+        logger.warning(f"Virality scoring failed for {video.get('filename')}: {str(e)}")
+    get_campaign_store().add_video(video)
+    mark_own_change()
+    get_feed_queue().mark_handled(video.get('filename'))
+    get_metadata_index().add(video, "approved")
+    get_leaderboards().add(video)
+    record_trend_events(video.get('metadata'), video)
+    try:
+        update_mob_discovery(video)
+    except Exception as e:
+        logger.warning(f"Mob discovery update failed for {video.get('filename')}: {str(e)}")
+
+def record_quarantined_video(reason, log_entry, metadata=None):
+    """Quarantine a video under reason and log it"""
+    get_campaign_store().quarantine(reason, log_entry)
+    mark_own_change()
+    get_feed_queue().mark_handled(log_entry.get('filename'))
+    add_to_logs(log_entry)
+    get_metadata_index().add(log_entry, "quarantined", metadata)
+    record_trend_events(metadata)
+
+def calculate_confidence(analysis_text, milk_found, hits=None):
     """
     Calculate confidence score based on multiple signals from Pegasus analysis.
     This provides more nuanced scoring than Pegasus's binary 100/0.
     """
     if not milk_found:
         return 0
+
+    if hits is None:
+        hits = match_keywords(analysis_text)
+
+    def has_any(group):
+        return any(word in hits for word in CONFIDENCE_KEYWORDS[group])
     
     # Start with base score
     confidence = 50
     
     # Strong visual indicators (+20)
-    if any(word in analysis_text for word in ['clearly visible', 'prominently', 'definitely']):
+    if has_any("strong_visual"):
         confidence += 20
-    elif any(word in analysis_text for word in ['visible', 'can see']):
+    elif has_any("visual"):
         confidence += 10
     
     # Container/bottle visible (+15)
-    if any(word in analysis_text for word in ['bottle', 'carton', 'glass', 'container']):
+    if has_any("container"):
         confidence += 15
     
     # Label/text visible (+15)
-    if 'label' in analysis_text and any(word in analysis_text for word in ['visible', 'reads', 'says']):
+    if has_any("label") and has_any("label_read"):
         confidence += 15
     
     # Audio confirmation (+10)
-    if 'got milk' in analysis_text or 'saying' in analysis_text:
+    if has_any("audio"):
         confidence += 10
     
     # Penalties for uncertainty (-20)
-    if any(word in analysis_text for word in ['might', 'possibly', 'unclear', 'hard to see']):
+    if has_any("uncertain"):
         confidence -= 20
     
     # Cap between 0-100
@@ -333,6 +3838,10 @@ def main():
     
     # Initialize
     init_session_state()
+    sync_campaign_state()
+    get_mob_table()  # Compile mob rules up front so a bad rule file fails loudly at startup
+    start_parquet_exporter()
+    get_drop_watcher()
     client = init_twelve_labs()
     
     # Check if API is configured
@@ -375,24 +3884,35 @@ def main():
         st.markdown("---")
         if st.button("📈 Check Usage", use_container_width=True, help="Check your Twelve Labs API usage and credits"):
             check_usage(client)
+
+        st.checkbox("🔬 Profile page renders", key="profile_enabled",
+                    help=f"Write cProfile + collapsed stack files to logs/ (or set {PROFILE_ENV_VAR}=1)")
+
+        trending = get_trend_engine().trending("hashtag", n=5)
+        if trending:
+            st.markdown("---")
+            st.markdown("### 🔥 Trending Hashtags")
+            for hashtag, count, growth in trending:
+                st.caption(f"{hashtag} • {count} posts" + (f" • {growth * 100:+.0f}%" if growth is not None else " • 🆕"))
     
     # Display current page
-    if st.session_state.current_page == "API":
-        show_setupapp_details()
-    elif st.session_state.current_page == "Setup":
-        show_setup_page(client)
-    elif st.session_state.current_page == "Upload":
-        show_upload_page(client)
-    elif st.session_state.current_page == "Dashboard":
-        show_dashboard_page()
-    elif st.session_state.current_page == "Social":
-        show_instagram_simulator()
-    elif st.session_state.current_page == "Mobs":
-        show_mob_explorer()
-    elif st.session_state.current_page == "Tech":
-        show_tech_showcase()
-    elif page == "Directory":
-        show_got_milk_directory()
+    with profile_run(f"page_{st.session_state.current_page}"):
+        if st.session_state.current_page == "API":
+            show_setupapp_details()
+        elif st.session_state.current_page == "Setup":
+            show_setup_page(client)
+        elif st.session_state.current_page == "Upload":
+            show_upload_page(client)
+        elif st.session_state.current_page == "Dashboard":
+            show_dashboard_page()
+        elif st.session_state.current_page == "Social":
+            show_instagram_simulator()
+        elif st.session_state.current_page == "Mobs":
+            show_mob_explorer()
+        elif st.session_state.current_page == "Tech":
+            show_tech_showcase()
+        elif page == "Directory":
+            show_got_milk_directory()
     
 
 def check_usage(client):
@@ -617,16 +4137,8 @@ def show_upload_page(client):
         # Show test videos - Updated structure
         st.markdown("### Select a test video:")
         
-        # Get all test videos from new structure
-        test_videos = []
-        
-        # Check for videos in test_videos directory
-        video_dirs = ["test_videos/2%/*.mp4", "test_videos/choco/*.mp4", "test_videos/straw/*.mp4"]
-        
-        for pattern in video_dirs:
-            found_videos = glob.glob(pattern)
-            test_videos.extend(found_videos)
-            logger.info(f"Found {len(found_videos)} videos in {pattern}")
+        # Get all test videos from the catalog
+        test_videos = [entry['path'] for entry in get_video_catalog().videos(UPLOAD_VIDEO_DIRS)]
         
         if test_videos:
             # Group videos by type
@@ -1274,7 +4786,8 @@ def has_campaign_hashtags(metadata):
 #             logger.info(f"Quarantine contents: {[v['filename'] for v in st.session_state.quarantined_videos['ai_detection_failed']]}")
 
 #             # ADD THIS DEBUG LINE:
-#             logger.info(f"QUARANTINE DEBUG: Added {filename} to quarantine. Total in ai_detection_failed: {len(st.session_state.quarantined_videos['ai_detection_failed'])}")
+#             logger.info(f"QUARANTINE DEBUG: Added {filename} to quarantine. Total in ai_detection_failed: "
+#                         f"{len(st.session_state.quarantined_videos['ai_detection_failed'])}")
 #             st.write(f"DEBUG: Quarantine list now has {len(st.session_state.quarantined_videos['ai_detection_failed'])} videos")
             
 #             with st.expander("💭 Why was this quarantined?"):
@@ -1329,7 +4842,7 @@ def has_campaign_hashtags(metadata):
 
 #End New process -------------------------------------------------------------
 
-def process_video(client, video_file, filename=None):
+def process_video(client, video_file, filename=None, profile=None):
     """
     Complete video processing pipeline:
     1. Load video and metadata
@@ -1337,22 +4850,27 @@ def process_video(client, video_file, filename=None):
     3. If campaign participant → Send to Twelve Labs
     4. Detect milk content using Pegasus/multi-modal analysis
     5. If milk found → Assign to appropriate mob
+
+    Every run is recorded as a trace (see trace_span) rooted at "process_video".
+    Pass profile=True to profile this run regardless of the global setting.
     """
-    logger.info(f"=== PROCESS VIDEO DEBUG ===")
-    logger.info(f"Processing file: {video_file}")
-    logger.info(f"Filename: {filename}")
-    
-    # Track processing time
-    start_time = time.time()
-    
     # ===== STEP 1: SETUP AND INITIALIZATION =====
     if filename is None:
         filename = video_file.name if hasattr(video_file, 'name') else "uploaded_video.mp4"
-    
+
+    with profile_run(f"process_video_{filename}", enabled=profile):
+        with trace_span("process_video", filename=filename):
+            return _run_validation_pipeline(client, video_file, filename)
+
+def _run_validation_pipeline(client, video_file, filename):
+    """Body of process_video - runs inside the root trace span"""
+    # Track processing time
+    start_time = time.time()
+
     logger.info(f"=" * 60)
     logger.info(f"STARTING PROCESS FOR: {filename}")
     logger.info(f"=" * 60)
-    
+
     # ===== STEP 2: LOAD METADATA (Social Media Post Info) =====
     metadata = None
     video_path = None
@@ -1369,6 +4887,7 @@ def process_video(client, video_file, filename=None):
                 logger.info(f"Found metadata for user: @{metadata.get('username')}")
         else:
             logger.info("No metadata found - quarantining")
+            trace_annotate(outcome="quarantined", reason="missing_metadata")
             # QUARANTINE: Missing Metadata
             log_entry = {
                 "timestamp": datetime.now().isoformat(),
@@ -1380,8 +4899,7 @@ def process_video(client, video_file, filename=None):
                     "action": "Video must be posted with metadata"
                 }
             }
-            st.session_state.quarantined_videos['missing_metadata'].append(log_entry)
-            add_to_logs(log_entry)
+            record_quarantined_video('missing_metadata', log_entry)
             
             # Show error to user
             st.error("❌ Quarantined: Missing Metadata")
@@ -1417,14 +4935,15 @@ def process_video(client, video_file, filename=None):
     # Check if this is a campaign video
     if metadata:
         hashtags = metadata.get('hashtags', [])
-        has_campaign_tag = '#gotmilk' in hashtags or '#milkmob' in hashtags
+        with trace_span("hashtag_check", filename=filename, hashtag_count=len(hashtags)) as span:
+            has_campaign_tag = '#gotmilk' in hashtags or '#milkmob' in hashtags
+            span["has_campaign_tag"] = has_campaign_tag
 
-        logger.info(f"DEBUG: Found hashtags: {hashtags}")
-        
         if not has_campaign_tag:
             # NOT A CAMPAIGN VIDEO - QUARANTINE
             logger.info(f"REJECTED: No campaign hashtags found")
-            
+            trace_annotate(outcome="quarantined", reason="no_campaign_tags")
+
             log_entry = {
                 "timestamp": datetime.now().isoformat(),
                 "filename": filename,
@@ -1435,8 +4954,7 @@ def process_video(client, video_file, filename=None):
                     "missing": ["#gotmilk", "#milkmob"]
                 }
             }
-            st.session_state.quarantined_videos['no_campaign_tags'].append(log_entry)
-            add_to_logs(log_entry)
+            record_quarantined_video('no_campaign_tags', log_entry, metadata)
             
             st.error("❌ Quarantined: Not a #GotMilk Campaign Video!")
             
@@ -1482,19 +5000,22 @@ def process_video(client, video_file, filename=None):
         logger.info("Uploading to Twelve Labs API")
         
         # Handle both file paths and uploaded files
-        if isinstance(video_file, str):
-            # Open file if it's a path
-            with open(video_file, 'rb') as f:
+        with trace_span("upload", filename=filename) as span:
+            if isinstance(video_file, str):
+                # Open file if it's a path
+                with open(video_file, 'rb') as f:
+                    task = client.task.create(
+                        index_id=st.session_state.index_id,
+                        file=f
+                    )
+            else:
+                # Direct upload
                 task = client.task.create(
                     index_id=st.session_state.index_id,
-                    file=f
+                    file=video_file
                 )
-        else:
-            # Direct upload
-            task = client.task.create(
-                index_id=st.session_state.index_id,
-                file=video_file
-            )
+            span["task_id"] = task.id
+        trace_annotate(task_id=task.id)
         
         logger.info(f"Task created: {task.id}")
         st.info(f"Task ID: {task.id}")
@@ -1506,19 +5027,23 @@ def process_video(client, video_file, filename=None):
         progress.progress(40)
         
         max_attempts = 30  # 2.5 minutes max
-        for attempt in range(max_attempts):
-            task_status = client.task.retrieve(task.id)
-            logger.info(f"Processing status ({attempt+1}/30): {task_status.status}")
-            
-            if task_status.status == "ready":
-                break
-            elif task_status.status == "failed":
-                logger.error("Video processing failed")
-                st.error("❌ Processing failed!")
-                return
+        with trace_span("poll_task", task_id=task.id, max_attempts=max_attempts) as span:
+            for attempt in range(max_attempts):
+                task_status = client.task.retrieve(task.id)
+                span["attempts"] = attempt + 1
+                span["task_status"] = task_status.status
+                logger.info(f"Processing status ({attempt+1}/30): {task_status.status}")
                 
-            status.text(f"🔄 Status: {task_status.status} ({attempt+1}/30)")
-            time.sleep(5)
+                if task_status.status == "ready":
+                    break
+                elif task_status.status == "failed":
+                    logger.error("Video processing failed")
+                    trace_annotate(outcome="failed", reason="task_failed")
+                    st.error("❌ Processing failed!")
+                    return
+                    
+                status.text(f"🔄 Status: {task_status.status} ({attempt+1}/30)")
+                time.sleep(5)
         
         progress.progress(70)
         
@@ -1528,12 +5053,12 @@ def process_video(client, video_file, filename=None):
         
         # Get video ID
         video_id = task_status.video_id
+        trace_annotate(video_id=video_id)
         logger.info(f"Video ID: {video_id}")
         
         # Initialize detection variables
         milk_found = False
         confidence = 0.0
-        logger.info(f"🔍 CONFIDENCE DEBUG: Initialized confidence = {confidence}")
         detected_type = "Unknown"
         detection_methods = []
 
@@ -1552,77 +5077,40 @@ def process_video(client, video_file, filename=None):
 
 
         analysis_text = ""  # Store the analysis for later use
+        scene = None  # Keyword signals derived from analysis_text
         
         # Wait for SEARCH AI to complete. KEY FOR CONFIDENCE SCORING TO BE SHOW CORRECTLY 
-        time.sleep(10)
+        with trace_span("search_index_settle", video_id=video_id, seconds=10):
+            time.sleep(10)
         
         # ===== STEP 8: TRY PEGASUS ANALYSIS FIRST =====
         try:
             logger.info("Attempting Pegasus AI analysis")
             
-            #  PROMPT
-            # ENHANCED PROMPT WITH MILK MOMENT DETECTION
-            analysis_result = client.analyze(
-                video_id=video_id,
-                prompt="""Analyze this video and answer each question carefully:
-                1. Is there any milk visible in this video? (yes/no)
-                2. What type of milk is it? (chocolate, strawberry, regular, none)
-                3. What is the person doing? (drinking, pouring, cooking, exercising, dancing, studying, etc.)
-                4. Where are they? (kitchen, gym, bedroom, outdoors, classroom, etc.)
-                5. What's the mood/style? (funny, serious, energetic, chill, artistic)
-                6. How many people are in the video? (solo, duo, group)
-                7. What time of day does it appear to be? (morning, afternoon, evening, night)
-                8. Any unique activities or props? (skateboard, gaming, music, etc.)
-                9. At what timestamp (in seconds) does the person take their first sip or drink of milk?
-
-                MILK MOMENT AUDIO DETECTION - LISTEN CAREFULLY:
-                10. Does ANYONE in the video SAY ANY of these phrases: "got milk", "got chocolate", "got strawberry", "got 2%", or just the word "milk"? Listen to ALL audio carefully. (yes/no)
-                11. If yes to #10, at exactly what timestamp (in seconds) do they FIRST say any milk-related word or phrase?
-                12. If no drinking occurs in #9, at what timestamp is the milk most prominently featured or held up?
-                13. What EXACTLY does the person say about milk? Quote their words if any.
-
-                Listen to the ENTIRE audio track. People often say "got [type] milk" when showing their milk.""",
-                temperature=0.2  # Keep this for consistency!
-            )
-            
-            # Get the analysis text (handle different attribute names)
-            if hasattr(analysis_result, 'data'):
-                analysis_text = str(analysis_result.data).lower()
-            elif hasattr(analysis_result, 'content'):
-                analysis_text = str(analysis_result.content).lower()
-            elif hasattr(analysis_result, 'text'):
-                analysis_text = str(analysis_result.text).lower()
-            else:
-                analysis_text = str(analysis_result).lower()
-            
-            # Extract the timestamp
+            analysis_text = request_pegasus_analysis(client, video_id)
             
-            logger.info(f"Pegasus result: {analysis_text[:]}...")
+            logger.info(f"Pegasus result: {analysis_text[:200]}...")
 
             status.text("✅ Pegasus complete! Calculating confidence...")
             progress.progress(70)
             
             # Extract activity data from the analysis
-            activity, location, mood = extract_activity_data(analysis_text)
+            with trace_span("extract_scene", video_id=video_id) as span:
+                # Structured JSON when Pegasus followed the schema, keyword heuristics otherwise
+                scene = interpret_analysis(analysis_text)
+                activity, location, mood = scene["activity"], scene["location"], scene["mood"]
+                # Milk moment for perfect clipping
+                milk_moment, moment_type = scene["milk_moment"], scene["moment_type"]
+                span.update(activity=activity, location=location, mood=mood,
+                            milk_moment=milk_moment, moment_type=moment_type,
+                            structured=scene["structured"] is not None)
             logger.info(f"Detected - Activity: {activity}, Location: {location}, Mood: {mood}")
-
-            # ADD THESE LINES HERE:
-            # Extract milk moment for perfect clipping
-            milk_moment, moment_type = extract_milk_moment(analysis_text)
             logger.info(f"🎬 Milk moment detected: {milk_moment}s ({moment_type})")
 
-                        # ADD THIS LOGGING RIGHT AFTER:
-            logger.info(f"💾 PREPARING TO SAVE VIDEO DATA:")
-            logger.info(f"  - filename: {filename}")
-            logger.info(f"  - milk_moment: {milk_moment}")
-            logger.info(f"  - moment_type: {moment_type}")
-
             # Assign activity-based mob
-            activity_mob, mob_description = assign_activity_mob(activity, location, mood)
-            logger.info(f"Assigned to mob: {activity_mob}")
-
-            # Assign activity-based mob
-            activity_mob, mob_description = assign_activity_mob(activity, location, mood)
+            with trace_span("mob_assignment", video_id=video_id) as span:
+                activity_mob, mob_description = assign_activity_mob(activity, location, mood)
+                span["activity_mob"] = activity_mob
             logger.info(f"Assigned to mob: {activity_mob}")
                         
             # Display AI analysis
@@ -1630,7 +5118,7 @@ def process_video(client, video_file, filename=None):
                 st.write(analysis_text)
             
             # Parse results
-            milk_found = "yes" in analysis_text and ("milk" in analysis_text or "dairy" in analysis_text)
+            milk_found = scene["milk_found"]
             
             # REMOVED ALL CLIP DETECTION CODE - JUST USE SIMPLE DEFAULTS
             if milk_found:
@@ -1650,56 +5138,45 @@ def process_video(client, video_file, filename=None):
                 
                 logger.info(f"📍 Using activity-based clip times for '{activity}': {clip_start}s - {clip_end}s")
 
-            logger.info(f"🔍 CONFIDENCE DEBUG: After Pegasus, confidence still = {confidence}")
             status.text("✅ Confidence calculated! Assigning to mob...")
 
             # ===== CONFIDENCE CALCULATION =====
             if confidence == 0.0 and milk_found:
-                logger.info("🔍 CONFIDENCE DEBUG: Milk found but confidence is 0, trying main search")
                 # Get confidence from the main search
-                try:
-                    main_search = client.search.query(
-                        index_id=st.session_state.index_id,
-                        query_text="milk",
-                        options=["visual"],
-                    )
-                    
-                    logger.info(f"🔍 CONFIDENCE DEBUG: Main search returned {len(main_search.data)} results")
-                    
-                    video_found_in_search = False
-                    for idx, result in enumerate(main_search.data):
-                        if hasattr(result, 'video_id'):
-                            logger.info(f"🔍 CONFIDENCE DEBUG: Result {idx} video_id = {result.video_id}, score = {result.score}")
-                            if result.video_id == video_id:
+                with trace_span("confidence_search", video_id=video_id) as span:
+                    try:
+                        main_search = client.search.query(
+                            index_id=st.session_state.index_id,
+                            query_text="milk",
+                            options=["visual"],
+                        )
+                        span["result_count"] = len(main_search.data)
+                        
+                        video_found_in_search = False
+                        for idx, result in enumerate(main_search.data):
+                            if getattr(result, 'video_id', None) == video_id:
                                 confidence = result.score
                                 video_found_in_search = True
-                                logger.info(f"🔍 CONFIDENCE DEBUG: ✅ Found our video! Set confidence = {confidence}")
+                                span["rank"] = idx
                                 break
-                    
-                    if not video_found_in_search:
-                        logger.warning(f"🔍 CONFIDENCE DEBUG: ⚠️ Video {video_id} not found in search results")
-                        # If Pegasus confirmed milk but search didn't find it, give a conservative score
-                        confidence = 85.0
-                        logger.info(f"🔍 CONFIDENCE DEBUG: Using conservative confidence = {confidence}")
                         
-                except Exception as e:
-                    logger.error(f"🔍 CONFIDENCE DEBUG: ❌ Main search failed: {str(e)}")
-                    # If search fails but Pegasus found milk, still give it a score
-                    confidence = 70.0
-                    logger.info(f"🔍 CONFIDENCE DEBUG: Using fallback confidence = {confidence}")
+                        if not video_found_in_search:
+                            logger.warning(f"⚠️ Video {video_id} not found in confidence search results")
+                            # If Pegasus confirmed milk but search didn't find it, give a conservative score
+                            confidence = 85.0
+                            
+                    except Exception as e:
+                        logger.error(f"❌ Confidence search failed: {str(e)}")
+                        span["search_error"] = str(e)
+                        # If search fails but Pegasus found milk, still give it a score
+                        confidence = 70.0
+                    span["confidence"] = confidence
                     
-            logger.info(f"🔍 CONFIDENCE DEBUG: FINAL confidence = {confidence}")
+            logger.info(f"Final confidence: {confidence}")
             progress.progress(85)
             
             # Determine milk type
-            if "chocolate" in analysis_text:
-                detected_type = "Chocolate"
-            elif "strawberry" in analysis_text:
-                detected_type = "Strawberry"
-            elif "2%" in analysis_text or "regular" in analysis_text:
-                detected_type = "2% Regular"
-            else:
-                detected_type = "Regular"
+            detected_type = scene["milk_type"]
             
             detection_methods.append("AI Analysis (Pegasus)")
             
@@ -1713,6 +5190,8 @@ def process_video(client, video_file, filename=None):
             # Initialize clip times for fallback
             clip_start = 2.5
             clip_end = 6.5
+            milk_moment = 3.0
+            moment_type = "default"
             activity = "general"
             location = "unknown"
             mood = "neutral"
@@ -1720,34 +5199,36 @@ def process_video(client, video_file, filename=None):
             mob_description = "General milk lovers"
             
             # We'll do simplified detection here
-            try:
-                # Search for milk in the video
-                search_results = client.search.query(
-                    index_id=st.session_state.index_id,
-                    query_text="milk dairy bottle carton drinking",
-                    options=["visual", "audio"],
-                    threshold="low",
-                    page_limit=20
-                )
-                logger.info(f"🔍 CONFIDENCE DEBUG: Fallback search for video_id = {video_id}")
-                
-                # Check if our video appears in results
-                for idx, result in enumerate(search_results.data):
-                    if hasattr(result, 'video_id'):
-                        logger.info(f"🔍 CONFIDENCE DEBUG: Result {idx} has video_id = {result.video_id}")
-                        if result.video_id == video_id:
+            with trace_span("search_fallback", video_id=video_id) as span:
+                try:
+                    # Search for milk in the video
+                    search_results = client.search.query(
+                        index_id=st.session_state.index_id,
+                        query_text="milk dairy bottle carton drinking",
+                        options=["visual", "audio"],
+                        threshold="low",
+                        page_limit=20
+                    )
+                    span["result_count"] = len(search_results.data)
+                    
+                    # Check if our video appears in results
+                    for idx, result in enumerate(search_results.data):
+                        if getattr(result, 'video_id', None) == video_id:
                             milk_found = True
                             confidence = result.score
                             detection_methods.append("Multi-modal Search")
-                            logger.info(f"🔍 CONFIDENCE DEBUG: Found via fallback search, confidence = {confidence}")
+                            span.update(rank=idx, confidence=confidence)
+                            logger.info(f"Found via fallback search, confidence = {confidence}")
                             break
-                        
-            except Exception as e:
-                logger.error(f"Search failed: {str(e)}")
-                # Check if it's rate limit error
-                if "429" in str(e) or "rate limit" in str(e).lower():
-                    st.error("⚠️ API rate limit reached. Please try again later.")
-                    return
+                            
+                except Exception as e:
+                    logger.error(f"Search failed: {str(e)}")
+                    span["search_error"] = str(e)
+                    # Check if it's rate limit error
+                    if "429" in str(e) or "rate limit" in str(e).lower():
+                        trace_annotate(outcome="failed", reason="rate_limited")
+                        st.error("⚠️ API rate limit reached. Please try again later.")
+                        return
         
         progress.progress(100)
         
@@ -1793,6 +5274,15 @@ def process_video(client, video_file, filename=None):
                 st.metric("Status", "Approved")
             
             # ===== STEP 11: MOB ASSIGNMENT =====
+            # Prefer the embedding matchmaker; the rule-based mob stands if it's unavailable
+            mob_method = "rules"
+            mob_similarity = None
+            matched = match_mob_by_embedding(client, st.session_state.index_id, video_id)
+            if matched:
+                activity_mob, mob_description, mob_similarity = matched
+                mob_method = "embedding"
+                logger.info(f"🧭 Embedding matchmaker: {activity_mob} (similarity {mob_similarity:.3f})")
+
             st.markdown("### 🎯 Mob Assignment")
 
             # Show BOTH mob types
@@ -1815,12 +5305,15 @@ def process_video(client, video_file, filename=None):
                 st.caption(f"The {detected_type.lower()} milk lovers")
             
             # Save to session state
-            st.session_state.processed_videos.append({
+            record_approved_video({
                 "video_id": video_id,
                 "filename": filename,
+                "video_path": ingest_video_path(video_file),
                 "confidence": confidence,
                 "milk_type": detected_type,
                 "activity_mob": activity_mob,
+                "mob_method": mob_method,
+                "mob_similarity": mob_similarity,
                 "activity_data": {
                     "activity": activity,
                     "location": location,
@@ -1834,14 +5327,15 @@ def process_video(client, video_file, filename=None):
                 "clip_end": clip_end,
                 "milk_moment": milk_moment,  # MAKE SURE THIS IS HERE
                 "moment_type": moment_type,   # AND THIS
-                "analysis_text": analysis_text,  # ADD THIS to save the full Pegasus response
+                "analysis_text": analysis_text,  # Full Pegasus response
+                "analysis_structured": scene["structured"] if scene else None,
+                "prompt_version": PEGASUS_PROMPT_VERSION,
 
             })
 
-            # ADD THIS LOGGING RIGHT AFTER THE APPEND:
-            logger.info(f"✅ VIDEO SAVED TO DIRECTORY")
-            logger.info(f"  - Total videos now: {len(st.session_state.processed_videos)}")
-            logger.info(f"  - Last video milk_moment: {st.session_state.processed_videos[-1].get('milk_moment', 'ERROR: NOT SAVED')}")
+            trace_annotate(outcome="approved", milk_type=detected_type, confidence=confidence,
+                           activity_mob=activity_mob)
+            logger.info(f"✅ VIDEO SAVED TO DIRECTORY ({get_campaign_store().count()} total)")
             
             # CONFIDENCE DEBUG SUMMARY
             with st.expander("🔍 Confidence Debug Info"):
@@ -1855,15 +5349,10 @@ def process_video(client, video_file, filename=None):
         else:
             # QUARANTINE: AI Detection Failed
             logger.warning(f"FAILED: No milk detected in {filename}")
+            trace_annotate(outcome="quarantined", reason="ai_detection_failed")
             
-            # Analyze what was detected
-            detected_content = "Unknown beverage"
-            if analysis_text and "water" in analysis_text:
-                detected_content = "Water detected instead of milk"
-            elif analysis_text and ("soda" in analysis_text or "coke" in analysis_text or "cola" in analysis_text):
-                detected_content = "Soda/carbonated beverage detected"
-            elif analysis_text and "juice" in analysis_text:
-                detected_content = "Juice detected instead of milk"
+            # Analyze what was detected (from the same keyword pass as the scene analysis)
+            detected_content = scene["detected_content"] if scene else "Unknown beverage"
             
             log_entry = {
                 "timestamp": datetime.now().isoformat(),
@@ -1878,14 +5367,13 @@ def process_video(client, video_file, filename=None):
                     "metadata": metadata
                 }
             }
-            st.session_state.quarantined_videos['ai_detection_failed'].append(log_entry)
-            add_to_logs(log_entry)
+            record_quarantined_video('ai_detection_failed', log_entry, metadata)
             
             st.error("❌ Quarantined: No Milk Content Detected")
             st.warning(f"AI Analysis: {detected_content}")
 
             logger.info(f"QUARANTINE DEBUG: Added {filename}")
-            logger.info(f"Session state quarantine count: {len(st.session_state.quarantined_videos['ai_detection_failed'])}")
+            logger.info(f"Store quarantine count: {get_campaign_store().count('quarantined', 'ai_detection_failed')}")
             
             with st.expander("💭 Why was this quarantined?"):
                 st.write(f"**{detected_content}**")
@@ -2028,11 +5516,16 @@ def show_dashboard_page():
     st.title("📊 Campaign Dashboard")
     
     # Add tabs for different views
-    tab1, tab2, tab3 = st.tabs(["✅ Approved Videos", "🚫 Quarantine Zone", "📋 Processing Logs"])
+    tab1, tab2, tab3, tab4 = st.tabs(["✅ Approved Videos", "🚫 Quarantine Zone", "📋 Processing Logs", "📈 Throughput"])
+    store = get_campaign_store()
+    
+    with tab4:
+        show_throughput_charts(store)
     
     with tab1:
         # APPROVED VIDEOS TAB
-        if not st.session_state.processed_videos:
+        total_approved = store.count()
+        if not total_approved:
             st.info("No videos processed yet. Upload some videos to see analytics!")
             return
         
@@ -2040,25 +5533,22 @@ def show_dashboard_page():
         col1, col2, col3, col4 = st.columns(4)
         
         with col1:
-            st.metric("Total Videos", len(st.session_state.processed_videos))
+            st.metric("Total Videos", total_approved)
         
         with col2:
-            avg_confidence = sum(v['confidence'] for v in st.session_state.processed_videos) / len(st.session_state.processed_videos)
+            avg_confidence = store.average_confidence() or 0
             st.metric("Avg Confidence", f"{avg_confidence:.1f}%")
         
         with col3:
             # Count milk types
-            milk_types = {}
-            for v in st.session_state.processed_videos:
-                milk_type = v.get('milk_type', 'Regular')
-                milk_types[milk_type] = milk_types.get(milk_type, 0) + 1
+            milk_types = {milk_type or 'Regular': count for milk_type, count in store.counts_by("milk_type")}
             st.metric("Milk Types", len(milk_types))
         
         with col4:
             # Success rate calculation
-            total_quarantined = sum(len(videos) for videos in st.session_state.quarantined_videos.values())
-            total_attempts = len(st.session_state.processed_videos) + total_quarantined
-            success_rate = (len(st.session_state.processed_videos) / max(1, total_attempts)) * 100
+            total_quarantined = store.count("quarantined")
+            total_attempts = total_approved + total_quarantined
+            success_rate = (total_approved / max(1, total_attempts)) * 100
             st.metric("Success Rate", f"{success_rate:.0f}%")
         
         # Milk type breakdown
@@ -2076,23 +5566,16 @@ def show_dashboard_page():
         
         # Detection methods analysis
         st.markdown("### 🔍 Detection Methods Used")
-        all_methods = []
-        for video in st.session_state.processed_videos:
-            if 'detection_methods' in video:
-                all_methods.extend(video['detection_methods'])
-        
-        if all_methods:
-            method_counts = {}
-            for method in all_methods:
-                key = method.split(":")[0]  # Get method type
-                method_counts[key] = method_counts.get(key, 0) + 1
-            
-            for method, count in method_counts.items():
+        method_counts = store.counts_by("method")
+        if method_counts:
+            for method, count in method_counts:
                 st.write(f"- **{method}**: Used {count} times")
         
-        # Video list
+        # Video list (one page, newest first)
         st.markdown("### 📹 Processed Videos")
-        for video in reversed(st.session_state.processed_videos):
+        offset = page_controls(total_approved, "dashboard_page", DASHBOARD_PAGE_SIZE)
+        page_videos, _ = store.page(offset=offset, limit=DASHBOARD_PAGE_SIZE)
+        for video in page_videos:
             with st.expander(f"{video['filename']} - {video['confidence']:.1%} confidence"):
                 col1, col2 = st.columns(2)
                 with col1:
@@ -2105,46 +5588,54 @@ def show_dashboard_page():
                         st.markdown(f"**Methods**: {len(video['detection_methods'])}")
         
         # Export option
+        compress_exports = st.checkbox("🗜️ Gzip exports", key="dashboard_gzip_exports")
         if st.button("📥 Export Results as CSV"):
             logger.info("Exporting results to CSV")
-            df = pd.DataFrame(st.session_state.processed_videos)
-            csv = df.to_csv(index=False)
-            st.download_button(
-                label="Download CSV",
-                data=csv,
-                file_name=f"got_milk_results_{int(time.time())}.csv",
-                mime="text/csv"
-            )
+            offer_export(csv_chunks(store.iter_records()), f"got_milk_results_{int(time.time())}.csv",
+                         "text/csv", compress_exports, key="dashboard_csv_download")
+        if st.button("📥 Export Results as NDJSON"):
+            offer_export(ndjson_chunks(store.iter_records()), f"got_milk_results_{int(time.time())}.ndjson",
+                         "application/x-ndjson", compress_exports, key="dashboard_ndjson_download")
+        
+        if st.button("📦 Export Parquet Snapshot"):
+            try:
+                rows, elapsed = export_campaign_parquet()
+                st.success(f"Wrote {rows} videos to `{PARQUET_EXPORT_DIR}/` in {elapsed:.2f}s, partitioned by {' / '.join(PARQUET_PARTITIONS)}")
+            except ImportError:
+                st.error("Parquet export needs pyarrow - run `pip install -r requirements.txt`")
     
     with tab2:
         # QUARANTINE ZONE TAB
         st.markdown("### 🚫 Quarantine Zone")
         st.caption("Videos that couldn't be added to the campaign")
         
-        total_quarantined = sum(len(videos) for videos in st.session_state.quarantined_videos.values())
+        total_quarantined = store.count("quarantined")
         
         if total_quarantined == 0:
             st.success("✨ No videos in quarantine! All submissions have been valid.")
             return
         
         # Quarantine metrics
+        reason_counts = dict(store.counts_by("reason", status="quarantined"))
         col1, col2, col3 = st.columns(3)
         with col1:
-            st.metric("Missing Metadata", len(st.session_state.quarantined_videos.get('missing_metadata', [])))
+            st.metric("Missing Metadata", reason_counts.get('missing_metadata', 0))
         with col2:
-            st.metric("No Campaign Tags", len(st.session_state.quarantined_videos.get('no_campaign_tags', [])))
+            st.metric("No Campaign Tags", reason_counts.get('no_campaign_tags', 0))
         with col3:
-            st.metric("AI Detection Failed", len(st.session_state.quarantined_videos.get('ai_detection_failed', [])))
+            st.metric("AI Detection Failed", reason_counts.get('ai_detection_failed', 0))
         
         st.markdown("---")
         
-        # Show quarantined videos by category
-        for reason, videos in st.session_state.quarantined_videos.items():
-            if videos:
+        # Show quarantined videos by category, a page at a time
+        reasons = list(QUARANTINE_REASONS) + [reason for reason in reason_counts if reason not in QUARANTINE_REASONS]
+        for reason in reasons:
+            if reason_counts.get(reason):
                 reason_display = reason.replace('_', ' ').title()
                 st.markdown(f"#### 🔍 {reason_display}")
                 
-                for video in videos:
+                offset = page_controls(reason_counts[reason], f"quarantine_page_{reason}", QUARANTINE_PAGE_SIZE)
+                for video in store.quarantine_page(reason, offset, QUARANTINE_PAGE_SIZE):
                     with st.expander(f"{video['filename']} - {video['timestamp']}"):
                         st.write(f"**Reason**: {reason_display}")
                         
@@ -2172,17 +5663,19 @@ def show_dashboard_page():
     
     with tab3:
         # PROCESSING LOGS TAB
-        st.markdown("### 📋 Processing Logs (Last 100)")
+        st.markdown("### 📋 Processing Logs")
         
         # Check if logs exist
-        if 'processing_logs' not in st.session_state or not st.session_state.processing_logs:
+        event_log = get_event_log()
+        recent = event_log.recent(10)
+        if not recent:
             st.info("No processing logs yet")
             return
         
         # Summary stats
-        total_logs = len(st.session_state.processing_logs)
-        approved = sum(1 for log in st.session_state.processing_logs if log['status'] == 'approved')
-        quarantined = total_logs - approved
+        approved = store.count()
+        quarantined = store.count("quarantined")
+        total_logs = approved + quarantined
         
         col1, col2, col3 = st.columns(3)
         with col1:
@@ -2193,20 +5686,15 @@ def show_dashboard_page():
             st.metric("Quarantined", quarantined)
         
         # Export button
-        if st.button("📥 Export Logs as JSON"):
-            logs_json = json.dumps(st.session_state.processing_logs, indent=2)
-            st.download_button(
-                label="Download JSON",
-                data=logs_json,
-                file_name=f"processing_logs_{int(time.time())}.json",
-                mime="application/json"
-            )
+        if st.button("📥 Export Logs as NDJSON"):
+            offer_export(ndjson_chunks(event_log.query()), f"processing_logs_{int(time.time())}.ndjson",
+                         "application/x-ndjson", compress=True, key="logs_download")
         
         st.markdown("---")
         
         # Show recent logs (last 10)
         st.markdown("#### Recent Activity")
-        for log in reversed(st.session_state.processing_logs[-10:]):
+        for log in reversed(recent):
             status_emoji = "✅" if log['status'] == "approved" else "🚫"
             
             # Create a nice display for each log
@@ -2224,6 +5712,90 @@ def show_dashboard_page():
                 
                 st.caption(f"Processing Time: {log.get('processing_time', 'N/A')}")
 
+# Pagination -----------------------------------
+DASHBOARD_PAGE_SIZE = 20
+DIRECTORY_PAGE_SIZE = 25
+GALLERY_PAGE_SIZE = 10
+QUARANTINE_PAGE_SIZE = 10
+SIMILAR_PICKER_SIZE = 20
+
+def page_controls(total, key, page_size):
+    """Page picker for a list of total items; returns the offset of the current page"""
+    pages = max(1, -(-total // page_size))
+    if st.session_state.get(key, 1) > pages:
+        st.session_state[key] = pages
+    col1, col2 = st.columns([1, 3])
+    with col1:
+        page = st.number_input(f"Page (of {pages})", min_value=1, max_value=pages, step=1, key=key)
+    offset = (page - 1) * page_size
+    with col2:
+        st.caption(f"Showing {min(total, offset + 1)}-{min(total, offset + page_size)} of {total}")
+    return offset
+
+# Throughput -----------------------------------
+THROUGHPUT_WINDOWS = {"minute": 2 * 3600, "hour": 2 * 86400, "day": 60 * 86400}
+
+def rollup_frame(store, granularity):
+    """Rollup rows for the chart window, one row per bucket and a column per metric"""
+    since = time.time() - THROUGHPUT_WINDOWS[granularity]
+    rows = store.rollups(granularity, since)
+    if not rows:
+        return None
+    df = pd.DataFrame(rows, columns=["bucket", "metric", "value"]).pivot_table(
+        index="bucket", columns="metric", values="value", aggfunc="sum", fill_value=0)
+    df.index = [datetime.fromtimestamp(bucket) for bucket in df.index]
+    return df
+
+
+def show_throughput_charts(store):
+    """Approval/quarantine throughput, error rate, confidence and processing time from the rollups"""
+    st.markdown("### 📈 Throughput")
+    granularity = st.radio("Bucket size", list(THROUGHPUT_WINDOWS), index=1, horizontal=True,
+                           format_func=lambda g: f"per {g}", key="throughput_granularity")
+    df = rollup_frame(store, granularity)
+    if df is None:
+        st.info("No processing events in this window yet")
+        return
+    
+    def column(name):
+        return df[name] if name in df else pd.Series(0, index=df.index)
+    
+    reasons = [name for name in df.columns if name.startswith("quarantined:")]
+    quarantined = df[reasons].sum(axis=1) if reasons else pd.Series(0, index=df.index)
+    approved = column("approved")
+    total = approved + quarantined
+    
+    col1, col2, col3 = st.columns(3)
+    with col1:
+        st.metric("Processed", f"{int(total.sum()):,}")
+    with col2:
+        st.metric("Approved", f"{int(approved.sum()):,}")
+    with col3:
+        st.metric("Quarantine Rate", f"{quarantined.sum() / max(1, total.sum()) * 100:.0f}%")
+    
+    volume = go.Figure()
+    volume.add_trace(go.Bar(x=df.index, y=approved, name="Approved", marker_color="#00a651"))
+    for reason in reasons:
+        volume.add_trace(go.Bar(x=df.index, y=df[reason], name=reason.split(":", 1)[1].replace("_", " ").title()))
+    volume.add_trace(go.Scatter(x=df.index, y=(quarantined / total.where(total > 0)) * 100, name="Quarantine %",
+                                yaxis="y2", mode="lines+markers", line=dict(color="#e8453c")))
+    volume.update_layout(barmode="stack", title=f"Videos per {granularity}", height=380,
+                         yaxis=dict(title="Videos"), legend=dict(orientation="h"),
+                         yaxis2=dict(title="Quarantine %", overlaying="y", side="right", range=[0, 100]))
+    st.plotly_chart(volume, use_container_width=True)
+    
+    quality = make_subplots(specs=[[{"secondary_y": True}]])
+    confidence_count = column("confidence_count")
+    timing_count = column("processing_time_count")
+    quality.add_trace(go.Scatter(x=df.index, y=column("confidence_sum") / confidence_count.where(confidence_count > 0),
+                                 name="Avg confidence (%)", mode="lines+markers"), secondary_y=False)
+    quality.add_trace(go.Scatter(x=df.index, y=column("processing_time_sum") / timing_count.where(timing_count > 0),
+                                 name="Avg processing time (s)", mode="lines+markers"), secondary_y=True)
+    quality.update_layout(title="Confidence and processing time", height=340, legend=dict(orientation="h"))
+    quality.update_yaxes(title_text="Confidence %", secondary_y=False)
+    quality.update_yaxes(title_text="Seconds", secondary_y=True)
+    st.plotly_chart(quality, use_container_width=True)
+
 # UPDATED INSTA FEEED------------
 def show_instagram_simulator():
     """Simulate real-time Instagram uploads arriving at the platform"""
@@ -2236,36 +5808,19 @@ def show_instagram_simulator():
     
     # LIVE FEED TAB - YOUR EXISTING CODE
     # Get all videos with metadata that haven't been processed yet
-    processed_ids = [v['filename'] for v in st.session_state.processed_videos]
-    
-    # CRITICAL: Also check quarantined videos to avoid showing them again
-    quarantined_ids = []
-    for category in st.session_state.quarantined_videos.values():
-        for video in category:
-            if 'filename' in video:
-                quarantined_ids.append(video['filename'])
-    
-    # Find ALL unprocessed videos with metadata (regardless of hashtags)
-    available_videos = []
-    # ,
-    for pattern in ["test_videos/2%/*.mp4", "test_videos/choco/*.mp4", "test_videos/straw/*.mp4", "test_videos/EdgeTests/real vids META/*.mp4"]:
-        for video_path in glob.glob(pattern):
-            filename = os.path.basename(video_path)
-            
-            # Skip if already processed OR quarantined
-            if filename not in processed_ids and filename not in quarantined_ids:
-                # Check if has metadata
-                metadata_path = video_path.replace('.mp4', '_metadata.json')
-                if os.path.exists(metadata_path):
-                    with open(metadata_path, 'r') as f:
-                        metadata = json.load(f)
-                    
-                    # ADD ALL VIDEOS WITH METADATA (no hashtag filtering here!)
-                    available_videos.append({
-                        'path': video_path,
-                        'metadata': metadata,
-                        'filename': filename
-                    })
+    store = get_campaign_store()
+    
+    # Unprocessed posts with metadata (regardless of hashtags). Fresh drops go to
+    # the front; posts still being written, or that another moderator is
+    # validating right now, wait
+    watcher = get_drop_watcher()
+    arrivals = watcher.arrivals()
+    available_videos, waiting_count = get_feed_queue().upcoming(
+        4, first=arrivals, skip_paths=watcher.writing(),
+        skip_filenames=store.claimed_filenames())
+    
+    auto_validate = st.toggle("⚡ Auto-validate new drops", key="auto_validate",
+                              help="Validate posts as soon as they land in the drop folders")
     
     if not available_videos:
         st.success("🎉 All videos have been processed or quarantined! Check the Dashboard.")
@@ -2273,19 +5828,16 @@ def show_instagram_simulator():
         # Show summary
         col1, col2 = st.columns(2)
         with col1:
-            st.metric("Approved", len(st.session_state.processed_videos))
+            st.metric("Approved", store.count())
         with col2:
-            total_quarantined = sum(len(videos) for videos in st.session_state.quarantined_videos.values())
-            st.metric("Quarantined", total_quarantined)
+            st.metric("Quarantined", store.count("quarantined"))
             
         if st.button("🔄 Reset Demo"):
-            st.session_state.processed_videos = []
-            st.session_state.quarantined_videos = {
-                'missing_metadata': [],
-                'no_campaign_tags': [],
-                'ai_detection_failed': []
-            }
-            st.session_state.processing_logs = []
+            reset_campaign()
+            st.rerun()
+        if auto_validate:
+            st.caption(f"👀 Waiting for new drops ({watcher.mode})...")
+            time.sleep(WATCH_POLL_INTERVAL)
             st.rerun()
         return
     
@@ -2346,16 +5898,26 @@ def show_instagram_simulator():
             button_text = "🔍 Check Post Anyway"
             button_type = "secondary"
         
-        # Process button
-        if st.button(button_text, type=button_type, use_container_width=True):
-            with st.spinner("🤖 AI validating content..."):
-                # Process the video - it will quarantine if no campaign hashtags
-                client = init_twelve_labs()
-                # Pass the PATH, not the opened file!
-                process_video(client, next_video['path'], filename=next_video['filename'])
+        # Process button (or a fresh drop in auto mode)
+        auto_run = auto_validate and next_video['path'] in arrivals
+        if st.button(button_text, type=button_type, use_container_width=True) or auto_run:
+            owner = session_owner()
+            if not store.claim(next_video['filename'], owner):
+                st.warning("👥 Another moderator just picked up this post - moving on")
+                time.sleep(2)
+                st.rerun()
+            try:
+                with st.spinner("🤖 AI validating content..."):
+                    # Process the video - it will quarantine if no campaign hashtags
+                    client = init_twelve_labs()
+                    # Pass the PATH, not the opened file!
+                    process_video(client, next_video['path'], filename=next_video['filename'])
+            finally:
+                store.release(next_video['filename'], owner)
+                watcher.done(next_video['path'])
             
             # Only show balloons if it was actually approved
-            if next_video['filename'] in [v['filename'] for v in st.session_state.processed_videos]:
+            if store.has_filename(next_video['filename']):
                 st.balloons()
                 st.success("✅ Added to campaign!")
             
@@ -2365,7 +5927,7 @@ def show_instagram_simulator():
     # Show queue in sidebar
     with st.sidebar:
         st.markdown("### 📥 Incoming Queue")
-        st.metric("Posts Waiting", len(available_videos))
+        st.metric("Posts Waiting", waiting_count)
         
         # Color-code the queue based on hashtag status
         if len(available_videos) > 1:
@@ -2381,18 +5943,17 @@ def show_instagram_simulator():
         
         st.markdown("---")
         st.markdown("### ⚡ Live Stats")
-        st.metric("Approved", len(st.session_state.processed_videos))
+        st.metric("Approved", store.count())
         
         # Show quarantine counts
-        total_quarantined = sum(len(videos) for videos in st.session_state.quarantined_videos.values())
+        total_quarantined = store.count("quarantined")
         if total_quarantined > 0:
             st.metric("Quarantined", total_quarantined)
             
             # Show breakdown
             with st.expander("Quarantine Details"):
-                for reason, videos in st.session_state.quarantined_videos.items():
-                    if videos:
-                        st.caption(f"{reason.replace('_', ' ').title()}: {len(videos)}")
+                for reason, count in store.counts_by("reason", status="quarantined"):
+                    st.caption(f"{reason.replace('_', ' ').title()}: {count}")
     
     
 
@@ -2639,7 +6200,7 @@ def show_mob_explorer():
     </style>
     """, unsafe_allow_html=True)
     
-    if not st.session_state.processed_videos:
+    if not get_campaign_store().count():
         st.info("🎬 No videos processed yet. Head to Instagram Simulator to see AI in action!")
         return
     
@@ -2656,10 +6217,8 @@ def show_mob_explorer():
         st.markdown("### 🥛 Milk Type Distribution")
         
         # Count milk types
-        milk_type_counts = {}
-        for video in st.session_state.processed_videos:
-            milk_type = video.get('milk_type', 'Regular')
-            milk_type_counts[milk_type] = milk_type_counts.get(milk_type, 0) + 1
+        milk_type_counts = {milk_type or 'Regular': count
+                            for milk_type, count in get_campaign_store().counts_by("milk_type")}
         
         # Display milk type cards
         cols = st.columns(len(milk_type_counts))
@@ -2680,6 +6239,19 @@ def show_mob_explorer():
         st.markdown("### 🎯 Behavioral Mob Distribution")
         
         display_mob_gallery()
+
+        # More like this - the picker lists the newest matches for a filename search
+        st.markdown("#### 🔁 Find Similar Milk Moments")
+        search = st.text_input("Filename contains", key="mob_similar_search",
+                               placeholder=f"Newest {SIMILAR_PICKER_SIZE} videos if empty")
+        similar_to = st.selectbox(
+            "Pick a video",
+            get_campaign_store().search_filenames(search.strip(), limit=SIMILAR_PICKER_SIZE),
+            format_func=lambda v: f"{v['filename']} ({v.get('activity_mob', 'Unknown')})",
+            key="mob_similar_select"
+        )
+        if similar_to:
+            show_similar_videos(similar_to['video_id'])
         # Count mobs
         # mob_counts = {}
         # for video in st.session_state.processed_videos:
@@ -2712,13 +6284,8 @@ def show_mob_explorer():
         # CREATOR LEADERBOARD
         st.markdown("### 🏆 Top Performing Videos")
         
-        # Sort by confidence
-        sorted_videos = sorted(st.session_state.processed_videos, 
-                             key=lambda x: x.get('confidence', 0), 
-                             reverse=True)
-        
-        # Display top 10
-        for idx, video in enumerate(sorted_videos[:10]):
+        # Display top 10 by confidence
+        for idx, (video, _) in enumerate(get_leaderboards().top("confidence", k=10)):
             rank_emoji = ["🥇", "🥈", "🥉"][idx] if idx < 3 else f"#{idx + 1}"
             
             col1, col2, col3, col4 = st.columns([1, 3, 2, 1])
@@ -2750,32 +6317,33 @@ def show_got_milk_directory():
     st.title("📁 Got Milk Directory")
     st.markdown("Browse the best milk moments from our campaign")
     
-    if not st.session_state.processed_videos:
+    store = get_campaign_store()
+    if not store.count():
         st.info("No videos in the directory yet. Head to the Instagram Feed to start processing!")
         return
     
     # Create two columns
     col1, col2 = st.columns([1, 1])
     
-    # Initialize selected video in session state
-    if 'selected_video_index' not in st.session_state:
-        st.session_state.selected_video_index = 0
-    
     with col1:
         st.markdown("### Milk Moments Gallery")
         st.markdown("*Click any video to view details*")
         
+        # Only the current page's cards (and buttons) are built
+        offset = page_controls(store.count(), "gallery_page", GALLERY_PAGE_SIZE)
+        videos, _ = store.page(offset=offset, limit=GALLERY_PAGE_SIZE, sort="oldest")
+        
         # Create a grid of video thumbnails
         videos_per_row = 2
-        rows = len(st.session_state.processed_videos) // videos_per_row + 1
+        rows = len(videos) // videos_per_row + 1
         
         video_index = 0
         for row in range(rows):
             cols = st.columns(videos_per_row)
             for col_idx in range(videos_per_row):
-                if video_index < len(st.session_state.processed_videos):
+                if video_index < len(videos):
                     with cols[col_idx]:
-                        video = st.session_state.processed_videos[video_index]
+                        video = videos[video_index]
                         
                         # Create clickable video card
                         with st.container():
@@ -2815,8 +6383,8 @@ def show_got_milk_directory():
                             st.markdown(f"<small>🎯 {confidence:.1f}%</small>", unsafe_allow_html=True)
                             
                             # Select button
-                            if st.button(f"View", key=f"select_{video_index}"):
-                                st.session_state.selected_video_index = video_index
+                            if st.button(f"View", key=f"select_{offset + video_index}"):
+                                st.session_state.selected_video_id = video['video_id']
                                 st.rerun()
                         
                         video_index += 1
@@ -2824,10 +6392,10 @@ def show_got_milk_directory():
     with col2:
         st.markdown("### 🎬 Key Moments Panel")
         
-        if st.session_state.processed_videos:
-            selected_video = st.session_state.processed_videos[st.session_state.selected_video_index]
+        selected_video = store.get_video(st.session_state.get('selected_video_id')) or (videos[0] if videos else None)
+        if selected_video:
             logger.info(f"🎥 DIRECTORY - SELECTED VIDEO DEBUG:")
-            logger.info(f"  - Index: {st.session_state.selected_video_index}")
+            logger.info(f"  - Video ID: {selected_video.get('video_id')}")
             logger.info(f"  - Filename: {selected_video.get('filename', 'Unknown')}")
             logger.info(f"  - Milk moment: {selected_video.get('milk_moment', 'NOT FOUND')}")
             logger.info(f"  - Moment type: {selected_video.get('moment_type', 'NOT FOUND')}")
@@ -2864,8 +6432,16 @@ def show_got_milk_directory():
             with st.info(f"{moment_emoji} **{moment_type.replace('_', ' ').title()}** detected at {milk_moment:.1f}s"):
                 st.caption(f"Clip shows 1.5s before → MOMENT → 2s after")
                 
+            # Structured analyses carry the quote directly
+            structured = selected_video.get('analysis_structured')
+            if structured:
+                if structured.get('quote'):
+                    st.caption(f"💬 \"{structured['quote']}\"")
+                else:
+                    st.caption("Moment detected through AI analysis")
+
             # Get the analysis text if available (from metadata)
-            if 'analysis_text' in selected_video:
+            elif 'analysis_text' in selected_video:
                 analysis_text = selected_video.get('analysis_text', '')
                 
                 # Extract the specific answer about the milk moment
@@ -2897,21 +6473,10 @@ def show_got_milk_directory():
                 video_filename = selected_video['filename']
                 video_path = None
                 
-                # Try to find the video file
-                import glob
-                possible_patterns = [
-                    f"test_videos/*/{video_filename}",
-                    f"test_videos/2%/{video_filename}",
-                    f"test_videos/choco/{video_filename}",
-                    f"test_videos/straw/{video_filename}"
-                ]
-                
-                for pattern in possible_patterns:
-                    matches = glob.glob(pattern)
-                    if matches:
-                        video_path = matches[0]
-                        logger.info(f"📁 Found video at: {video_path}")
-                        break
+                # Recorded at ingest; legacy records use the catalog's filename index
+                video_path = resolve_video_path(selected_video)
+                if video_path:
+                    logger.info(f"📁 Found video at: {video_path}")
                 
                 if video_path and os.path.exists(video_path):
                     # Show the perfect milk moment clip
@@ -2985,6 +6550,8 @@ def show_got_milk_directory():
                 st.write(f"**Milk Type:** {selected_video.get('milk_type', 'Unknown')}")
                 st.write(f"**Confidence:** {selected_video.get('confidence', 0):.1f}%")
                 st.write(f"**Mob Assignment:** {selected_video.get('activity_mob', 'Unknown')}")
+                if selected_video.get('mob_method') == "embedding":
+                    st.caption(f"🧭 Matched by embedding similarity ({selected_video.get('mob_similarity', 0):.2f})")
 
                 # milk moment reasoning display 
                 # ADD MILK MOMENT DETAILS
@@ -3039,6 +6606,11 @@ def show_got_milk_directory():
                 else:
                     st.info("Scene analysis data not available")
             
+            # More like this
+            if 'video_id' in selected_video:
+                with st.expander("🔁 More Like This", expanded=False):
+                    show_similar_videos(selected_video['video_id'])
+            
             # Metadata
             with st.expander("Post Metadata", expanded=False):
                 st.write(f"**Caption:** {selected_metadata.get('caption', 'No caption')}")
@@ -3484,37 +7056,87 @@ def show_directory_view():
     
     st.markdown("### 📁 Processed Videos Directory")
     
-    # Get processed videos
-    processed = st.session_state.get('processed_videos', [])
-    
-    if not processed:
+    store = get_campaign_store()
+    if not store.count():
         st.info("No videos processed yet. Head to Instagram Feed to start processing!")
         return
     
+    index = get_metadata_index()
+    approved = index.match({"status": "approved"})
+    
     # Summary metrics
     col1, col2, col3, col4 = st.columns(4)
     with col1:
-        st.metric("Total Videos", len(processed))
+        st.metric("Total Videos", store.count())
     with col2:
-        avg_confidence = sum(v.get('confidence', 0) for v in processed) / len(processed) if processed else 0
+        avg_confidence = store.average_confidence() or 0
         st.metric("Avg Confidence", f"{avg_confidence:.1f}%")
     with col3:
-        milk_types = set(v.get('milk_type', 'Regular') for v in processed)
-        st.metric("Milk Types", len(milk_types))
+        st.metric("Milk Types", len(store.counts_by("milk_type")))
     with col4:
-        mobs = set(v.get('activity_mob', 'Unknown') for v in processed)
-        st.metric("Active Mobs", len(mobs))
+        st.metric("Active Mobs", len(store.counts_by("activity_mob")))
+    
+    st.markdown("---")
+    
+    # Faceted filters. Milk type and mob are store columns (counted by the store's
+    # counters, filtered and sorted in SQL); the post metadata facets are only in
+    # the inverted index
+    filters = {"status": "approved"}
+    facet_fields = [("milk_type", "🥛 Milk Type"), ("activity_mob", "🎯 Mob"), ("hashtag", "#️⃣ Hashtag"),
+                    ("location", "📍 Location"), ("creative_style", "🎨 Style"), ("username", "👤 Creator")]
+    facet_cols = st.columns(3)
+    for idx, (field, label) in enumerate(facet_fields):
+        with facet_cols[idx % 3]:
+            if field in SQL_FACETS:
+                options = [(value, count) for value, count in store.counts_by(field) if value]
+            else:
+                options = index.facet(field, approved)
+            counts = dict(options)
+            filters[field] = st.multiselect(label, [value for value, _ in options],
+                                            format_func=lambda value, counts=counts: f"{value} ({counts[value]})",
+                                            key=f"dir_facet_{field}")
+    sort = st.selectbox("Sort by", list(PAGE_SORTS), format_func=str.title, key="dir_sort")
+    
+    if any(filters[field] for field, _ in facet_fields if field not in SQL_FACETS):
+        processed = index.query(filters)
+        if sort == "newest":
+            processed = processed[::-1]
+        elif sort == "confidence":
+            processed = sorted(processed, key=lambda v: -(v.get('confidence') or 0))
+        elif sort == "filename":
+            processed = sorted(processed, key=lambda v: v.get('filename') or '')
+        total = len(processed)
+        
+        def page_videos(offset):
+            return processed[offset:offset + DIRECTORY_PAGE_SIZE]
+    else:
+        total = store.count_matching(milk_types=filters["milk_type"], activity_mobs=filters["activity_mob"])
+        
+        def page_videos(offset):
+            return store.page(offset=offset, limit=DIRECTORY_PAGE_SIZE, sort=sort,
+                              milk_types=filters["milk_type"], activity_mobs=filters["activity_mob"])[0]
+    if total != store.count():
+        st.caption(f"{total} of {store.count()} videos match")
     
     st.markdown("---")
     
     # Export buttons
     export_col1, export_col2, export_col3 = st.columns([1, 1, 4])
+    with export_col3:
+        compress_exports = st.checkbox("🗜️ Gzip", key="dir_gzip_exports")
+    def matching_records():
+        # Streamed from the database (milk type and mob filtered in SQL), oldest first
+        records = store.iter_records(milk_types=filters["milk_type"], activity_mobs=filters["activity_mob"])
+        return (record for record in records if record_matches(record, filters))
+    
     with export_col1:
         if st.button("📊 Export to CSV", use_container_width=True, key="dir_export_csv"):
-            st.info("Export feature coming soon!")
+            offer_export(csv_chunks(matching_records()), f"got_milk_directory_{int(time.time())}.csv",
+                         "text/csv", compress_exports, key="dir_csv_download")
     with export_col2:
         if st.button("📄 Export to JSON", use_container_width=True, key="dir_export_json"):
-            st.info("Export feature coming soon!")
+            offer_export(ndjson_chunks(matching_records()), f"got_milk_directory_{int(time.time())}.ndjson",
+                         "application/x-ndjson", compress_exports, key="dir_json_download")
     
     st.markdown("---")
     
@@ -3527,8 +7149,9 @@ def show_directory_view():
     
     st.markdown("---")
     
-    # Display each video in finder style
-    for idx, video in enumerate(processed):
+    # Display one page of videos in finder style
+    offset = page_controls(total, "dir_page", DIRECTORY_PAGE_SIZE)
+    for idx, video in enumerate(page_videos(offset), offset):
         col1, col2 = st.columns([2, 3])
         
         with col1:
@@ -3577,7 +7200,6 @@ def show_directory_view():
             
             # Timestamp
             if 'timestamp' in video:
-                import time
                 time_str = time.strftime('%I:%M %p', time.localtime(video['timestamp']))
                 metadata_items.append(f"Processed: {time_str}")
             
@@ -3591,49 +7213,100 @@ def show_directory_view():
     st.markdown("---")
     st.markdown("### 🎬 Bulk Actions")
     
-    action_col1, action_col2, action_col3, action_col4 = st.columns(4)
+    action_col1, action_col2, action_col3, action_col4, action_col5 = st.columns(5)
     with action_col1:
         if st.button("🏷️ Re-tag All", use_container_width=True, key="dir_retag"):
-            st.info("Bulk re-tagging coming soon!")
+            start = time.time()
+            campaign = store.videos()
+            with st.spinner("Re-tagging from stored analyses..."):
+                retagged, changed = retag_videos(campaign)
+            # Swap the whole list in at once so a rerun never sees a half-tagged campaign
+            demoted = reindex_videos(campaign, retagged)
+            elapsed = time.time() - start
+            logger.info(f"🏷️ Re-tagged {len(retagged)} videos ({changed} changed, {demoted} quarantined) in {elapsed:.2f}s")
+            st.success(f"Re-tagged {len(retagged)} videos - {changed} changed ({elapsed:.2f}s)")
+            if demoted:
+                st.warning(f"{demoted} videos no longer show milk and were moved to quarantine")
     with action_col2:
         if st.button("🤖 Re-analyze All", use_container_width=True, key="dir_reanalyze"):
-            st.info("Bulk analysis coming soon!")
+            client = init_twelve_labs()
+            progress = st.progress(0)
+            status = st.empty()
+
+            def show_progress(done, total, stats):
+                progress.progress(done / total if total else 1.0)
+                status.text(f"{done}/{total} - {stats['analyzed']} analyzed, "
+                            f"{stats['current'] + stats['cached']} up to date, {stats['failed']} failed")
+
+            start = time.time()
+            campaign = store.videos()
+            updated, stats = reanalyze_videos(client, campaign, on_progress=show_progress)
+            demoted = reindex_videos(campaign, updated)
+            if demoted:
+                st.warning(f"{demoted} videos no longer show milk and were moved to quarantine")
+            logger.info(f"🤖 Re-analyzed campaign with prompt {PEGASUS_PROMPT_VERSION}: {stats} in {time.time() - start:.1f}s")
+            if stats["failed"]:
+                st.warning(f"{stats['failed']} videos failed - run Re-analyze All again to retry them")
+            else:
+                st.success(f"All {stats['total']} videos are on prompt {PEGASUS_PROMPT_VERSION}")
     with action_col3:
+        if st.button("🧭 Sync Embeddings", use_container_width=True, key="dir_sync_embeddings",
+                     help="Fetch missing video and mob embeddings from Twelve Labs, then re-tag"):
+            if not st.session_state.get('index_id'):
+                st.error("Set CAMPAIGN_INDEX_ID to fetch embeddings")
+                st.stop()
+            progress = st.progress(0)
+            campaign = store.videos()
+            stats = sync_embeddings(init_twelve_labs(), st.session_state.index_id, campaign,
+                                    on_progress=lambda done, total: progress.progress(done / total))
+            progress.progress(1.0)
+            retagged, changed = retag_videos(campaign)
+            demoted = reindex_videos(campaign, retagged)
+            if demoted:
+                st.warning(f"{demoted} videos no longer show milk and were moved to quarantine")
+            logger.info(f"🧭 Synced embeddings: {stats}, {changed} videos re-tagged")
+            st.success(f"Fetched {stats['fetched']} embeddings ({stats['failed']} failed) - {changed} videos re-tagged")
+    with action_col4:
         if st.button("📤 Share Report", use_container_width=True, key="dir_share"):
             st.info("Report sharing coming soon!")
-    with action_col4:
+    with action_col5:
         if st.button("🗑️ Clear All", use_container_width=True, key="dir_clear"):
             if st.button("⚠️ Confirm Clear", key="dir_confirm_clear"):
-                st.session_state.processed_videos = []
+                for video in index.query({"status": "approved"}):
+                    index.remove(video)
+                store.clear("approved")
+                mark_own_change()
+                get_leaderboards.clear()
+                get_mob_discovery().reset()
+                get_feed_queue().reset()
                 st.rerun()
 
 # directy end =============
 
+def campaign_breakdown(group_path, detail_path, group_default="unknown"):
+    """{group: [(detail, count)]} over approved videos, most common detail first (one SQL aggregate)"""
+    breakdown = {}
+    for (group, detail), count, _ in get_campaign_store().group_by(group_path, detail_path):
+        breakdown.setdefault(group or group_default, []).append((detail, count))
+    return breakdown
+
 def show_milk_type_analysis():
     """Primary view showing milk type distribution - THE MAIN INSIGHT"""
     st.markdown("### 🥛 Milk Type Distribution - Primary Campaign Metric")
     st.info("🔬 **Twelve Labs Multi-Modal Detection**: Visual (bottle/label) + Audio (spoken) + Text (on-screen)")
     
-    # Gather milk type data
+    # Gather milk type data (SQL aggregates, not a pass over every record)
+    creators = campaign_breakdown("$.milk_type", "$.metadata.username", "Unknown")
+    activities = campaign_breakdown("$.milk_type", "$.activity_data.activity", "Unknown")
     milk_types = {}
-    for video in st.session_state.processed_videos:
-        milk_type = video.get('milk_type', 'Unknown')
-        if milk_type not in milk_types:
-            milk_types[milk_type] = {
-                'count': 0,
-                'creators': [],
-                'activities': [],
-                'confidence_scores': []
-            }
-        
-        milk_types[milk_type]['count'] += 1
-        milk_types[milk_type]['confidence_scores'].append(video.get('confidence', 0))
-        
-        if video.get('metadata'):
-            milk_types[milk_type]['creators'].append(video['metadata'].get('username', 'Unknown'))
-        
-        if video.get('activity_data'):
-            milk_types[milk_type]['activities'].append(video['activity_data'].get('activity', 'unknown'))
+    for (milk_type,), count, avg_confidence in get_campaign_store().group_by("$.milk_type"):
+        milk_type = milk_type or 'Unknown'
+        milk_types[milk_type] = {
+            'count': count,
+            'avg_confidence': avg_confidence or 0,
+            'creators': [creator for creator, _ in creators.get(milk_type, []) if creator],
+            'activities': [activity for activity, _ in activities.get(milk_type, []) if activity]
+        }
     
     # Display milk type cards
     cols = st.columns(3)
@@ -3648,7 +7321,7 @@ def show_milk_type_analysis():
     for idx, (milk_type, data) in enumerate(milk_types.items()):
         with cols[idx % 3]:
             style = milk_type_colors.get(milk_type, {'gradient': 'linear-gradient(135deg, #95A5A6 0%, #7F8C8D 100%)', 'emoji': '🥛'})
-            avg_confidence = sum(data['confidence_scores']) / len(data['confidence_scores']) if data['confidence_scores'] else 0
+            avg_confidence = data['avg_confidence']
             
             st.markdown(f"""
             <div style="background: {style['gradient']}; 
@@ -3667,8 +7340,8 @@ def show_milk_type_analysis():
             </div>
             """, unsafe_allow_html=True)
             
-            # Show unique activities for this milk type
-            unique_activities = list(set(data['activities']))
+            # Show the most common activities for this milk type
+            unique_activities = data['activities']
             if unique_activities:
                 st.caption(f"**Activities**: {', '.join(act.title() for act in unique_activities[:3])}")
             
@@ -3714,35 +7387,27 @@ def show_activity_intelligence():
     st.markdown("### 🎯 Deep Activity Analysis")
     st.info("🔬 **Twelve Labs Exclusive**: We don't just see 'person with milk' - we understand the complete context of their activity")
     
-    # Gather activity data
+    # Gather activity data (SQL aggregates, not a pass over every record)
+    locations = campaign_breakdown("$.activity_data.activity", "$.activity_data.location")
+    moods = campaign_breakdown("$.activity_data.activity", "$.activity_data.mood")
+    creators = campaign_breakdown("$.activity_data.activity", "$.metadata.username")
     activity_data = {}
-    for video in st.session_state.processed_videos:
-        activity = video.get('activity_data', {}).get('activity', 'unknown')
-        location = video.get('activity_data', {}).get('location', 'unknown')
-        mood = video.get('activity_data', {}).get('mood', 'unknown')
-        
-        if activity not in activity_data:
-            activity_data[activity] = {
-                'count': 0,
-                'locations': [],
-                'moods': [],
-                'creators': []
-            }
-        
-        activity_data[activity]['count'] += 1
-        activity_data[activity]['locations'].append(location)
-        activity_data[activity]['moods'].append(mood)
-        
-        # Only add creator if metadata exists
-        if video.get('metadata') and video['metadata'].get('username'):
-            activity_data[activity]['creators'].append(video['metadata']['username'])
+    for (activity,), count, _ in get_campaign_store().group_by("$.activity_data.activity"):
+        activity = activity or 'unknown'
+        activity_data[activity] = {
+            'count': count,
+            'locations': [location for location, _ in locations.get(activity, [])],
+            'moods': [mood for mood, _ in moods.get(activity, [])],
+            # Only creators whose metadata has a username, most active first
+            'creators': [creator for creator, _ in creators.get(activity, []) if creator]
+        }
     
     # Display activity cards
     for activity, data in activity_data.items():
         with st.container():
             # Get unique locations and moods
-            unique_locations = list(set(loc for loc in data['locations'] if loc != 'unknown'))
-            unique_moods = list(set(mood for mood in data['moods'] if mood != 'unknown'))
+            unique_locations = [loc for loc in data['locations'] if loc and loc != 'unknown']
+            unique_moods = [mood for mood in data['moods'] if mood and mood != 'unknown']
             
             st.markdown(f"""
             <div class="intelligence-card">
@@ -3785,15 +7450,7 @@ def show_engagement_champions():
     """Show top creators by engagement rate"""
     st.markdown("#### 💫 Top Engaged Creators")
     
-    # Sort by engagement
-    creators_with_metadata = [v for v in st.session_state.processed_videos if v.get('metadata')]
-    sorted_creators = sorted(
-        creators_with_metadata,
-        key=lambda x: x.get('metadata', {}).get('engagement_rate', 0),
-        reverse=True
-    )
-    
-    for rank, video in enumerate(sorted_creators[:5], 1):
+    for rank, (video, _) in enumerate(get_leaderboards().top("engagement", k=5), 1):
         metadata = video.get('metadata', {})
         activity_data = video.get('activity_data', {})
         
@@ -3826,7 +7483,7 @@ def show_activity_masters():
     # Group by activity and find top performer
     activity_masters = {}
     
-    for video in st.session_state.processed_videos:
+    for video in get_campaign_store().videos():
         activity = video.get('activity_data', {}).get('activity', 'unknown')
         engagement = video.get('metadata', {}).get('engagement_rate', 0)
         
@@ -3865,10 +7522,9 @@ def show_scene_analytics():
         st.markdown("#### 🎭 Mood Distribution")
         
         # Collect mood data
-        mood_counts = {}
-        for video in st.session_state.processed_videos:
-            mood = video.get('activity_data', {}).get('mood', 'unknown')
-            mood_counts[mood] = mood_counts.get(mood, 0) + 1
+        store = get_campaign_store()
+        total = store.count()
+        mood_counts = {mood or 'unknown': count for (mood,), count, _ in store.group_by("$.activity_data.mood")}
         
         # Create mood cards
         mood_colors = {
@@ -3887,7 +7543,7 @@ def show_scene_analytics():
                 <strong>{mood.title()}</strong>: {count} videos
                 <div style="background: rgba(255,255,255,0.3); height: 10px; 
                             border-radius: 5px; margin-top: 5px;">
-                    <div style="background: white; height: 100%; width: {(count/len(st.session_state.processed_videos))*100}%;
+                    <div style="background: white; height: 100%; width: {(count/total)*100}%;
                                 border-radius: 5px;"></div>
                 </div>
             </div>
@@ -3895,42 +7551,27 @@ def show_scene_analytics():
     
     with col2:
         st.markdown("#### ⏰ Activity Timing Patterns")
-        st.caption("When creators post (based on metadata)")
-        
-        # Mock time distribution (you could extract from timestamps)
-        time_slots = {
-            "Morning (6am-12pm)": 4,
-            "Afternoon (12pm-6pm)": 5,
-            "Evening (6pm-12am)": 3
-        }
+        st.caption(f"When creators post (from metadata) - last {TREND_WINDOW_BUCKETS}h vs the {TREND_WINDOW_BUCKETS}h before")
         
-        for time_slot, count in time_slots.items():
-            st.metric(time_slot, f"{count} posts")
+        engine = get_trend_engine()
+        for time_slot, _ in TIME_SLOTS:
+            count, previous = engine.counts("time_slot", time_slot)
+            st.metric(time_slot, f"{count} posts", delta=count - previous)
 
 def show_location_insights():
     """Show location-based analytics"""
     st.markdown("### 🌍 Location Intelligence")
     st.caption("🔬 Twelve Labs understands WHERE activities happen")
     
-    # Gather location data
+    # Gather location data (SQL aggregates, not a pass over every record)
+    cities = campaign_breakdown("$.activity_data.location", "$.metadata.location")
     location_data = {}
-    for video in st.session_state.processed_videos:
-        location = video.get('activity_data', {}).get('location', 'unknown')
-        
-        # Check if metadata exists before accessing it
-        if video.get('metadata'):
-            creator_location = video['metadata'].get('location', 'Unknown City')
-        else:
-            creator_location = 'Unknown City'
-        
-        if location not in location_data:
-            location_data[location] = {
-                'count': 0,
-                'cities': []
-            }
-        
-        location_data[location]['count'] += 1
-        location_data[location]['cities'].append(creator_location)
+    for (location,), count, _ in get_campaign_store().group_by("$.activity_data.location"):
+        location = location or 'unknown'
+        location_data[location] = {
+            'count': count,
+            'cities': [city or 'Unknown City' for city, _ in cities.get(location, [])]
+        }
     
     # Display location cards in a grid
     cols = st.columns(3)
@@ -3958,8 +7599,8 @@ def show_location_insights():
             </div>
             """, unsafe_allow_html=True)
             
-            # Show unique cities
-            unique_cities = list(set(data['cities']))[:3]
+            # Show the most common cities
+            unique_cities = data['cities'][:3]
             if unique_cities:
                 st.caption(f"Cities: {', '.join(unique_cities)}")
 
@@ -3968,33 +7609,23 @@ def show_viral_predictors():
     st.markdown("### 🚀 Viral Prediction Intelligence")
     st.info("🔬 **Twelve Labs Exclusive**: AI predicts viral potential by analyzing hook quality, creativity, and trend alignment")
     
-    # Mock viral scores (in real app, calculate from various factors)
     st.markdown("#### 🌟 Top Viral Candidates")
     
-    viral_candidates = []
-    for video in st.session_state.processed_videos:
-        # Skip videos without metadata
-        if not video.get('metadata'):
-            continue
-            
-        # Calculate mock viral score
-        engagement = video['metadata'].get('engagement_rate', 0)
-        views = video['metadata'].get('views', 0)
-        viral_score = (engagement * 0.6) + (min(views/1000, 10) * 0.4)
-        
-        viral_candidates.append({
-            'video': video,
-            'score': viral_score
-        })
+    # Scores are stored on each video at ingest; the campaign is rescored only when the model changes
+    refresh_viral_scores()
     
+    viral_candidates = [{'video': video, 'score': score}
+                        for video, score in get_leaderboards().top("viral_score", k=3)]
     if not viral_candidates:
         st.info("Process videos with social media metadata to see viral predictions!")
         return
     
-    # Sort by viral score
-    viral_candidates.sort(key=lambda x: x['score'], reverse=True)
+    if viral_candidates[0]['video'].get('viral_model_version') == HEURISTIC_VIRALITY_VERSION:
+        st.caption("Heuristic scores - train a model with `python Tests/train_virality_model.py` for real predictions")
+    else:
+        st.caption(f"Model {viral_candidates[0]['video']['viral_model_version']}")
     
-    for candidate in viral_candidates[:3]:
+    for candidate in viral_candidates:
         video = candidate['video']
         metadata = video['metadata']
         activity_data = video.get('activity_data', {})
@@ -4025,12 +7656,12 @@ def show_creative_stars():
     """Show most creative content creators"""
     st.markdown("#### 🎨 Creative Excellence Awards")
     
-    # Filter for artistic/creative videos WITH metadata
-    creative_videos = [
-        v for v in st.session_state.processed_videos 
-        if v.get('activity_data', {}).get('mood') in ['artistic', 'funny', 'energetic']
+    # First three artistic/creative videos WITH metadata, streamed so the scan stops there
+    creative_videos = list(itertools.islice((
+        v for v in get_campaign_store().iter_records()
+        if (v.get('activity_data') or {}).get('mood') in ['artistic', 'funny', 'energetic']
         and v.get('metadata')  # Add this check!
-    ]
+    ), 3))
     
     if not creative_videos:
         st.info("No creative videos found yet. Keep processing to discover creative stars!")
@@ -4058,22 +7689,14 @@ def show_activity_masters():
     st.markdown("#### 🎯 Activity Masters")
     st.caption("Best creator in each activity category")
     
-    # Group by activity and find top performer
+    # Best engagement on each activity's board
+    leaderboards = get_leaderboards()
     activity_masters = {}
-    
-    for video in st.session_state.processed_videos:
-        # Skip videos without metadata
-        if not video.get('metadata'):
-            continue
-            
-        activity = video.get('activity_data', {}).get('activity', 'unknown')
-        engagement = video.get('metadata', {}).get('engagement_rate', 0)
-        
-        if activity not in activity_masters or engagement > activity_masters[activity]['engagement']:
-            activity_masters[activity] = {
-                'video': video,
-                'engagement': engagement
-            }
+    for group in leaderboards.groups("engagement", "activity:"):
+        top = leaderboards.top("engagement", group, k=1)
+        if top:
+            video, engagement = top[0]
+            activity_masters[group.split(':', 1)[1]] = {'video': video, 'engagement': engagement}
     
     # Check if we have any masters to display
     if not activity_masters:
@@ -4102,41 +7725,29 @@ def show_milk_type_mobs():
     """Show traditional milk type groupings"""
     st.markdown("### 🥛 Classic Milk Categories")
     
-    # Group by milk type
-    milk_groups = {}
-    for video in st.session_state.processed_videos:
-        milk_type = video.get('milk_type', 'Unknown')
-        if milk_type not in milk_groups:
-            milk_groups[milk_type] = []
-        milk_groups[milk_type].append(video)
+    # Group by milk type (counters and one SQL aggregate)
+    creators = campaign_breakdown("$.milk_type", "$.metadata.username", "Unknown")
     
     cols = st.columns(3)
     icons = {"Chocolate": "🍫", "Strawberry": "🍓", "2% Regular": "🥛", "Regular": "🥛"}
     
-    for idx, (milk_type, videos) in enumerate(milk_groups.items()):
+    for idx, (milk_type, count) in enumerate(get_campaign_store().counts_by("milk_type")):
+        milk_type = milk_type or 'Unknown'
         with cols[idx % 3]:
             icon = icons.get(milk_type, "🥛")
             st.markdown(f"### {icon} {milk_type}")
-            st.metric("Members", len(videos))
+            st.metric("Members", count)
             
             # List top creators
             st.markdown("**Top Creators:**")
-            for video in videos[:3]:
-                metadata = video.get('metadata', {})
-                if metadata:
-                    st.caption(f"• {metadata.get('username', 'Unknown')}")
+            for creator, _ in [item for item in creators.get(milk_type, []) if item[0]][:3]:
+                st.caption(f"• {creator}")
 
 def show_creator_leaderboard():
     """Show top creators by engagement"""
     st.markdown("### 🏆 Top Campaign Creators")
     
-    # Sort by engagement
-    creators_with_metadata = [v for v in st.session_state.processed_videos if v.get('metadata')]
-    sorted_creators = sorted(creators_with_metadata, 
-                           key=lambda x: x.get('metadata', {}).get('engagement_rate', 0), 
-                           reverse=True)
-    
-    for rank, video in enumerate(sorted_creators[:10], 1):
+    for rank, (video, _) in enumerate(get_leaderboards().top("engagement", k=10), 1):
         metadata = video.get('metadata', {})
         col1, col2, col3, col4 = st.columns([0.5, 2, 1, 1])
         